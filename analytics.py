@@ -0,0 +1,424 @@
+"""
+Analytics
+Requêtes des panneaux du dashboard, partagées par les endpoints /api/* et /api/dashboard
+"""
+
+import base64
+import binascii
+import json
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import click_sketches
+from click_rollups import RANGE_INTERVALS, rollup_filter
+from timeline import resolve, timeline_query
+
+# exact: first click per link_id from the rollups / approx: merged HyperLogLog sketches
+UNIQUE_MODES = ('exact', 'approx')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def analytics_panel(cur, time_range, campaign_filter):
+    """Overall analytics with time range and campaign filter (read from hourly rollups)"""
+    # Time and campaign filter on the rollup table
+    conditions, params = rollup_filter(time_range, campaign_filter)
+    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    # Total links created (with campaign filter)
+    if campaign_filter:
+        cur.execute('SELECT COUNT(*) as total_links FROM links WHERE campaign = %s', (campaign_filter,))
+    else:
+        cur.execute('SELECT COUNT(*) as total_links FROM links')
+    total_links = cur.fetchone()['total_links']
+
+    # Total clicks and unique links clicked (with time and campaign filter)
+    cur.execute(f'''
+        SELECT COALESCE(SUM(r.click_count), 0)::bigint as total_clicks,
+               COUNT(DISTINCT r.link_id) as unique_clicks
+        FROM click_rollups_hourly r
+        {where_clause}
+    ''', params)
+    totals = cur.fetchone()
+    total_clicks = totals['total_clicks']
+    unique_clicks = totals['unique_clicks']
+
+    # Click rate
+    click_rate = (unique_clicks / total_links * 100) if total_links > 0 else 0
+
+    # Clicks by campaign (with time filter) - campaigns without clicks are
+    # only listed when there is no time filter
+    campaign_join = 'JOIN' if time_range in RANGE_INTERVALS else 'LEFT JOIN'
+    cur.execute(f'''
+        SELECT l.campaign, COALESCE(r.clicks, 0)::bigint as clicks
+        FROM (SELECT DISTINCT campaign FROM links {'WHERE campaign = %s' if campaign_filter else ''}) l
+        {campaign_join} (
+            SELECT r.campaign, SUM(r.click_count) as clicks
+            FROM click_rollups_hourly r
+            {where_clause}
+            GROUP BY r.campaign
+        ) r ON r.campaign = l.campaign
+        ORDER BY clicks DESC
+    ''', ([campaign_filter] if campaign_filter else []) + params)
+    campaigns = cur.fetchall()
+
+    # Recent clicks (with time filter) - raw clicks, newest first via idx_clicks_clicked_at
+    recent_conditions, recent_params = ['NOT c.is_bot'], []
+    if time_range in RANGE_INTERVALS:
+        recent_conditions.append(f"c.clicked_at >= NOW() - INTERVAL '{RANGE_INTERVALS[time_range]}'")
+    if campaign_filter:
+        recent_conditions.append('l.campaign = %s')
+        recent_params.append(campaign_filter)
+    cur.execute(f'''
+        SELECT l.first_name, l.last_name, l.email, l.campaign,
+               c.clicked_at, c.country, c.city
+        FROM clicks c
+        JOIN links l ON c.link_id = l.link_id
+        WHERE {' AND '.join(recent_conditions)}
+        ORDER BY c.clicked_at DESC
+        LIMIT 10
+    ''', recent_params)
+    recent_clicks = cur.fetchall()
+
+    # Top clickers (with time filter) - people who clicked the most
+    cur.execute(f'''
+        SELECT
+            l.first_name,
+            l.last_name,
+            l.email,
+            SUM(r.click_count)::bigint as clicks
+        FROM click_rollups_hourly r
+        JOIN links l ON r.link_id = l.link_id
+        {where_clause}
+        GROUP BY l.first_name, l.last_name, l.email
+        ORDER BY clicks DESC
+        LIMIT 10
+    ''', params)
+    geo_data = cur.fetchall()
+
+    return {
+        'total_links': total_links,
+        'total_clicks': total_clicks,
+        'unique_clicks': unique_clicks,
+        'click_rate': round(click_rate, 2),
+        'campaigns': campaigns,
+        'recent_clicks': recent_clicks,
+        'geo_data': geo_data
+    }
+
+
+def encode_cursor(row):
+    """Opaque /api/clicks cursor pointing just after `row`"""
+    key = [row['click_count'], row['created_at'].isoformat(), row['link_id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(click_count, created_at, link_id) from a cursor - raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        click_count, created_at, link_id = json.loads(raw)
+        return int(click_count), datetime.fromisoformat(created_at), str(link_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def clicks_panel(cur, campaign, page, per_page, search, status_filter, cursor=None, total_mode=None):
+    """Detailed click data with person info - keyset pagination and filtering
+
+    Links are ordered by (click_count, created_at, link_id), all descending.
+    With a `cursor` (the `next_cursor` of the previous page) the page starts
+    right after that key, so every page costs the same; without one, `page`
+    is applied as an OFFSET (page 1, or jumping straight to a page).
+    Click counts and first/last click times are the counters kept on links,
+    so a page is an index scan on idx_links_campaign_click_count.
+
+    total_mode: 'exact' (one COUNT), 'approx' (planner estimate) or 'none';
+    by default exact on the first request and none once a cursor is used.
+    Raises ValueError on a malformed cursor.
+    """
+    if total_mode not in ('exact', 'approx', 'none'):
+        total_mode = 'none' if cursor else 'exact'
+
+    # Build WHERE conditions
+    conditions = []
+    params = []
+
+    if campaign:
+        conditions.append('l.campaign = %s')
+        params.append(campaign)
+
+    if search:
+        search_condition = "(l.first_name ILIKE %s OR l.last_name ILIKE %s OR l.email ILIKE %s)"
+        conditions.append(search_condition)
+        search_param = f'%{search}%'
+        params.extend([search_param, search_param, search_param])
+
+    ranked = f'''
+        WITH ranked AS (
+            SELECT
+                l.link_id,
+                l.first_name,
+                l.last_name,
+                l.email,
+                l.icp,
+                l.campaign,
+                l.company_name,
+                l.company_url,
+                l.linkedin_url,
+                l.created_at,
+                l.click_count,
+                l.last_clicked_at as last_clicked,
+                l.first_clicked_at as first_clicked
+            FROM links l
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        )
+    '''
+
+    # Status filter on the click counter
+    status_conditions = []
+    if status_filter == 'clicked':
+        status_conditions.append('click_count > 0')
+    elif status_filter == 'not_clicked':
+        status_conditions.append('click_count = 0')
+
+    # Total (the pagination count is no longer recomputed for every page)
+    total = None
+    filtered = f"SELECT * FROM ranked {'WHERE ' + ' AND '.join(status_conditions) if status_conditions else ''}"
+    if total_mode == 'exact':
+        cur.execute(ranked + f'SELECT COUNT(*) as total FROM ({filtered}) f', params)
+        total = cur.fetchone()['total']
+    elif total_mode == 'approx':
+        cur.execute('EXPLAIN (FORMAT JSON) ' + ranked + filtered, params)
+        total = int(cur.fetchone()['QUERY PLAN'][0]['Plan']['Plan Rows'])
+
+    page_conditions, page_params = list(status_conditions), []
+    offset = 0
+    if cursor:
+        page_conditions.append('(click_count, created_at, link_id) < (%s, %s, %s)')
+        page_params.extend(decode_cursor(cursor))
+    else:
+        offset = (page - 1) * per_page
+
+    # One row more than requested tells whether there is a next page
+    cur.execute(ranked + f'''
+        SELECT * FROM ranked
+        {'WHERE ' + ' AND '.join(page_conditions) if page_conditions else ''}
+        ORDER BY click_count DESC, created_at DESC, link_id DESC
+        LIMIT {per_page + 1} OFFSET {offset}
+    ''', params + page_params)
+    clicks = cur.fetchall()
+
+    has_next = len(clicks) > per_page
+    clicks = clicks[:per_page]
+
+    return {
+        'data': clicks,
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_approximate': total_mode == 'approx',
+            'total_pages': (total + per_page - 1) // per_page if total is not None else None,  # Ceiling division
+            'has_next': has_next,
+            'has_prev': bool(cursor) or page > 1,
+            'next_cursor': encode_cursor(clicks[-1]) if has_next else None
+        }
+    }
+
+
+def campaigns_panel(cur):
+    """List of all campaigns"""
+    cur.execute('SELECT DISTINCT campaign FROM links ORDER BY campaign')
+    campaigns = cur.fetchall()
+
+    return [c['campaign'] for c in campaigns]
+
+
+def icp_stats_panel(cur, time_range, campaign_filter):
+    """ICP distribution for links that have been clicked"""
+    conditions, params = rollup_filter(time_range, campaign_filter)
+    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    # Get ICP distribution for clicked links only
+    cur.execute(f'''
+        SELECT
+            COALESCE(NULLIF(l.icp, ''), 'Non défini') as icp,
+            COUNT(DISTINCT l.link_id) as click_count
+        FROM click_rollups_hourly r
+        JOIN links l ON l.link_id = r.link_id
+        {where_clause}
+        GROUP BY 1
+        ORDER BY click_count DESC
+    ''', params)
+    icp_stats = cur.fetchall()
+
+    return icp_stats
+
+
+def check_unique_options(mode, unique_by):
+    """Raise ValueError for an unknown unique visitors mode / key"""
+    if mode not in UNIQUE_MODES:
+        raise ValueError(f"Invalid mode '{mode}' (expected one of: {', '.join(UNIQUE_MODES)})")
+    if unique_by not in click_sketches.KINDS:
+        raise ValueError(f"Invalid unique_by '{unique_by}' (expected one of: {', '.join(click_sketches.KINDS)})")
+    if unique_by != 'link' and mode == 'exact':
+        raise ValueError(f"unique_by={unique_by} is only available with mode=approx")
+
+
+def heatmap_panel(cur, time_range, campaign_filter, mode='exact', unique_by='link'):
+    """Click heatmap by day of week and hour (unique visitors only)"""
+    check_unique_options(mode, unique_by)
+    if mode == 'approx':
+        # New visitors per hour from the sketches, summed into (day of week, hour) cells
+        since = None
+        if time_range in RANGE_INTERVALS:
+            since = f"date_trunc('hour', NOW() - INTERVAL '{RANGE_INTERVALS[time_range]}')"
+        new_visitors = click_sketches.first_seen(cur, 's.bucket_hour', since, campaign_filter, unique_by)
+        cells = {}
+        for hour, visitors in new_visitors.items():
+            if visitors:
+                key = (hour.isoweekday() % 7, hour.hour)  # 0 = Sunday, like EXTRACT(DOW)
+                cells[key] = cells.get(key, 0) + visitors
+        return [
+            {'day_of_week': day_of_week, 'hour': hour, 'click_count': visitors}
+            for (day_of_week, hour), visitors in sorted(cells.items())
+        ]
+
+    # New visitors: links whose first click ever falls in the time period
+    conditions, params = [], []
+    if time_range in RANGE_INTERVALS:
+        conditions.append(f"f.clicked_at >= NOW() - INTERVAL '{RANGE_INTERVALS[time_range]}'")
+    if campaign_filter:
+        conditions.append('f.campaign = %s')
+        params.append(campaign_filter)
+
+    cur.execute(f'''
+        SELECT
+            EXTRACT(DOW FROM f.clicked_at) as day_of_week,
+            EXTRACT(HOUR FROM f.clicked_at) as hour,
+            COUNT(*) as click_count
+        FROM first_clicks f
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        GROUP BY day_of_week, hour
+        ORDER BY day_of_week, hour
+    ''', params)
+    heatmap_data = cur.fetchall()
+
+    return heatmap_data
+
+
+def timeline_panel(cur, time_range, campaign_filter, bucket=None, mode='exact', unique_by='link'):
+    """Clicks timeline for chart (unique visitors only) - raises ValueError on a bad bucket
+
+    Sketches are hourly: buckets shorter than an hour are always exact.
+    """
+    check_unique_options(mode, unique_by)
+    start_interval, bucket_size = resolve(time_range, bucket)
+    if mode == 'exact' or not bucket_size.from_rollups:
+        if unique_by != 'link':
+            raise ValueError(f"unique_by={unique_by} needs buckets of whole hours")
+        query, params = timeline_query(time_range, bucket, campaign_filter)
+        cur.execute(query, params)
+        return cur.fetchall()
+
+    query, params = timeline_query(time_range, bucket, campaign_filter, with_uniques=False)
+    cur.execute(query, params)
+    timeline_data = cur.fetchall()
+    new_visitors = click_sketches.first_seen(
+        cur, bucket_size.sql('s.bucket_hour'),
+        f"date_trunc('hour', LOCALTIMESTAMP - INTERVAL '{start_interval}')", campaign_filter, unique_by)
+    for row in timeline_data:
+        row['unique_visitors'] = new_visitors.get(row.pop('period_start'), 0)
+    return timeline_data
+
+
+def _get_executor(parallelism):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(parallelism - 1, 1), thread_name_prefix='dashboard')
+        return _executor
+
+
+def _drain(cur, pending, results):
+    """Run queued panels on this cursor until none are left"""
+    while True:
+        try:
+            name, fn, args = pending.popleft()
+        except IndexError:
+            return
+        results[name] = fn(cur, *args)
+
+
+def _follow(get_connection, snapshot_id, timeout, pending, results):
+    """Import the leader's snapshot on another pooled connection and help drain the panels"""
+    try:
+        conn = get_connection(timeout=timeout)
+    except psycopg2.Error:
+        return  # pool busy: the leader runs the remaining panels itself
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            cur.execute('SET TRANSACTION SNAPSHOT %s', (snapshot_id,))
+        except psycopg2.Error as e:
+            print(f"⚠️  Dashboard snapshot import failed: {e}")
+            return
+        _drain(cur, pending, results)
+        cur.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def run_panels(get_connection, panels, parallelism=3, follower_timeout=0.2):
+    """Compute {name: (fn, args)} panels over one consistent database snapshot
+
+    The leader connection opens a REPEATABLE READ, READ ONLY transaction and
+    exports its snapshot; up to `parallelism - 1` follower connections import
+    it, so every panel sees exactly the same data whichever connection runs
+    it. Followers that cannot get a pooled connection within
+    `follower_timeout` seconds are skipped and the leader runs their share;
+    so are followers still queued in the shared executor (behind another
+    dashboard) when the leader is done - they are cancelled, not awaited.
+    Returns (results, generated_at). A panel exception is re-raised.
+    """
+    pending = deque((name, fn, args) for name, (fn, args) in panels.items())
+    results = {}
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cur.execute('SELECT pg_export_snapshot() as snapshot_id, NOW() as generated_at')
+        snapshot = cur.fetchone()
+
+        followers = min(parallelism, len(panels)) - 1
+        futures = []
+        if followers > 0:
+            executor = _get_executor(parallelism)
+            futures = [
+                executor.submit(_follow, get_connection, snapshot['snapshot_id'], follower_timeout, pending, results)
+                for _ in range(followers)
+            ]
+        try:
+            _drain(cur, pending, results)
+        finally:
+            # The exported snapshot only lives as long as the leader transaction:
+            # wait for running followers, drop the ones that never started
+            for future in futures:
+                if not future.cancel():
+                    future.result()
+        cur.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+    return results, snapshot['generated_at']
@@ -1,13 +1,35 @@
-from flask import Flask, request, jsonify, redirect, render_template_string, session, url_for
+from flask import Flask, request, jsonify, redirect, render_template_string, session, url_for, g, has_request_context
 from flask_cors import CORS
-from functools import wraps
+from functools import partial, wraps
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import hashlib
 import secrets
+import threading
+import time
+import atexit
 from datetime import datetime
 import requests
+import analytics
+import bulk_links
+import click_sketches
+import hll
+import migrations
+from bot_filter import BotFilter
+from click_buffer import ClickBuffer
+from clay_delivery import ClayDelivery
+import clay_outbox
+from clay_outbox import ClayDispatcher, enqueue_hot_leads, hot_lead_payload
+from click_spool import ClickSpool
+from db_pool import ConnectionPool
+from first_clicks import record_countries
+from geolocation import GeoCache, GeoDatabase, GeoEnricher
+from link_filter import LinkFilter
+from response_cache import ResponseCache, bump_versions
+from short_ids import ShortIdAllocator
+from timeline import resolve, timeline_query
+from ttl_cache import TTLCache
 
 app = Flask(__name__)
 CORS(app)
@@ -27,6 +49,21 @@ AUTHORIZED_USERS = {
 # Database configuration
 DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
 
+# One pool per worker process, sized by gunicorn_config.py (workers x threads)
+db_pool = ConnectionPool.from_env(DATABASE_URL)
+
+# Deadline for the link lookup on a /c/<link_id> cache miss
+REDIRECT_DB_TIMEOUT = float(os.environ.get('REDIRECT_DB_TIMEOUT', 2.0))
+
+# Unique visitors of the heatmap and timeline: approx (HyperLogLog sketches) or exact
+UNIQUE_VISITORS_MODE = os.environ.get('UNIQUE_VISITORS_MODE', 'approx')
+
+# Seconds between two attempts of a worker to roll the cumulative sketches forward
+SKETCH_ADVANCE_INTERVAL = float(os.environ.get('SKETCH_ADVANCE_INTERVAL', 3600))
+
+# Connections used in parallel by /api/dashboard (1 = sequential on one connection)
+DASHBOARD_PARALLELISM = int(os.environ.get('DASHBOARD_PARALLELISM', 3))
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -36,84 +73,78 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def get_db_connection():
-    """Create database connection"""
-    conn = psycopg2.connect(DATABASE_URL)
+def get_db_connection(timeout=None):
+    """Borrow a pooled database connection - conn.close() returns it to the pool"""
+    conn = db_pool.getconn(timeout)
+    if has_request_context():
+        g.setdefault('db_connections', []).append((conn, conn._lease))
     return conn
 
-def ensure_tables_exist():
-    """Ensure database tables exist, create them if they don't"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+@app.teardown_request
+def release_db_connections(exc=None):
+    """Return connections a handler forgot to close (e.g. after an exception)
+
+    Releases by lease: a connection the handler already closed, and that
+    another request may have borrowed since, is left alone.
+    """
+    for conn, lease in g.pop('db_connections', []):
+        db_pool.putconn(conn, lease)
 
-        # Check if tables exist
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'links'
-            )
-        """)
+# Per-worker cache of link_id -> destination_url for /c/<link_id>
+link_cache = TTLCache(
+    maxsize=int(os.environ.get('LINK_CACHE_SIZE', 100000)),
+    ttl=int(os.environ.get('LINK_CACHE_TTL', 600))
+)
 
-        if not cur.fetchone()[0]:
-            # Tables don't exist, create them
-            init_db()
+# Per-worker Bloom filter of existing link_ids (negative lookups for /c/<link_id>)
+link_filter = LinkFilter.from_env(get_db_connection)
 
+# Link previews, email security scanners and bursts: tagged (or dropped) before the click is written
+bot_filter = BotFilter.from_env()
+
+def warm_link_cache(limit):
+    """Preload the most recently created links into the link cache"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute('SELECT link_id, destination_url FROM links ORDER BY created_at DESC LIMIT %s', (limit,))
+        for link_id, destination_url in cur.fetchall():
+            link_cache.set(link_id, destination_url)
         cur.close()
         conn.close()
+        print(f"🔗 Link cache warmed with {len(link_cache)} links")
     except Exception as e:
-        print(f"Error checking/creating tables: {e}")
+        print(f"Error warming link cache: {e}")
+
+def build_short_url(link_id, campaign):
+    """Public short URL of a link (custom domain chosen from the campaign)"""
+    # Support for multiple custom domains via environment variables
+    if 'wesser' in campaign.lower():
+        # Use Wesser custom domain
+        custom_domain = os.getenv('WESSER_DOMAIN', os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com'))
+    elif 'aura' in campaign.lower():
+        # Use Aura custom domain
+        custom_domain = os.getenv('AURA_DOMAIN', os.getenv('CUSTOM_DOMAIN', 'agence.aura.camp'))
+    else:
+        # Default domain
+        custom_domain = os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com')
 
-def init_db():
-    """Initialize database tables"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    return f"https://{custom_domain}/c/{link_id}"
 
-    # Links table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS links (
-            id SERIAL PRIMARY KEY,
-            link_id VARCHAR(10) UNIQUE NOT NULL,
-            first_name VARCHAR(255),
-            last_name VARCHAR(255),
-            email VARCHAR(255),
-            icp VARCHAR(255),
-            campaign VARCHAR(255),
-            company_name VARCHAR(255),
-            company_url TEXT,
-            linkedin_url TEXT,
-            destination_url TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            sent_to_clay BOOLEAN DEFAULT FALSE,
-            sent_to_clay_at TIMESTAMP
-        )
-    ''')
-
-    # Clicks table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS clicks (
-            id SERIAL PRIMARY KEY,
-            link_id VARCHAR(10) NOT NULL,
-            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            ip_address VARCHAR(45),
-            user_agent TEXT,
-            country VARCHAR(100),
-            city VARCHAR(100),
-            referer TEXT,
-            FOREIGN KEY (link_id) REFERENCES links(link_id)
-        )
-    ''')
+# Per-worker allocator of link_ids (sequence blocks + keyed permutation)
+short_id_allocator = ShortIdAllocator.from_env(get_db_connection)
 
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def generate_short_id():
+def generate_short_id(cur=None):
     """Generate a unique short ID for links"""
-    return secrets.token_urlsafe(6)[:8]
+    return short_id_allocator.allocate(1, cur)[0]
+
+# Offline IP range database (GEOIP_DB_PATH), hot-reloaded when the file changes
+geo_database = GeoDatabase.from_env()
 
 def get_geo_info(ip):
-    """Get geolocation info from IP address"""
+    """Get geolocation info from IP address (local database if configured, else ip-api.com)"""
+    if geo_database is not None:
+        return geo_database.lookup(ip)
     try:
         response = requests.get(f'http://ip-api.com/json/{ip}', timeout=2)
         if response.status_code == 200:
@@ -123,6 +154,104 @@ def get_geo_info(ip):
         pass
     return 'Unknown', 'Unknown'
 
+# Per-worker cache in front of get_geo_info (exact IP, then /24 or /48 network)
+geo_cache = GeoCache.from_env(get_geo_info)
+geo_enricher = GeoEnricher.from_env(geo_cache.lookup, get_db_connection, on_write=record_countries)
+
+# Clay webhook sender (concurrency, per-host rate limit, retries)
+clay_delivery = ClayDelivery.from_env()
+
+# Sends the hot-lead events queued in clay_outbox by click flushes (CLAY_WEBHOOK_URL)
+clay_dispatcher = ClayDispatcher.from_env(get_db_connection, clay_delivery)
+
+# Per-worker cache of analytics responses, versioned per campaign across workers (cache_versions)
+response_cache = ResponseCache.from_env(get_db_connection)
+
+def cached_response(f=None, *, all_campaigns=False):
+    """Serve a GET endpoint from the response cache, with ETag/Last-Modified (304 when unchanged)
+
+    Entries are validated against the version of the `campaign` filter, or
+    against the version of all campaigns when the response also has panels
+    over every campaign (all_campaigns=True)
+    """
+    if f is None:
+        return partial(cached_response, all_campaigns=all_campaigns)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        campaign = '' if all_campaigns else request.args.get('campaign', '')
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entry = response_cache.get(key, campaign)
+        if entry is None:
+            # Read the version first: clicks written while the queries run make the entry stale
+            version = response_cache.version(campaign)
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = response_cache.set(key, version, response.get_data())
+
+        response = app.response_class(entry.body, mimetype='application/json')
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True  # always revalidate
+        response.make_conditional(request)
+        if response.status_code == 304:
+            response_cache.not_modified += 1
+        return response
+    return decorated_function
+
+_sketches_advanced_at = 0.0
+_sketches_advance_lock = threading.Lock()
+
+def advance_sketches():
+    """Fold the hourly sketches older than the longest range into the cumulative ones (approx unique visitors)"""
+    try:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            through = click_sketches.advance_cumulative(cur)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        if through is not None:
+            print(f"📈 Cumulative click sketches advanced to {through:%Y-%m-%d}")
+    except Exception as e:
+        print(f"⚠️  Cumulative click sketches advance failed: {e}")
+
+def schedule_sketch_advance():
+    # Own thread: the first advance reads the whole sketch history
+    global _sketches_advanced_at
+    with _sketches_advance_lock:
+        if time.monotonic() - _sketches_advanced_at < SKETCH_ADVANCE_INTERVAL:
+            return
+        _sketches_advanced_at = time.monotonic()
+    threading.Thread(target=advance_sketches, name='sketch-advance', daemon=True).start()
+
+def on_clicks_flushed(rows, campaigns):
+    """Queue freshly inserted human clicks for geolocation, invalidate the cached analytics, start the background threads"""
+    response_cache.invalidate(campaigns)
+    clay_dispatcher.ensure_started()
+    schedule_sketch_advance()
+    geo_enricher.ensure_started()  # also sweeps clicks a previous worker left without geo
+    for click_id, _link_id, ip_address, _clicked_at in rows:
+        geo_enricher.submit(click_id, ip_address)
+
+# Write-behind buffer: clicks are inserted in batches off the request path,
+# and spooled to local disk when the database can't take them in time
+click_spool = ClickSpool.from_env()
+click_buffer = ClickBuffer.from_env(get_db_connection, on_flushed=on_clicks_flushed, spool=click_spool,
+                                   hold=bot_filter.burst_hold)
+
+def shutdown(timeout=None):
+    """Flush buffered clicks before the worker exits (called from gunicorn worker_exit)"""
+    written = click_buffer.close(timeout)
+    if written:
+        print(f"💾 Flushed {written} buffered clicks on shutdown")
+    clay_dispatcher.stop(timeout=5)
+
+atexit.register(shutdown)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page"""
@@ -198,19 +327,42 @@ def index():
 @app.route('/api/version')
 def get_version():
     """Get API version to verify deployment"""
+    unique_visitors = (
+        f"HyperLogLog sketches per campaign and hour, ±{hll.HyperLogLog(hll.DEFAULT_PRECISION).relative_error:.1%} (mode=approx)"
+        if UNIQUE_VISITORS_MODE == 'approx' else 'First click per link_id (mode=exact)'
+    )
     return jsonify({
-        'version': '2.0-unique-visitors',
-        'heatmap': 'Uses DISTINCT ON ip_address for unique visitors',
-        'timeline': 'Uses DISTINCT ON ip_address for unique visitors',
+        'version': '2.1-hll-unique-visitors' if UNIQUE_VISITORS_MODE == 'approx' else '2.0-unique-visitors',
+        'heatmap': f'Unique visitors counted at their first click in the period: {unique_visitors}',
+        'timeline': f'Unique visitors counted at their first click in the period: {unique_visitors}',
+        'unique_visitors_mode': UNIQUE_VISITORS_MODE,
+        'hll_precision': hll.DEFAULT_PRECISION,
         'deployed_at': datetime.now().isoformat()
     })
 
+@app.route('/api/metrics')
+def get_metrics():
+    """Runtime metrics for this worker process"""
+    return jsonify({
+        'pid': os.getpid(),
+        'db_pool': db_pool.stats(),
+        'geo_enricher': geo_enricher.stats(),
+        'geo_cache': geo_cache.stats(),
+        'link_cache': link_cache.stats(),
+        'link_filter': link_filter.stats(),
+        'bot_filter': bot_filter.stats(),
+        'response_cache': response_cache.stats(),
+        'short_ids': short_id_allocator.stats(),
+        'clay_delivery': clay_delivery.stats(),
+        'clay_outbox': clay_dispatcher.stats(),
+        'click_buffer': click_buffer.stats(),
+        'click_spool': click_spool.stats(),
+        'geo_database': geo_database.stats() if geo_database is not None else None
+    })
+
 @app.route('/api/create-link', methods=['POST'])
 def create_link():
     """Create a new tracked link - Called from Clay"""
-    # Ensure tables exist on first request
-    ensure_tables_exist()
-
     data = request.json
 
     # Validate required fields
@@ -227,35 +379,28 @@ def create_link():
     linkedin_url = data.get('linkedin_url', '')
     destination_url = data.get('destination_url')
 
-    # Generate unique link ID
-    link_id = generate_short_id()
-
     # Store in database
     conn = get_db_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute('''
-            INSERT INTO links (link_id, first_name, last_name, email, icp, campaign, company_name, company_url, linkedin_url, destination_url)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (link_id, first_name, last_name, email, icp, campaign, company_name, company_url, linkedin_url, destination_url))
-
+        # Allocated IDs are unique; only a legacy random ID can already hold one
+        inserted = False
+        while not inserted:
+            link_id = generate_short_id(cur)
+            cur.execute('''
+                INSERT INTO links (link_id, first_name, last_name, email, icp, campaign, company_name, company_url, linkedin_url, destination_url)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (link_id) DO NOTHING
+            ''', (link_id, first_name, last_name, email, icp, campaign, company_name, company_url, linkedin_url, destination_url))
+            inserted = cur.rowcount == 1
+
+        bump_versions(cur, [campaign])
         conn.commit()
+        link_filter.add(link_id)
+        response_cache.invalidate([campaign])
 
-        # Determine domain based on campaign
-        # Support for multiple custom domains via environment variables
-        if 'wesser' in campaign.lower():
-            # Use Wesser custom domain
-            custom_domain = os.getenv('WESSER_DOMAIN', os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com'))
-        elif 'aura' in campaign.lower():
-            # Use Aura custom domain
-            custom_domain = os.getenv('AURA_DOMAIN', os.getenv('CUSTOM_DOMAIN', 'agence.aura.camp'))
-        else:
-            # Default domain
-            custom_domain = os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com')
-
-        base_url = f"https://{custom_domain}"
-        short_url = f"{base_url}/c/{link_id}"
+        short_url = build_short_url(link_id, campaign)
 
         return jsonify({
             'success': True,
@@ -270,297 +415,182 @@ def create_link():
         cur.close()
         conn.close()
 
-@app.route('/c/<link_id>')
-def redirect_link(link_id):
-    """Redirect short link and track the click"""
+@app.route('/api/create-links/bulk', methods=['POST'])
+def create_links_bulk():
+    """Create many tracked links in one request - Clay table pushes
+
+    Body: JSON array of create-link objects, or NDJSON (one object per line,
+    Content-Type: application/x-ndjson). Rows are inserted by chunks of
+    BULK_CHUNK_SIZE, one multi-row statement and commit per chunk; results
+    come back in input order, with an error for each rejected row.
+    """
+    results = []
+    chunk = []  # (result index, row values)
+    created = 0
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Get link info
-    cur.execute('SELECT * FROM links WHERE link_id = %s', (link_id,))
-    link = cur.fetchone()
+    cur = conn.cursor()
 
-    if not link:
+    def flush():
+        nonlocal created
+        link_ids = bulk_links.insert_links(cur, [values for _i, values in chunk], short_id_allocator.allocate)
+        bump_versions(cur, {values[bulk_links.CAMPAIGN] for _i, values in chunk})
+        conn.commit()
+        campaigns = set()
+        for (i, values), link_id in zip(chunk, link_ids):
+            if isinstance(link_id, Exception):
+                results[i] = {'index': i, 'error': str(link_id)}
+                continue
+            campaign = values[bulk_links.CAMPAIGN]
+            link_filter.add(link_id)
+            campaigns.add(campaign)
+            results[i] = {'index': i, 'link_id': link_id, 'short_url': build_short_url(link_id, campaign)}
+            created += 1
+        response_cache.invalidate(campaigns)
+        chunk.clear()
+
+    too_many = False
+    try:
+        for data, error in bulk_links.iter_rows(request):
+            i = len(results)
+            if i >= bulk_links.BULK_MAX_ROWS:
+                # Rows read so far are still created and reported
+                too_many = True
+                break
+            results.append(None)
+            if error is None:
+                try:
+                    chunk.append((i, bulk_links.link_row(data)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                results[i] = {'index': i, 'error': error}
+            if len(chunk) >= bulk_links.BULK_CHUNK_SIZE:
+                flush()
+        if chunk:
+            flush()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e), 'created': created, 'results': [r for r in results if r]}), 500
+    finally:
         cur.close()
         conn.close()
-        return "Link not found", 404
 
-    # Track the click
+    if too_many:
+        return jsonify({
+            'error': f'Too many rows (max {bulk_links.BULK_MAX_ROWS} per request), the remaining rows were not read',
+            'created': created,
+            'results': results
+        }), 413
+
+    failed = len(results) - created
+    return jsonify({
+        'success': failed == 0,
+        'created': created,
+        'failed': failed,
+        'results': results
+    }), 201 if failed == 0 else 207
+
+@app.route('/c/<link_id>')
+def redirect_link(link_id):
+    """Redirect short link and track the click"""
+    # Get link info (most redirects are served from the worker cache)
+    destination_url = link_cache.get(link_id)
+    if destination_url is None:
+        # Definitely-unknown codes (scanners, typos) are rejected without a query
+        if not link_filter.might_exist(link_id):
+            return "Link not found", 404
+        try:
+            conn = get_db_connection(timeout=REDIRECT_DB_TIMEOUT)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute('SET LOCAL statement_timeout = %s', (int(REDIRECT_DB_TIMEOUT * 1000),))
+            cur.execute('SELECT destination_url FROM links WHERE link_id = %s', (link_id,))
+            link = cur.fetchone()
+            cur.close()
+            conn.close()
+        except psycopg2.Error as e:
+            print(f"Error resolving link {link_id}: {e}")
+            return "Service temporarily unavailable, please retry in a moment", 503
+
+        if not link:
+            link_filter.record_false_positive()
+            return "Link not found", 404
+
+        destination_url = link['destination_url']
+        link_cache.set(link_id, destination_url)
+
+    # Track the click - written to the database in batches by the click buffer
+    # (or to the local spool if the database is slow or down)
     ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
     user_agent = request.headers.get('User-Agent', '')
     referer = request.headers.get('Referer', '')
-
-    # Get geolocation
-    country, city = get_geo_info(ip_address)
-
-    cur.execute('''
-        INSERT INTO clicks (link_id, ip_address, user_agent, country, city, referer)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    ''', (link_id, ip_address, user_agent, country, city, referer))
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    bot_reason = bot_filter.classify(link_id, ip_address, user_agent)
+    if bot_reason == 'burst':
+        # The first hits of the burst are still held by the buffer: they are bots too
+        click_buffer.tag_recent(link_id, time.time() - bot_filter.burst_window, bot_reason)
+    if bot_reason is None or bot_filter.mode != 'drop':
+        click_buffer.add(link_id, ip_address, user_agent, referer, bot_reason=bot_reason)
 
     # Redirect to destination
-    return redirect(link['destination_url'])
+    return redirect(destination_url)
 
 @app.route('/api/analytics')
+@cached_response
 def get_analytics():
-    """Get overall analytics with time range and campaign filter"""
+    """Get overall analytics with time range and campaign filter (read from hourly rollups)"""
     time_range = request.args.get('range', 'all')  # 24h, 7d, 30d, all
     campaign_filter = request.args.get('campaign', '')
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Build time filter for clicks
-    time_filter = ""
-    if time_range == '24h':
-        time_filter = "WHERE c.clicked_at >= NOW() - INTERVAL '24 hours'"
-    elif time_range == '7d':
-        time_filter = "WHERE c.clicked_at >= NOW() - INTERVAL '7 days'"
-    elif time_range == '30d':
-        time_filter = "WHERE c.clicked_at >= NOW() - INTERVAL '30 days'"
-
-    # Add campaign filter
-    if campaign_filter:
-        if time_filter:
-            time_filter += f" AND l.campaign = '{campaign_filter}'"
-        else:
-            time_filter = f"WHERE l.campaign = '{campaign_filter}'"
-
-    # Total links created (with campaign filter)
-    if campaign_filter:
-        cur.execute(f"SELECT COUNT(*) as total_links FROM links WHERE campaign = '{campaign_filter}'")
-    else:
-        cur.execute('SELECT COUNT(*) as total_links FROM links')
-    total_links = cur.fetchone()['total_links']
-
-    # Total clicks (with time and campaign filter)
-    if time_filter:
-        cur.execute(f'SELECT COUNT(*) as total_clicks FROM clicks c JOIN links l ON c.link_id = l.link_id {time_filter}')
-    else:
-        cur.execute('SELECT COUNT(*) as total_clicks FROM clicks')
-    total_clicks = cur.fetchone()['total_clicks']
-
-    # Unique links clicked (with time and campaign filter)
-    if time_filter:
-        cur.execute(f'SELECT COUNT(DISTINCT c.link_id) as unique_clicks FROM clicks c JOIN links l ON c.link_id = l.link_id {time_filter}')
-    else:
-        cur.execute('SELECT COUNT(DISTINCT link_id) as unique_clicks FROM clicks')
-    unique_clicks = cur.fetchone()['unique_clicks']
-
-    # Click rate
-    click_rate = (unique_clicks / total_links * 100) if total_links > 0 else 0
-
-    # Clicks by campaign (with time filter) - need to adjust time_filter for this query
-    campaign_time_filter = time_filter.replace('WHERE c.', 'WHERE ').replace('c.clicked_at', 'c.clicked_at') if time_filter and 'WHERE c.' in time_filter else time_filter
-    cur.execute(f'''
-        SELECT l.campaign, COUNT(c.id) as clicks
-        FROM links l
-        LEFT JOIN clicks c ON l.link_id = c.link_id
-        {campaign_time_filter}
-        GROUP BY l.campaign
-        ORDER BY clicks DESC
-    ''')
-    campaigns = cur.fetchall()
-
-    # Recent clicks (with time filter)
-    cur.execute(f'''
-        SELECT l.first_name, l.last_name, l.email, l.campaign,
-               c.clicked_at, c.country, c.city
-        FROM clicks c
-        JOIN links l ON c.link_id = l.link_id
-        {time_filter}
-        ORDER BY c.clicked_at DESC
-        LIMIT 10
-    ''')
-    recent_clicks = cur.fetchall()
-
-    # Top clickers (with time filter) - people who clicked the most
-    top_clickers_query = '''
-        SELECT
-            l.first_name,
-            l.last_name,
-            l.email,
-            COUNT(c.id) as clicks
-        FROM clicks c
-        JOIN links l ON c.link_id = l.link_id
-    '''
-    if campaign_filter and time_filter:
-        top_clickers_query += f" WHERE l.campaign = '{campaign_filter}' AND {time_filter.replace('WHERE ', '')}"
-    elif campaign_filter:
-        top_clickers_query += f" WHERE l.campaign = '{campaign_filter}'"
-    elif time_filter:
-        top_clickers_query += f" {time_filter}"
-
-    top_clickers_query += '''
-        GROUP BY l.first_name, l.last_name, l.email
-        ORDER BY clicks DESC
-        LIMIT 10
-    '''
-
-    cur.execute(top_clickers_query)
-    geo_data = cur.fetchall()
-
+    data = analytics.analytics_panel(cur, time_range, campaign_filter)
     cur.close()
     conn.close()
 
-    return jsonify({
-        'total_links': total_links,
-        'total_clicks': total_clicks,
-        'unique_clicks': unique_clicks,
-        'click_rate': round(click_rate, 2),
-        'campaigns': campaigns,
-        'recent_clicks': recent_clicks,
-        'geo_data': geo_data
-    })
+    return jsonify(data)
 
 @app.route('/api/clicks')
 def get_clicks():
-    """Get detailed click data with person info - with pagination and filtering"""
+    """Get detailed click data with person info - with pagination and filtering
+
+    Pass the `next_cursor` of a page as `cursor` to get the next one (keyset
+    pagination); `page` still works for jumping to a page. `total` is
+    exact, approx or none (default: exact without a cursor, none with one).
+    """
     campaign = request.args.get('campaign', '')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 50))
     search = request.args.get('search', '')
     status_filter = request.args.get('status', 'all')  # all, clicked, not_clicked
+    cursor = request.args.get('cursor')
+    total_mode = request.args.get('total')  # exact, approx, none
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        data = analytics.clicks_panel(cur, campaign, page, per_page, search, status_filter, cursor, total_mode)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        cur.close()
+        conn.close()
 
-    # Base query
-    query = '''
-        SELECT
-            l.link_id,
-            l.first_name,
-            l.last_name,
-            l.email,
-            l.icp,
-            l.campaign,
-            l.company_name,
-            l.company_url,
-            l.linkedin_url,
-            l.created_at,
-            COUNT(c.id) as click_count,
-            MAX(c.clicked_at) as last_clicked,
-            MIN(c.clicked_at) as first_clicked
-        FROM links l
-        LEFT JOIN clicks c ON l.link_id = c.link_id
-    '''
-
-    # Count query for pagination
-    count_query = '''
-        SELECT COUNT(DISTINCT l.link_id) as total
-        FROM links l
-        LEFT JOIN clicks c ON l.link_id = c.link_id
-    '''
-
-    # Build WHERE conditions
-    conditions = []
-    params = []
-
-    if campaign:
-        conditions.append('l.campaign = %s')
-        params.append(campaign)
-
-    if search:
-        search_condition = "(l.first_name ILIKE %s OR l.last_name ILIKE %s OR l.email ILIKE %s)"
-        conditions.append(search_condition)
-        search_param = f'%{search}%'
-        params.extend([search_param, search_param, search_param])
-
-    where_clause = ''
-    if conditions:
-        where_clause = ' WHERE ' + ' AND '.join(conditions)
-
-    # Add WHERE clause to both queries
-    query += where_clause
-    count_query += where_clause
-
-    # Group by for main query
-    query += ' GROUP BY l.link_id, l.first_name, l.last_name, l.email, l.icp, l.campaign, l.company_name, l.company_url, l.linkedin_url, l.created_at'
-
-    # Apply status filter after GROUP BY using HAVING
-    if status_filter == 'clicked':
-        query += ' HAVING COUNT(c.id) > 0'
-    elif status_filter == 'not_clicked':
-        query += ' HAVING COUNT(c.id) = 0'
-
-    # Get total count
-    cur.execute(count_query, params)
-    total = cur.fetchone()['total']
-
-    # Apply status filter to count if needed
-    if status_filter == 'clicked':
-        count_filtered = '''
-            SELECT COUNT(*) as total FROM (
-                SELECT l.link_id
-                FROM links l
-                LEFT JOIN clicks c ON l.link_id = c.link_id
-                {where}
-                GROUP BY l.link_id
-                HAVING COUNT(c.id) > 0
-            ) as filtered
-        '''.format(where=where_clause)
-        cur.execute(count_filtered, params)
-        total = cur.fetchone()['total']
-    elif status_filter == 'not_clicked':
-        count_filtered = '''
-            SELECT COUNT(*) as total FROM (
-                SELECT l.link_id
-                FROM links l
-                LEFT JOIN clicks c ON l.link_id = c.link_id
-                {where}
-                GROUP BY l.link_id
-                HAVING COUNT(c.id) = 0
-            ) as filtered
-        '''.format(where=where_clause)
-        cur.execute(count_filtered, params)
-        total = cur.fetchone()['total']
-
-    # Add ordering and pagination
-    query += ' ORDER BY click_count DESC, l.created_at DESC'
-    offset = (page - 1) * per_page
-    query += f' LIMIT {per_page} OFFSET {offset}'
-
-    # Execute main query
-    cur.execute(query, params)
-    clicks = cur.fetchall()
-
-    cur.close()
-    conn.close()
-
-    # Calculate pagination metadata
-    total_pages = (total + per_page - 1) // per_page  # Ceiling division
-
-    return jsonify({
-        'data': clicks,
-        'pagination': {
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'total_pages': total_pages,
-            'has_next': page < total_pages,
-            'has_prev': page > 1
-        }
-    })
+    return jsonify(data)
 
 @app.route('/api/campaigns')
 def get_campaigns():
     """Get list of all campaigns"""
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    cur.execute('SELECT DISTINCT campaign FROM links ORDER BY campaign')
-    campaigns = cur.fetchall()
-
+    campaigns = analytics.campaigns_panel(cur)
     cur.close()
     conn.close()
 
-    return jsonify([c['campaign'] for c in campaigns])
+    return jsonify(campaigns)
 
 @app.route('/api/icp-stats')
+@cached_response
 def get_icp_stats():
     """Get ICP distribution for links that have been clicked"""
     time_range = request.args.get('range', 'all')
@@ -568,175 +598,115 @@ def get_icp_stats():
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Build time filter for clicks
-    time_filter = ""
-    if time_range == '24h':
-        time_filter = "AND c.clicked_at >= NOW() - INTERVAL '24 hours'"
-    elif time_range == '7d':
-        time_filter = "AND c.clicked_at >= NOW() - INTERVAL '7 days'"
-    elif time_range == '30d':
-        time_filter = "AND c.clicked_at >= NOW() - INTERVAL '30 days'"
-
-    # Build campaign filter
-    campaign_condition = ""
-    if campaign_filter:
-        campaign_condition = f"AND l.campaign = '{campaign_filter}'"
-
-    # Get ICP distribution for clicked links only
-    query = f'''
-        SELECT
-            COALESCE(NULLIF(l.icp, ''), 'Non défini') as icp,
-            COUNT(DISTINCT l.link_id) as click_count
-        FROM links l
-        INNER JOIN clicks c ON l.link_id = c.link_id
-        WHERE 1=1 {time_filter} {campaign_condition}
-        GROUP BY l.icp
-        ORDER BY click_count DESC
-    '''
-
-    cur.execute(query)
-    icp_stats = cur.fetchall()
-
+    icp_stats = analytics.icp_stats_panel(cur, time_range, campaign_filter)
     cur.close()
     conn.close()
 
     return jsonify(icp_stats)
 
 @app.route('/api/heatmap')
+@cached_response
 def get_heatmap():
-    """Get click heatmap data by day of week and hour (unique visitors only)"""
+    """Get click heatmap data by day of week and hour (unique visitors only)
+
+    `mode` is exact or approx (HyperLogLog sketches, default UNIQUE_VISITORS_MODE);
+    `unique_by` is link (one link = one person) or ip (approx only).
+    """
     time_range = request.args.get('range', 'all')  # 24h, 7d, 30d, all
     campaign_filter = request.args.get('campaign', '')
+    mode = request.args.get('mode', UNIQUE_VISITORS_MODE)
+    unique_by = request.args.get('unique_by', 'link')
+
+    try:
+        analytics.check_unique_options(mode, unique_by)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Build WHERE clause combining campaign and time filters
-    where_conditions = []
-    if campaign_filter:
-        where_conditions.append(f"l.campaign = '{campaign_filter}'")
-
-    # Add time filter to the CTE to only get first clicks within the period
-    if time_range == '24h':
-        where_conditions.append("c.clicked_at >= NOW() - INTERVAL '24 hours'")
-    elif time_range == '7d':
-        where_conditions.append("c.clicked_at >= NOW() - INTERVAL '7 days'")
-    elif time_range == '30d':
-        where_conditions.append("c.clicked_at >= NOW() - INTERVAL '30 days'")
-
-    where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-
-    # Get first click per unique visitor (by link_id = unique person) within the time period
-    query = f'''
-        WITH first_clicks AS (
-            SELECT DISTINCT ON (c.link_id)
-                c.clicked_at
-            FROM clicks c
-            JOIN links l ON c.link_id = l.link_id
-            {where_clause}
-            ORDER BY c.link_id, c.clicked_at ASC
-        )
-        SELECT
-            EXTRACT(DOW FROM fc.clicked_at) as day_of_week,
-            EXTRACT(HOUR FROM fc.clicked_at) as hour,
-            COUNT(*) as click_count
-        FROM first_clicks fc
-        GROUP BY day_of_week, hour
-        ORDER BY day_of_week, hour
-    '''
-
-    cur.execute(query)
-    heatmap_data = cur.fetchall()
-
+    heatmap_data = analytics.heatmap_panel(cur, time_range, campaign_filter, mode, unique_by)
     cur.close()
     conn.close()
 
     return jsonify(heatmap_data)
 
 @app.route('/api/analytics/timeline')
+@cached_response
 def get_timeline():
-    """Get clicks timeline for chart (unique visitors only)"""
+    """Get clicks timeline for chart (unique visitors only)
+
+    Optional `bucket` sets the period size (15m, hour, 6h, day, week...);
+    by default hour for 24h and day for the other ranges. `mode` and
+    `unique_by` work as for /api/heatmap (buckets under an hour are exact).
+    """
     time_range = request.args.get('range', '7d')
     campaign_filter = request.args.get('campaign', '')
+    bucket = request.args.get('bucket')
+    mode = request.args.get('mode', UNIQUE_VISITORS_MODE)
+    unique_by = request.args.get('unique_by', 'link')
+
+    try:
+        timeline_query(time_range, bucket, campaign_filter)
+        analytics.check_unique_options(mode, unique_by)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        timeline_data = analytics.timeline_panel(cur, time_range, campaign_filter, bucket, mode, unique_by)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        cur.close()
+        conn.close()
 
-    # Configure based on time range
-    if time_range == '24h':
-        start_interval = '24 hours'
-        step_interval = '1 hour'
-        format_str = 'YYYY-MM-DD HH24:00'
-    elif time_range == '7d':
-        start_interval = '7 days'
-        step_interval = '1 day'
-        format_str = 'YYYY-MM-DD'
-    elif time_range == '30d':
-        start_interval = '30 days'
-        step_interval = '1 day'
-        format_str = 'YYYY-MM-DD'
-    else:  # 'all'
-        start_interval = '90 days'
-        step_interval = '1 day'
-        format_str = 'YYYY-MM-DD'
-
-    # Build WHERE clause for filtering first clicks within the time period
-    where_conditions = [f"c.clicked_at >= NOW() - INTERVAL '{start_interval}'"]
-    if campaign_filter:
-        where_conditions.append(f"l.campaign = '{campaign_filter}'")
-
-    where_clause = "WHERE " + " AND ".join(where_conditions)
-
-    # Get first click per unique visitor (by link_id) within the time period
-    # AND get total clicks count
-    query = f'''
-        WITH time_series AS (
-            SELECT generate_series(
-                NOW() - INTERVAL '{start_interval}',
-                NOW(),
-                INTERVAL '{step_interval}'
-            ) AS period_time
-        ),
-        first_clicks AS (
-            SELECT DISTINCT ON (c.link_id)
-                c.link_id,
-                c.clicked_at
-            FROM clicks c
-            JOIN links l ON c.link_id = l.link_id
-            {where_clause}
-            ORDER BY c.link_id, c.clicked_at ASC
-        ),
-        all_clicks AS (
-            SELECT
-                c.clicked_at
-            FROM clicks c
-            JOIN links l ON c.link_id = l.link_id
-            {where_clause}
-        )
-        SELECT
-            TO_CHAR(ts.period_time, '{format_str}') as period,
-            COALESCE(COUNT(DISTINCT fc.link_id), 0) as unique_visitors,
-            COALESCE(
-                (SELECT COUNT(*)
-                 FROM all_clicks ac
-                 WHERE TO_CHAR(ac.clicked_at, '{format_str}') = TO_CHAR(ts.period_time, '{format_str}')
-                ), 0
-            ) as total_clicks
-        FROM time_series ts
-        LEFT JOIN first_clicks fc
-            ON TO_CHAR(fc.clicked_at, '{format_str}') = TO_CHAR(ts.period_time, '{format_str}')
-        GROUP BY period, ts.period_time
-        ORDER BY ts.period_time
-    '''
-
-    cur.execute(query)
-    timeline_data = cur.fetchall()
+    return jsonify(timeline_data)
 
-    cur.close()
-    conn.close()
+@app.route('/api/dashboard')
+@cached_response(all_campaigns=True)  # the campaigns panel covers every campaign
+def get_dashboard():
+    """Get every dashboard panel in one round trip, computed over one database snapshot
 
-    return jsonify(timeline_data)
+    Accepts the parameters of the individual endpoints: range, campaign,
+    bucket, mode, unique_by (timeline, heatmap) and page, per_page, search,
+    status, cursor, total (clicks table).
+    """
+    time_range = request.args.get('range', 'all')
+    campaign_filter = request.args.get('campaign', '')
+    bucket = request.args.get('bucket')
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 50))
+    search = request.args.get('search', '')
+    status_filter = request.args.get('status', 'all')
+    cursor = request.args.get('cursor')
+    total_mode = request.args.get('total')
+    mode = request.args.get('mode', UNIQUE_VISITORS_MODE)
+    unique_by = request.args.get('unique_by', 'link')
+
+    # Validate the bucket, unique visitors options and cursor before borrowing any connection
+    try:
+        timeline_query(time_range, bucket, campaign_filter)
+        analytics.check_unique_options(mode, unique_by)
+        if unique_by != 'link' and not resolve(time_range, bucket)[1].from_rollups:
+            raise ValueError(f"unique_by={unique_by} needs buckets of whole hours")
+        if cursor:
+            analytics.decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    panels = {
+        'analytics': (analytics.analytics_panel, (time_range, campaign_filter)),
+        'timeline': (analytics.timeline_panel, (time_range, campaign_filter, bucket, mode, unique_by)),
+        'heatmap': (analytics.heatmap_panel, (time_range, campaign_filter, mode, unique_by)),
+        'icp_stats': (analytics.icp_stats_panel, (time_range, campaign_filter)),
+        'campaigns': (analytics.campaigns_panel, ()),
+        'clicks': (analytics.clicks_panel, (campaign_filter, page, per_page, search, status_filter, cursor, total_mode)),
+    }
+    results, generated_at = analytics.run_panels(get_db_connection, panels, DASHBOARD_PARALLELISM)
+    results['generated_at'] = generated_at
+
+    return jsonify(results)
 
 @app.route('/api/update-link', methods=['POST', 'PUT'])
 def update_link():
@@ -784,12 +754,17 @@ def update_link():
         params.append(identifier)
 
         # Execute update
-        query = f"UPDATE links SET {', '.join(update_fields)} WHERE {where_clause}"
+        query = f"UPDATE links SET {', '.join(update_fields)} WHERE {where_clause} RETURNING link_id, campaign"
         cur.execute(query, params)
+        updated = cur.fetchall()
+        bump_versions(cur, {row['campaign'] for row in updated})
 
         conn.commit()
+        for row in updated:
+            link_cache.pop(row['link_id'])
+        response_cache.invalidate({row['campaign'] for row in updated})
 
-        if cur.rowcount == 0:
+        if not updated:
             return jsonify({'error': 'Link not found', 'searched_by': 'link_id' if link_id else 'email', 'value': identifier}), 404
 
         # Return updated link info
@@ -819,14 +794,25 @@ def delete_link(link_id):
         # Delete clicks first (foreign key constraint)
         cur.execute('DELETE FROM clicks WHERE link_id = %s', (link_id,))
 
+        cur.execute('DELETE FROM click_rollups_hourly WHERE link_id = %s', (link_id,))
+        cur.execute('DELETE FROM first_clicks WHERE link_id = %s', (link_id,))
+        cur.execute('DELETE FROM clay_outbox WHERE link_id = %s', (link_id,))
+
         # Then delete the link
-        cur.execute('DELETE FROM links WHERE link_id = %s', (link_id,))
+        cur.execute('DELETE FROM links WHERE link_id = %s RETURNING campaign', (link_id,))
+        deleted = cur.fetchone()
+        if deleted is not None:
+            bump_versions(cur, [deleted[0]])
 
         conn.commit()
+        link_cache.pop(link_id)
+        link_filter.remove(link_id)
 
-        if cur.rowcount == 0:
+        if deleted is None:
             return jsonify({'error': 'Link not found'}), 404
 
+        response_cache.invalidate([deleted[0]])
+
         return jsonify({'success': True, 'message': 'Link deleted'}), 200
 
     except Exception as e:
@@ -838,24 +824,31 @@ def delete_link(link_id):
 
 @app.route('/api/webhook/hot-leads', methods=['POST', 'GET'])
 def send_hot_leads_to_clay():
-    """Send leads with 5+ clicks to Clay webhook - Manual or automated trigger"""
+    """Send leads past their campaign's click threshold to Clay webhook - Manual or automated trigger
+
+    With "enqueue": true the leads are queued in clay_outbox instead, and
+    sent by the background dispatcher (catch-up sweep run by cron_hot_leads.py).
+    """
 
     # Get Clay webhook URL from request or environment
     data = request.json if request.method == 'POST' else {}
     clay_webhook_url = data.get('clay_webhook_url') or os.environ.get('CLAY_WEBHOOK_URL')
+    enqueue = bool(data.get('enqueue'))
 
+    if enqueue and not clay_dispatcher.enabled:
+        return jsonify({'error': 'enqueue requires the CLAY_WEBHOOK_URL environment variable (outbox dispatcher)'}), 400
     if not clay_webhook_url:
         return jsonify({'error': 'clay_webhook_url is required. Provide it in the request body or set CLAY_WEBHOOK_URL environment variable'}), 400
 
     # Get optional parameters
-    min_clicks = int(data.get('min_clicks', 5))  # Default: 5 clicks
+    min_clicks = data.get('min_clicks')  # Default: each campaign's hot-lead threshold
     campaign_filter = data.get('campaign', '')
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        # Find hot leads: 5+ clicks AND not yet sent to Clay
+        # Find hot leads: past the click threshold AND not yet sent to Clay (counters on links, idx_links_hot_leads)
         query = '''
             SELECT
                 l.link_id,
@@ -869,25 +862,35 @@ def send_hot_leads_to_clay():
                 l.linkedin_url,
                 l.destination_url,
                 l.created_at,
-                COUNT(c.id) as click_count,
-                MAX(c.clicked_at) as last_clicked,
-                MIN(c.clicked_at) as first_clicked
+                l.click_count,
+                l.last_clicked_at as last_clicked,
+                l.first_clicked_at as first_clicked
             FROM links l
-            LEFT JOIN clicks c ON l.link_id = c.link_id
-            WHERE l.sent_to_clay = FALSE
         '''
+        if min_clicks is not None:
+            min_clicks = int(min_clicks)
+            query += ' WHERE l.sent_to_clay = FALSE AND l.click_count >= %s'
+            params = [min_clicks]
+        else:
+            # The lowest enabled threshold keeps idx_links_hot_leads usable
+            query += '''
+                LEFT JOIN hot_lead_thresholds t ON t.campaign = l.campaign
+                WHERE l.sent_to_clay = FALSE
+                  AND l.click_count >= LEAST(NULLIF(%s, 0), (SELECT MIN(min_clicks) FROM hot_lead_thresholds WHERE min_clicks > 0))
+                  AND COALESCE(t.min_clicks, %s) > 0
+                  AND l.click_count >= COALESCE(t.min_clicks, %s)
+            '''
+            default = clay_outbox.HOT_LEAD_MIN_CLICKS
+            params = [default, default, default]
+            min_clicks = 'per campaign'
 
         if campaign_filter:
-            query += f" AND l.campaign = '{campaign_filter}'"
+            query += " AND l.campaign = %s"
+            params.append(campaign_filter)
 
-        query += f'''
-            GROUP BY l.link_id, l.first_name, l.last_name, l.email, l.icp, l.campaign,
-                     l.company_name, l.company_url, l.linkedin_url, l.destination_url, l.created_at
-            HAVING COUNT(c.id) >= {min_clicks}
-            ORDER BY COUNT(c.id) DESC
-        '''
+        query += ' ORDER BY l.click_count DESC'
 
-        cur.execute(query)
+        cur.execute(query, params)
         hot_leads = cur.fetchall()
 
         if not hot_leads:
@@ -898,58 +901,38 @@ def send_hot_leads_to_clay():
                 'min_clicks': min_clicks
             }), 200
 
-        # Send each lead to Clay webhook
-        sent_count = 0
-        errors = []
-        sent_link_ids = []
-
-        for lead in hot_leads:
-            try:
-                # Prepare payload for Clay
-                payload = {
-                    'first_name': lead['first_name'],
-                    'last_name': lead['last_name'],
-                    'email': lead['email'],
-                    'company_name': lead['company_name'],
-                    'company_url': lead['company_url'],
-                    'linkedin_url': lead['linkedin_url'],
-                    'icp': lead['icp'],
-                    'campaign': lead['campaign'],
-                    'click_count': lead['click_count'],
-                    'first_clicked': lead['first_clicked'].isoformat() if lead['first_clicked'] else None,
-                    'last_clicked': lead['last_clicked'].isoformat() if lead['last_clicked'] else None,
-                    'link_id': lead['link_id'],
-                    'tracking_url': f"https://{os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com')}/c/{lead['link_id']}"
-                }
+        if enqueue:
+            # Leads already queued (e.g. by the click that made them hot) are left alone
+            queued = enqueue_hot_leads(cur, [lead['link_id'] for lead in hot_leads])
+            conn.commit()
+            clay_dispatcher.wake()
+            return jsonify({
+                'success': True,
+                'message': f'Queued {queued} hot leads for Clay',
+                'queued_count': queued,
+                'total_found': len(hot_leads),
+                'min_clicks': min_clicks
+            }), 200
 
-                # Send to Clay webhook
-                response = requests.post(clay_webhook_url, json=payload, timeout=10)
-
-                if response.status_code in [200, 201, 202]:
-                    sent_count += 1
-                    sent_link_ids.append(lead['link_id'])
-                else:
-                    errors.append({
-                        'email': lead['email'],
-                        'error': f"Clay webhook returned {response.status_code}"
-                    })
-
-            except Exception as e:
-                errors.append({
-                    'email': lead['email'],
-                    'error': str(e)
-                })
-
-        # Mark sent leads as sent_to_clay
-        if sent_link_ids:
-            placeholders = ','.join(['%s'] * len(sent_link_ids))
-            cur.execute(f'''
+        def mark_sent(link_ids):
+            # Committed as each batch is confirmed: a crash later on can't resend them
+            cur.execute('''
                 UPDATE links
                 SET sent_to_clay = TRUE, sent_to_clay_at = NOW()
-                WHERE link_id IN ({placeholders})
-            ''', sent_link_ids)
+                WHERE link_id = ANY(%s)
+            ''', (list(link_ids),))
             conn.commit()
 
+        # Send leads to the Clay webhook concurrently, marked by batches as they are confirmed
+        leads = {lead['link_id']: lead for lead in hot_leads}
+        sent, failed = clay_delivery.deliver(
+            clay_webhook_url,
+            [(link_id, hot_lead_payload(lead)) for link_id, lead in leads.items()],
+            on_batch=mark_sent
+        )
+        sent_count = len(sent)
+        errors = [{'email': leads[link_id]['email'], 'error': error} for link_id, error in failed.items()]
+
         return jsonify({
             'success': True,
             'message': f'Sent {sent_count} hot leads to Clay',
@@ -966,6 +949,72 @@ def send_hot_leads_to_clay():
         cur.close()
         conn.close()
 
+@app.route('/api/hot-leads/thresholds', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def hot_lead_thresholds():
+    """List, set or remove per-campaign hot-lead thresholds (default: HOT_LEAD_MIN_CLICKS)"""
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        if request.method == 'GET':
+            cur.execute('SELECT campaign, min_clicks, updated_at FROM hot_lead_thresholds ORDER BY campaign')
+            return jsonify({
+                'default_min_clicks': clay_outbox.HOT_LEAD_MIN_CLICKS,
+                'thresholds': cur.fetchall()
+            }), 200
+
+        data = request.json if request.method != 'DELETE' else {}
+        campaign = data.get('campaign') or request.args.get('campaign')
+        if not campaign:
+            return jsonify({'error': 'campaign is required'}), 400
+
+        if request.method == 'DELETE':
+            cur.execute('DELETE FROM hot_lead_thresholds WHERE campaign = %s', (campaign,))
+            conn.commit()
+            clay_outbox.thresholds.invalidate()
+            if cur.rowcount == 0:
+                return jsonify({'error': 'No threshold for this campaign'}), 404
+            return jsonify({'success': True, 'message': f'Threshold removed for {campaign}'}), 200
+
+        try:
+            min_clicks = int(data.get('min_clicks'))
+            if min_clicks < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({'error': 'min_clicks must be an integer >= 0 (0 = no hot leads for the campaign)'}), 400
+
+        cur.execute('''
+            INSERT INTO hot_lead_thresholds (campaign, min_clicks) VALUES (%s, %s)
+            ON CONFLICT (campaign) DO UPDATE SET min_clicks = EXCLUDED.min_clicks, updated_at = CURRENT_TIMESTAMP
+        ''', (campaign, min_clicks))
+
+        # Leads already past a lowered threshold will never cross it: queue them now
+        queued = 0
+        if min_clicks > 0:
+            cur.execute('''
+                SELECT link_id FROM links
+                WHERE campaign = %s AND sent_to_clay = FALSE AND click_count >= %s
+            ''', (campaign, min_clicks))
+            queued = enqueue_hot_leads(cur, [row['link_id'] for row in cur.fetchall()])
+        conn.commit()
+        clay_outbox.thresholds.invalidate()
+        if queued:
+            clay_dispatcher.wake()
+
+        return jsonify({
+            'success': True,
+            'campaign': campaign,
+            'min_clicks': min_clicks,
+            'queued_count': queued
+        }), 200
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
 @app.route('/api/webhook/reset-clay-status', methods=['POST'])
 def reset_clay_status():
     """Reset sent_to_clay status for testing purposes"""
@@ -976,13 +1025,20 @@ def reset_clay_status():
     cur = conn.cursor()
 
     try:
+        # Settled outbox events go too, so a lead that gets hot again is queued again
         if email:
             cur.execute('UPDATE links SET sent_to_clay = FALSE, sent_to_clay_at = NULL WHERE email = %s', (email,))
+            count = cur.rowcount
+            cur.execute('''
+                DELETE FROM clay_outbox
+                WHERE status IN ('sent', 'dead') AND link_id IN (SELECT link_id FROM links WHERE email = %s)
+            ''', (email,))
         else:
             cur.execute('UPDATE links SET sent_to_clay = FALSE, sent_to_clay_at = NULL')
+            count = cur.rowcount
+            cur.execute("DELETE FROM clay_outbox WHERE status IN ('sent', 'dead')")
 
         conn.commit()
-        count = cur.rowcount
 
         return jsonify({
             'success': True,
@@ -1577,6 +1633,11 @@ DASHBOARD_HTML = '''
 </html>
 '''
 
+# Warm the link cache in the background when the worker starts
+if int(os.environ.get('LINK_CACHE_WARM', 0)) > 0:
+    threading.Thread(target=warm_link_cache, args=(int(os.environ['LINK_CACHE_WARM']),),
+                     name='link-cache-warmup', daemon=True).start()
+
 # ===== HEYREACH EXPORTER INTEGRATION =====
 from heyreach_simple import init_heyreach_routes
 init_heyreach_routes(app)
@@ -1589,12 +1650,8 @@ def tracker_dashboard():
     return redirect('/')
 
 if __name__ == '__main__':
-    # Initialize database on first run
-    try:
-        init_db()
-        print("Database initialized successfully!")
-    except Exception as e:
-        print(f"Database initialization error: {e}")
+    # Apply pending schema migrations (gunicorn does it in on_starting)
+    migrations.run(DATABASE_URL)
 
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
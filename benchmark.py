@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Benchmark
+Banc de charge reproductible : données générées sur un PostgreSQL local, redirections /c/<link_id>
+à débit cible (p50/p95/p99, débit), temps de chaque endpoint analytics, résultats en JSON
+
+Usage: python benchmark.py [--sizes 10000:1000000,100000:10000000] [--rps 200] [--duration 30]
+                           [--output results.json] [--compare baseline.json]
+
+For each size (links:clicks) the benchmark database is emptied and seeded
+(links with COPY, clicks generated server side, derived tables rebuilt),
+then the app is started with gunicorn against it, loaded, and stopped.
+Seeding truncates every tracking table: the database name must contain
+'bench' (or pass --force). --url targets an app that is already running
+instead (restart it after each seed: its link caches would be stale).
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import psycopg2
+import requests
+
+import click_rollups
+import click_sketches
+import first_clicks
+import link_counters
+import migrations
+
+DATABASE_URL = os.environ.get('BENCH_DATABASE_URL', 'postgresql://localhost/link_tracker_bench')
+
+CAMPAIGNS = ['aura.camp', 'wesser-recrutement.fr', 'agence-demo.fr', 'saas-outbound.io', 'recrutement-tech.fr']
+ICPS = ['CEO', 'CTO', 'Head of Sales', 'Recruiter', '']
+LOCATIONS = [('France', 'Paris'), ('France', 'Lyon'), ('Belgium', 'Brussels'), ('Switzerland', 'Geneva'),
+             ('Canada', 'Montreal'), ('United States', 'New York'), ('Germany', 'Berlin'), ('Unknown', 'Unknown')]
+BROWSER_UA = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0) AppleWebKit/605.1.15 '
+              '(KHTML, like Gecko) Version/17.0 Safari/605.1.15')
+# Redirect load: each simulated visitor gets one of these and its own address
+VISITOR_UAS = [
+    BROWSER_UA,
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_{m} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.{m} Mobile/15E148 Safari/604.1',
+]
+
+# Tables emptied before each seed (RESTART IDENTITY: links.id runs 1..N again)
+SEEDED_TABLES = ['clicks', 'links', 'click_rollups_hourly', 'first_clicks', 'click_sketches_hourly',
+                 'click_sketches_cumulative', 'clay_outbox']
+
+# (name, path, query parameters) - the GET analytics endpoints of app.py
+ENDPOINTS = [
+    ('analytics_all', '/api/analytics', {'range': 'all'}),
+    ('analytics_7d', '/api/analytics', {'range': '7d'}),
+    ('analytics_campaign', '/api/analytics', {'range': '30d', 'campaign': CAMPAIGNS[0]}),
+    ('clicks_page1', '/api/clicks', {'per_page': 50}),
+    ('clicks_clicked', '/api/clicks', {'status': 'clicked', 'per_page': 50}),
+    ('clicks_search', '/api/clicks', {'search': 'prospect42', 'per_page': 50}),
+    ('campaigns', '/api/campaigns', {}),
+    ('icp_stats', '/api/icp-stats', {'range': 'all'}),
+    ('heatmap', '/api/heatmap', {'range': 'all'}),
+    ('heatmap_exact', '/api/heatmap', {'range': '30d', 'mode': 'exact'}),
+    ('timeline_7d', '/api/analytics/timeline', {'range': '7d'}),
+    ('timeline_30d', '/api/analytics/timeline', {'range': '30d', 'bucket': 'day'}),
+    ('dashboard', '/api/dashboard', {'range': '7d'}),
+]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (None if empty)"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values))), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_ms(seconds):
+    """count, p50/p95/p99, max and mean in milliseconds of durations in seconds"""
+    values = sorted(seconds)
+    summary = {'count': len(values)}
+    for p in (50, 95, 99):
+        value = percentile(values, p)
+        summary[f'p{p}_ms'] = round(value * 1000, 2) if value is not None else None
+    summary['max_ms'] = round(values[-1] * 1000, 2) if values else None
+    summary['mean_ms'] = round(sum(values) / len(values) * 1000, 2) if values else None
+    return summary
+
+
+def link_id_for(row):
+    """link_id of the row-th seeded link (links.id = row after the seed)"""
+    return f'b{row:09d}'
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def seed_links(cur, count, rng, chunk=50000):
+    """COPY `count` links, created 30 to 120 days ago, spread over CAMPAIGNS"""
+    now = datetime.now()
+    for first in range(1, count + 1, chunk):
+        buffer = io.StringIO()
+        for i in range(first, min(first + chunk, count + 1)):
+            campaign = CAMPAIGNS[i % len(CAMPAIGNS)]
+            created_at = now - timedelta(days=rng.uniform(30, 120))
+            buffer.write(f'{link_id_for(i)}\tProspect\tprospect{i}\tprospect{i}@example.com\t{campaign}\t'
+                         f'https://{campaign}/?ref={i}\t{created_at.isoformat(sep=" ")}\t'
+                         f'Company {i % 5000}\t{ICPS[i % len(ICPS)]}\n')
+        buffer.seek(0)
+        cur.copy_expert('''
+            COPY links (link_id, first_name, last_name, email, campaign, destination_url,
+                        created_at, company_name, icp)
+            FROM STDIN
+        ''', buffer)
+
+
+def seed_clicks(cur, count, links, seed, days=30, skew=3.0, bot_ratio=0.05, chunk=1000000):
+    """Generate `count` clicks server side, in chunks of `chunk` rows
+
+    Links are picked with a power-law skew (a few links get most clicks),
+    visitors from a pool of 2 IPs per link, times uniformly over the last
+    `days` days; `bot_ratio` of the clicks are stored as tagged bot hits.
+    setseed() makes every run generate the same rows.
+    """
+    countries = [country for country, _city in LOCATIONS]
+    cities = [city for _country, city in LOCATIONS]
+    chunks = -(-count // chunk)
+    for index in range(chunks):
+        size = min(chunk, count - index * chunk)
+        cur.execute('SELECT setseed(%s)', (((seed + index) % 1000) / 1000,))
+        cur.execute('''
+            INSERT INTO clicks (link_id, clicked_at, ip_address, user_agent, country, city, referer,
+                                is_bot, bot_reason)
+            SELECT l.link_id,
+                   LOCALTIMESTAMP - random() * %(days)s * INTERVAL '1 day',
+                   '10.' || (s.visitor / 65536 %% 256) || '.' || (s.visitor / 256 %% 256) || '.' || (s.visitor %% 256),
+                   CASE WHEN s.bot THEN 'LinkedInBot/1.0 (compatible; Mozilla/5.0)' ELSE %(ua)s END,
+                   (%(countries)s::text[])[1 + s.visitor %% %(locations)s],
+                   (%(cities)s::text[])[1 + s.visitor %% %(locations)s],
+                   '', s.bot, CASE WHEN s.bot THEN 'preview:linkedin' END
+            FROM (
+                SELECT 1 + floor(power(random(), %(skew)s) * %(links)s)::int AS link_row,
+                       floor(random() * %(visitors)s)::int AS visitor,
+                       random() < %(bot_ratio)s AS bot
+                FROM generate_series(1, %(size)s)
+            ) s
+            JOIN links l ON l.id = s.link_row
+        ''', {
+            'days': days, 'ua': BROWSER_UA, 'countries': countries, 'cities': cities,
+            'locations': len(LOCATIONS), 'skew': skew, 'links': links, 'visitors': 2 * links,
+            'bot_ratio': bot_ratio, 'size': size,
+        })
+        print(f"   clicks: {min((index + 1) * chunk, count):,}/{count:,}", flush=True)
+
+
+def seed(database_url, links, clicks, seed_value, force=False):
+    """Empty and reseed the benchmark database: returns the duration of each step in seconds"""
+    database = urlsplit(database_url).path.lstrip('/')
+    if 'bench' not in database and not force:
+        raise SystemExit(f"❌ Refusing to truncate database '{database}': its name must contain "
+                         f"'bench' (or pass --force)")
+
+    migrations.run(database_url)
+    timings = {}
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute('SET synchronous_commit = off')
+
+        def step(name, fn, *args):
+            started = time.perf_counter()
+            fn(*args)
+            conn.commit()
+            timings[name] = round(time.perf_counter() - started, 2)
+            print(f"   {name}: {timings[name]}s", flush=True)
+
+        step('truncate', cur.execute, f"TRUNCATE {', '.join(SEEDED_TABLES)} RESTART IDENTITY CASCADE")
+        step('links', seed_links, cur, links, random.Random(seed_value))
+        step('clicks', seed_clicks, cur, clicks, links, seed_value)
+        step('rollups', click_rollups.rebuild, cur)
+        step('first_clicks', first_clicks.rebuild, cur)
+        step('sketches', click_sketches.rebuild, cur)
+        step('cumulative_sketches', click_sketches.advance_cumulative, cur)
+        step('link_counters', link_counters.reconcile, cur, 1, links)
+        conn.autocommit = True
+        step('analyze', cur.execute, 'VACUUM ANALYZE')
+        cur.close()
+    finally:
+        conn.close()
+    return timings
+
+
+# ---------------------------------------------------------------------------
+# App under test
+# ---------------------------------------------------------------------------
+
+class AppServer:
+    """gunicorn app:app with the repo's config, bound to localhost, output in a log file"""
+
+    def __init__(self, database_url, port, log_path, workers=None, threads=None, env=None):
+        self.database_url = database_url
+        self.port = port
+        self.log_path = log_path
+        self.workers = workers
+        self.threads = threads
+        self.env = env or {}
+        self.url = f'http://127.0.0.1:{port}'
+        self._process = None
+
+    def start(self, timeout=60):
+        command = [sys.executable, '-m', 'gunicorn', 'app:app', '--config', 'gunicorn_config.py',
+                   '--bind', f'127.0.0.1:{self.port}']
+        if self.workers:
+            command += ['--workers', str(self.workers)]
+        if self.threads:
+            command += ['--threads', str(self.threads)]
+        env = dict(os.environ, DATABASE_URL=self.database_url, PORT=str(self.port), **self.env)
+        log = open(self.log_path, 'a')
+        self._process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        log.close()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {self._process.returncode} (see {self.log_path})")
+            try:
+                if requests.get(f'{self.url}/api/version', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"app did not answer within {timeout}s (see {self.log_path})")
+
+    def stop(self, timeout=60):
+        # SIGTERM: workers flush their click buffers (worker_exit) before exiting
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def visitor_headers(visitor):
+    """User agent and X-Forwarded-For of a simulated visitor (stable per visitor number)"""
+    user_agent = VISITOR_UAS[visitor % len(VISITOR_UAS)].format(v=110 + visitor % 17, m=visitor % 6)
+    address = visitor + 1
+    return {'User-Agent': user_agent, 'X-Forwarded-For': f'11.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}'}
+
+
+def run_redirect_load(base_url, links, rps, duration, concurrency, skew=1.0, miss_ratio=0.01, seed_value=0,
+                      visitors=5000):
+    """Open-loop load on /c/<link_id> at `rps` requests/s for `duration` seconds
+
+    Requests are scheduled at fixed intervals whatever the response times,
+    and latency is measured from the scheduled time, so a slow server shows
+    up as queueing delay instead of silently lowering the offered load
+    (coordinated omission). service_time is the HTTP round-trip alone.
+    Each request comes from one of `visitors` simulated visitors. Links are
+    picked with a power-law `skew` (1.0 = uniform): burst detection counts
+    hits per link, so a steep skew makes the hottest links look like scanners
+    under the production thresholds (see hottest_link_hits).
+    """
+    rng = random.Random(seed_value)
+    local = threading.local()
+    latencies, service_times, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def hit(link_id, headers, scheduled):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = session.get(f'{base_url}/c/{link_id}', allow_redirects=False, timeout=10,
+                                 headers=headers).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            latencies.append(finished - scheduled)
+            service_times.append(finished - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    total = int(rps * duration)
+    interval = 1.0 / rps
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-redirect') as pool:
+        started = time.perf_counter()
+        for i in range(total):
+            scheduled = started + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if rng.random() < miss_ratio:
+                link_id = uuid.uuid4().hex[:8]
+            else:
+                link_id = link_id_for(1 + int(rng.random() ** skew * links))
+            pool.submit(hit, link_id, visitor_headers(rng.randrange(visitors)), scheduled)
+    elapsed = time.perf_counter() - started
+
+    redirects = statuses.get(302, 0)
+    return {
+        'target_rps': rps,
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 1),
+        'redirect_rps': round(redirects / elapsed, 1),
+        'statuses': {str(status): n for status, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        'error_rate': round(1 - (redirects + statuses.get(404, 0)) / total, 4) if total else None,
+        'latency': summarize_ms(latencies),
+        'service_time': summarize_ms(service_times),
+    }
+
+
+def hottest_link_hits(links, rps, skew, window):
+    """Expected hits on the most requested link within `window` seconds of the redirect load"""
+    return rps * window * (1 / links) ** (1 / skew)
+
+
+def time_endpoints(base_url, runs):
+    """Time every ENDPOINTS entry: `runs` uncached requests, then `runs` cached ones
+
+    The response cache is keyed on the query string, so a unique `_bench`
+    parameter forces a miss (the full queries); the cached series repeats
+    one fixed URL.
+    """
+    session = requests.Session()
+    results = {}
+    for name, path, params in ENDPOINTS:
+        uncached, cached, status = [], [], None
+        for i in range(runs):
+            started = time.perf_counter()
+            response = session.get(f'{base_url}{path}', params=dict(params, _bench=uuid.uuid4().hex), timeout=600)
+            uncached.append(time.perf_counter() - started)
+            status = response.status_code
+        for i in range(runs):
+            started = time.perf_counter()
+            session.get(f'{base_url}{path}', params=params, timeout=600)
+            cached.append(time.perf_counter() - started)
+        results[name] = {
+            'path': path,
+            'params': params,
+            'status': status,
+            'bytes': len(response.content),
+            'uncached': summarize_ms(uncached),
+            'cached': summarize_ms(cached),
+        }
+        print(f"   {name:<20} {results[name]['uncached']['p50_ms']:>9} ms   "
+              f"(cached {results[name]['cached']['p50_ms']} ms)", flush=True)
+    return results
+
+
+def max_click_id(database_url):
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT COALESCE(MAX(id), 0) FROM clicks')
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def bot_tagged(database_url, after_id):
+    """Share of the clicks stored since `after_id` that the bot filter tagged, by reason
+
+    Tagged clicks skip the rollup, counter, sketch and outbox writes: a high
+    share means the load measured less write work than real traffic.
+    """
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT COALESCE(bot_reason, 'human'), COUNT(*) FROM clicks WHERE id > %s GROUP BY 1
+        ''', (after_id,))
+        counts = dict(cur.fetchall())
+    finally:
+        conn.close()
+    total = sum(counts.values())
+    bots = total - counts.get('human', 0)
+    return {
+        'clicks': total,
+        'bot_clicks': bots,
+        'bot_share': round(bots / total, 4) if total else None,
+        'by_reason': {reason: n for reason, n in counts.items() if reason != 'human'},
+    }
+
+
+def fetch_metrics(base_url):
+    """/api/metrics of the worker that answers (per-process counters)"""
+    try:
+        return requests.get(f'{base_url}/api/metrics', timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Comparison
+# ---------------------------------------------------------------------------
+
+def compare(results, baseline, max_regression):
+    """Print p95 changes against a previous results file: returns the regressions found"""
+    previous = {(size['links'], size['clicks']): size for size in baseline.get('sizes', [])}
+    regressions = []
+
+    def check(label, before, after):
+        if before is None or after is None or before <= 0:
+            return
+        change = (after - before) / before
+        flag = '❌' if change > max_regression else '✅'
+        print(f"   {flag} {label:<45} {before:>9} → {after:>9} ms ({change:+.0%})")
+        if change > max_regression:
+            regressions.append({'metric': label, 'baseline_ms': before, 'current_ms': after,
+                                'change': round(change, 3)})
+
+    for size in results['sizes']:
+        old = previous.get((size['links'], size['clicks']))
+        if old is None:
+            print(f"   (no baseline for {size['links']:,} links / {size['clicks']:,} clicks)")
+            continue
+        prefix = f"{size['links']}:{size['clicks']}"
+        if size.get('redirect') and old.get('redirect'):
+            for p in ('p50_ms', 'p95_ms', 'p99_ms'):
+                check(f'{prefix} redirect {p}', old['redirect']['latency'][p], size['redirect']['latency'][p])
+        for name, endpoint in size.get('endpoints', {}).items():
+            if name in old.get('endpoints', {}):
+                check(f'{prefix} {name} p95_ms', old['endpoints'][name]['uncached']['p95_ms'],
+                      endpoint['uncached']['p95_ms'])
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        links, clicks = item.split(':')
+        sizes.append((int(float(links)), int(float(clicks))))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the redirect and analytics paths')
+    parser.add_argument('--database-url', default=DATABASE_URL,
+                        help='benchmark database (emptied!) - default BENCH_DATABASE_URL')
+    parser.add_argument('--sizes', default='10000:1000000,100000:10000000',
+                        help='comma-separated links:clicks data sizes (1e5:1e7 accepted)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the generated data and load')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data already in the database')
+    parser.add_argument('--force', action='store_true', help="seed a database whose name lacks 'bench'")
+    parser.add_argument('--url', help='app already running (default: start gunicorn for each size)')
+    parser.add_argument('--port', type=int, default=18080, help='port of the started app')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default: gunicorn_config.py)')
+    parser.add_argument('--threads', type=int, help='gunicorn threads per worker')
+    parser.add_argument('--rps', type=float, default=200, help='target redirects per second')
+    parser.add_argument('--duration', type=float, default=30, help='redirect load duration in seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured load before the measurement')
+    parser.add_argument('--concurrency', type=int, default=64, help='client threads for the redirect load')
+    parser.add_argument('--miss-ratio', type=float, default=0.01, help='share of unknown link_ids')
+    parser.add_argument('--visitors', type=int, default=5000,
+                        help='simulated visitors of the redirect load (user agent and address each)')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='power-law skew of the links hit by the redirect load (1.0 = uniform)')
+    parser.add_argument('--bot-burst-hits', type=int,
+                        help='BOT_BURST_HITS of the started app (default: production setting)')
+    parser.add_argument('--endpoint-runs', type=int, default=5, help='requests per analytics endpoint')
+    parser.add_argument('--output', default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--compare', help='previous results file: report p95 changes')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='p95 increase counted as a regression by --compare (0.2 = +20%%)')
+    args = parser.parse_args()
+
+    # Settings of the started app that differ from production, recorded with the results
+    app_env = {}
+    if args.bot_burst_hits is not None:
+        app_env['BOT_BURST_HITS'] = str(args.bot_burst_hits)
+
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('database_url', 'output')},
+        'app_env': app_env,
+        'sizes': [],
+    }
+
+    for links, clicks in parse_sizes(args.sizes):
+        print(f"\n📦 {links:,} links / {clicks:,} clicks")
+        size = {'links': links, 'clicks': clicks}
+        if not args.skip_seed:
+            print("🌱 Seeding...")
+            size['seed_s'] = seed(args.database_url, links, clicks, args.seed, force=args.force)
+
+        first_click_id = max_click_id(args.database_url)
+        server = None
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            server = AppServer(args.database_url, args.port, 'benchmark_app.log', args.workers, args.threads,
+                               env=app_env)
+            server.start()
+            base_url = server.url
+        hottest = hottest_link_hits(links, args.rps, args.skew, float(os.environ.get('BOT_BURST_WINDOW', 2.0)))
+        if args.bot_burst_hits is None and hottest >= int(os.environ.get('BOT_BURST_HITS', 3)) / 2:
+            print(f"⚠️  The hottest link gets ~{hottest:.1f} hits per burst window: "
+                  f"lower --skew or expect bursts tagged as bots")
+        try:
+            if args.warmup > 0:
+                run_redirect_load(base_url, links, args.rps, args.warmup, args.concurrency, skew=args.skew,
+                                  miss_ratio=args.miss_ratio, seed_value=args.seed + 1, visitors=args.visitors)
+            print(f"🚀 Redirects: {args.rps:g} req/s for {args.duration:g}s...")
+            size['redirect'] = run_redirect_load(base_url, links, args.rps, args.duration, args.concurrency,
+                                                 skew=args.skew, miss_ratio=args.miss_ratio,
+                                                 seed_value=args.seed, visitors=args.visitors)
+            latency = size['redirect']['latency']
+            print(f"   {size['redirect']['throughput_rps']} req/s - p50 {latency['p50_ms']} ms, "
+                  f"p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms, "
+                  f"errors {size['redirect']['error_rate']:.2%}")
+            size['metrics_after_load'] = fetch_metrics(base_url)
+
+            print(f"📊 Analytics endpoints ({args.endpoint_runs} runs each)...")
+            size['endpoints'] = time_endpoints(base_url, args.endpoint_runs)
+        finally:
+            if server is not None:
+                server.stop()
+        # After stop: the workers flushed their click buffers on exit
+        size['bot_tagged'] = bot_tagged(args.database_url, first_click_id)
+        print(f"🤖 Bot-tagged clicks: {size['bot_tagged']['bot_clicks']:,} of {size['bot_tagged']['clicks']:,}")
+        results['sizes'].append(size)
+
+        # Written after every size so an interrupted run keeps what it measured
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+    print(f"\n💾 Results: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n🔍 Compared with {args.compare} (commit {baseline.get('git_commit')}):")
+        results['regressions'] = compare(results, baseline, args.max_regression)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        if results['regressions']:
+            print(f"\n❌ {len(results['regressions'])} regression(s) above +{args.max_regression:.0%}")
+            sys.exit(1)
+        print("\n✅ No regression")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Bot Filter
+Classification des hits de /c/<link_id> avant écriture : aperçus de liens, scanners de sécurité, rafales
+"""
+
+import csv
+import ipaddress
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from geolocation import IPRangeTable, parse_ip
+
+# Columns written by the click buffer (see migrations.py)
+BOT_COLUMNS = '''
+    ALTER TABLE clicks ADD COLUMN IF NOT EXISTS is_bot BOOLEAN NOT NULL DEFAULT FALSE;
+    ALTER TABLE clicks ADD COLUMN IF NOT EXISTS bot_reason VARCHAR(32);
+'''
+
+MODES = ('tag', 'drop', 'off')
+
+EMAIL_SCANNER_VENDORS = (r'Barracuda|Mimecast|Proofpoint|ppops|MessageLabs|Symantec|Forcepoint|Sophos|Trend ?Micro|'
+                         r'FireEye|Trellix|Cisco|IronPort|ZScaler|Fortinet|SafeLinks|urldefense|Avanan|Check ?Point')
+
+# (reason, user-agent pattern) - evaluated as one compiled alternation, first match wins
+USER_AGENT_RULES = [
+    # Link previews / unfurlers
+    ('preview:linkedin', r'LinkedInBot'),
+    ('preview:slack', r'Slackbot|Slack-ImgProxy'),
+    ('preview:microsoft', r'SkypeUriPreview|MicrosoftPreview|Microsoft Office|ms-office'),
+    ('preview:social', r'facebookexternalhit|Facebot|Twitterbot|WhatsApp|TelegramBot|Discordbot|Pinterest|redditbot|Embedly|vkShare'),
+    ('preview:apple', r'Applebot'),
+    ('preview:google', r'Google-PageRenderer|GoogleImageProxy|Googlebot|AdsBot-Google|FeedFetcher-Google'),
+    # Email security scanners: the vendor name as the product token that starts the user
+    # agent, or as a versioned token (corporate browser builds may mention a vendor elsewhere)
+    ('scanner:email', r'(?:^|[\s;(])(?:' + EMAIL_SCANNER_VENDORS + r')[\w.-]*/\d|^(?:' + EMAIL_SCANNER_VENDORS + r')\b'),
+    # Scripts, headless browsers and generic crawlers
+    ('scanner:headless', r'HeadlessChrome|PhantomJS|Puppeteer|Playwright|Selenium|Lighthouse'),
+    ('scanner:script', r'^(?:curl|Wget|python-requests|python-urllib|aiohttp|Go-http-client|Java/|okhttp|'
+                       r'axios|node-fetch|libwww-perl|HTTPie|Apache-HttpClient|Ruby|PostmanRuntime)'),
+    # Versioned product tokens (AhrefsBot/7.0, SiteChecker/1.2) or a "+https://..." contact URL
+    ('crawler', r'(?:bot|crawler|spider|scanner|preview|fetcher|monitor|validator|checker)/\d|\+https?://'),
+]
+
+
+def compile_rules(rules):
+    """One case-insensitive regex for all rules: the match's lastgroup names the rule"""
+    groups = [f'(?P<r{i}>{pattern})' for i, (_reason, pattern) in enumerate(rules)]
+    return re.compile('|'.join(groups), re.IGNORECASE), {f'r{i}': reason for i, (reason, _p) in enumerate(rules)}
+
+
+def load_ip_ranges(path):
+    """IPRangeTable of scanner networks from a CSV: network,label (CIDR) or start_ip,end_ip,label"""
+    def rows():
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    if '/' in row[0]:
+                        network = ipaddress.ip_network(row[0].strip(), strict=False)
+                        start, end = int(network.network_address), int(network.broadcast_address)
+                        label = row[1] if len(row) > 1 else 'scanner'
+                    else:
+                        start = int(ipaddress.ip_address(row[0].strip()))
+                        end = int(ipaddress.ip_address(row[1].strip()))
+                        label = row[2] if len(row) > 2 else 'scanner'
+                except (ValueError, IndexError):
+                    continue  # header line or malformed row
+                yield start, end, label.strip(), ''
+    return IPRangeTable(rows())
+
+
+class BotFilter:
+    """Classifies a hit as human (None) or bot (reason) without I/O
+
+    Rules, in order:
+    - empty user agent
+    - user-agent rules (USER_AGENT_RULES plus BOT_EXTRA_UA_PATTERN), one compiled regex
+    - scanner IP ranges (BOT_IP_RANGES_PATH), binary search in an IPRangeTable
+    - burst: the `burst_hits`-th hit on the same link within `burst_window`
+      seconds (scanners opening every link of a delivered email at once) and
+      every later one; the earlier hits of the burst are tagged in the click
+      buffer, which holds clicks `burst_hold` seconds for that
+
+    Burst state is per worker: a burst spread over several workers is only
+    caught once one of them sees `burst_hits` hits.
+
+    Built once per worker. In 'tag' mode bot hits are stored with
+    clicks.is_bot and left out of the counters, rollups, sketches, hot
+    leads and geolocation; in 'drop' mode they are not stored at all.
+    """
+
+    def __init__(self, mode='tag', extra_pattern=None, ip_ranges=None, burst_hits=3, burst_window=2.0,
+                 max_tracked_links=10000):
+        if mode not in MODES:
+            raise ValueError(f"Invalid BOT_FILTER_MODE '{mode}' (expected one of: {', '.join(MODES)})")
+        self.mode = mode
+        rules = list(USER_AGENT_RULES)
+        if extra_pattern:
+            rules.insert(0, ('custom', extra_pattern))
+        self._ua_regex, self._ua_reasons = compile_rules(rules)
+        self._ip_ranges = ip_ranges
+        self.burst_hits = burst_hits
+        self.burst_window = burst_window
+        self.max_tracked_links = max_tracked_links
+
+        self._recent = OrderedDict()  # link_id -> (window start, hits in window)
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self._checked = 0
+        self._by_reason = {}
+        self._eval_seconds = 0.0
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get('BOT_IP_RANGES_PATH')
+        ip_ranges = load_ip_ranges(path) if path else None
+        if ip_ranges is not None:
+            print(f"🤖 Bot IP ranges loaded: {path} ({len(ip_ranges)} ranges)")
+        return cls(
+            mode=os.environ.get('BOT_FILTER_MODE', 'tag'),
+            extra_pattern=os.environ.get('BOT_EXTRA_UA_PATTERN'),
+            ip_ranges=ip_ranges,
+            burst_hits=int(os.environ.get('BOT_BURST_HITS', 3)),
+            burst_window=float(os.environ.get('BOT_BURST_WINDOW', 2.0)),
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @property
+    def burst_hold(self):
+        """Seconds the click buffer must hold a click so a burst can still tag it"""
+        return self.burst_window if self.enabled and self.burst_hits > 0 else 0.0
+
+    def _burst(self, link_id, now):
+        if self.burst_hits <= 0:
+            return False
+        with self._lock:
+            started, hits = self._recent.pop(link_id, (now, 0))
+            if now - started > self.burst_window:
+                started, hits = now, 0
+            hits += 1
+            self._recent[link_id] = (started, hits)
+            if len(self._recent) > self.max_tracked_links:
+                self._recent.popitem(last=False)
+            return hits >= self.burst_hits
+
+    def classify(self, link_id, ip_address, user_agent):
+        """Bot reason of a hit, or None for a (probable) human"""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        reason = None
+        if not user_agent:
+            reason = 'empty_user_agent'
+        else:
+            match = self._ua_regex.search(user_agent)
+            if match:
+                reason = self._ua_reasons[match.lastgroup]
+        if reason is None and self._ip_ranges is not None:
+            ip = parse_ip(ip_address)
+            if ip is not None:
+                found = self._ip_ranges.lookup(ip)
+                if found is not None:
+                    reason = f'ip:{found[0]}'[:32]
+        if reason is None and self._burst(link_id, time.monotonic()):
+            reason = 'burst'
+
+        self._checked += 1
+        if reason is not None:
+            self._by_reason[reason] = self._by_reason.get(reason, 0) + 1
+        self._eval_seconds += time.perf_counter() - started
+        return reason
+
+    def stats(self):
+        bots = sum(self._by_reason.values())
+        return {
+            'mode': self.mode,
+            'checked': self._checked,
+            'bots': bots,
+            'bot_rate': round(bots / self._checked, 3) if self._checked else None,
+            'by_reason': dict(self._by_reason),
+            'avg_eval_us': round(self._eval_seconds / self._checked * 1e6, 1) if self._checked else None,
+            'ip_ranges': len(self._ip_ranges) if self._ip_ranges is not None else 0,
+            'tracked_links': len(self._recent),
+        }
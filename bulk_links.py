@@ -0,0 +1,150 @@
+"""
+Bulk Links
+Création de liens en masse (tableau JSON ou flux NDJSON) : IDs générés par lot, insertion multi-lignes, erreurs par ligne
+"""
+
+import json
+import os
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Rows inserted per statement / transaction
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+# Rows accepted in one request
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 50000))
+
+# Request fields -> links columns, with the column size (None = TEXT)
+LINK_FIELDS = [
+    ('first_name', 255),
+    ('last_name', 255),
+    ('email', 255),
+    ('icp', 255),
+    ('campaign', 255),
+    ('company_name', 255),
+    ('company_url', None),
+    ('linkedin_url', None),
+    ('destination_url', None),
+]
+
+# Position of the campaign in link_row() values
+CAMPAIGN = [field for field, _size in LINK_FIELDS].index('campaign')
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+# New IDs drawn for rows whose ID is already taken (by a legacy random ID) before the row is reported as failed
+MAX_ID_ATTEMPTS = 5
+
+
+def link_row(data):
+    """Validate one input row: tuple of LINK_FIELDS values, or ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('row must be a JSON object')
+    if not data.get('destination_url'):
+        raise ValueError('destination_url is required')
+
+    data = dict(data, icp=data.get('ICP', data.get('icp', '')), campaign=data.get('campaign') or 'default')
+    values = []
+    for field, size in LINK_FIELDS:
+        value = data.get(field)
+        if value is None:
+            value = ''
+        elif isinstance(value, (dict, list)):
+            raise ValueError(f'{field} must be a string')
+        value = str(value)
+        if size is not None and len(value) > size:
+            raise ValueError(f'{field} is longer than {size} characters')
+        values.append(value)
+    return tuple(values)
+
+
+def iter_rows(request):
+    """(data, error) for each input row of a bulk request, in input order
+
+    NDJSON bodies are read line by line from the request stream, so a large
+    push is never held in memory as a whole; a JSON body must be an array
+    (or {"links": [...]}).
+    """
+    if request.mimetype in NDJSON_TYPES:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError as e:
+                yield None, f'invalid JSON: {e}'
+        return
+
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('links')
+    if not isinstance(body, list):
+        raise ValueError('body must be a JSON array of links (or NDJSON with Content-Type: application/x-ndjson)')
+    for data in body:
+        yield data, None
+
+
+def insert_links(cur, rows, allocate):
+    """Insert validated rows with one multi-row statement: [link_id or error] in row order
+
+    allocate(count, cur) returns new link_ids (ShortIdAllocator.allocate).
+    Allocated IDs never collide with each other; a row whose ID is already
+    taken by a legacy random ID gets a new one and is retried.
+    If the statement fails anyway, rows are inserted one by one under a
+    savepoint so only the faulty rows are reported. Run it inside a
+    transaction; the caller commits.
+    """
+    results = [None] * len(rows)
+    pending = list(range(len(rows)))
+    for _attempt in range(MAX_ID_ATTEMPTS):
+        if not pending:
+            break
+        ids = dict(zip(pending, allocate(len(pending), cur)))
+        values = [(ids[i],) + rows[i] for i in pending]
+        cur.execute('SAVEPOINT bulk_links')
+        try:
+            inserted = execute_values(cur, f'''
+                INSERT INTO links (link_id, {', '.join(field for field, _size in LINK_FIELDS)})
+                VALUES %s
+                ON CONFLICT (link_id) DO NOTHING
+                RETURNING link_id
+            ''', values, page_size=len(values), fetch=True)
+        except psycopg2.Error:
+            cur.execute('ROLLBACK TO SAVEPOINT bulk_links')
+            return _insert_one_by_one(cur, rows, results, pending, allocate)
+        cur.execute('RELEASE SAVEPOINT bulk_links')
+
+        inserted = {link_id for (link_id,) in inserted}
+        for i in pending:
+            if ids[i] in inserted:
+                results[i] = ids[i]
+        pending = [i for i in pending if results[i] is None]
+
+    for i in pending:
+        results[i] = ValueError('could not generate a unique link_id')
+    return results
+
+
+def _insert_one_by_one(cur, rows, results, pending, allocate):
+    for i in pending:
+        cur.execute('SAVEPOINT bulk_link')
+        try:
+            for _attempt in range(MAX_ID_ATTEMPTS):
+                link_id = allocate(1, cur)[0]
+                cur.execute(f'''
+                    INSERT INTO links (link_id, {', '.join(field for field, _size in LINK_FIELDS)})
+                    VALUES ({', '.join(['%s'] * (len(LINK_FIELDS) + 1))})
+                    ON CONFLICT (link_id) DO NOTHING
+                ''', (link_id,) + rows[i])
+                if cur.rowcount:
+                    results[i] = link_id
+                    break
+            else:
+                results[i] = ValueError('could not generate a unique link_id')
+            cur.execute('RELEASE SAVEPOINT bulk_link')
+        except psycopg2.Error as e:
+            cur.execute('ROLLBACK TO SAVEPOINT bulk_link')
+            results[i] = ValueError(str(e).strip())
+    return results
@@ -0,0 +1,193 @@
+"""
+Clay Delivery
+Envoi des webhooks Clay : concurrence bornée, session HTTP partagée, limite de débit par destination, reprises avec backoff
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying (rate limited / server side errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, bursts of `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available (returns the seconds waited)"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """Spend the tokens of the next `seconds` (the destination asked us to back off)"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class ClayDelivery:
+    """Delivers JSON payloads to webhooks, keyed by an item id
+
+    Requests run on `concurrency` threads over one pooled Session; each
+    destination host has its own token bucket. 429 and 5xx answers (and
+    network errors) are retried with exponential backoff and jitter,
+    honoring Retry-After. Confirmed items are reported by batches of
+    `batch_size` through on_batch(keys), in the calling thread, as they
+    complete - so the caller can mark them sent while the rest is in flight.
+    """
+
+    def __init__(self, concurrency=4, rate=5.0, burst=5, max_retries=4, backoff=1.0,
+                 max_backoff=30.0, timeout=10, batch_size=25):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.batch_size = batch_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._throttled = 0
+        self._rate_wait = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            concurrency=int(os.environ.get('CLAY_DELIVERY_CONCURRENCY', 4)),
+            rate=float(os.environ.get('CLAY_RATE_LIMIT', 5)),
+            burst=int(os.environ.get('CLAY_RATE_BURST', 5)),
+            max_retries=int(os.environ.get('CLAY_MAX_RETRIES', 4)),
+            timeout=float(os.environ.get('CLAY_TIMEOUT', 10)),
+            batch_size=int(os.environ.get('CLAY_MARK_BATCH', 25)),
+        )
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def _retry_delay(self, attempt, response):
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass  # HTTP-date form: fall back to the backoff
+        return delay * random.uniform(0.5, 1.0)
+
+    def post(self, url, payload, headers=None):
+        """POST one payload with retries: returns None when accepted, else the error message"""
+        bucket = self._bucket(url)
+        for attempt in range(self.max_retries + 1):
+            waited = bucket.acquire()
+            response, error = None, None
+            try:
+                response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+                if 200 <= response.status_code < 300:
+                    with self._lock:
+                        self._sent += 1
+                        self._rate_wait += waited
+                    return None
+                error = f"Clay webhook returned {response.status_code}"
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            if attempt == self.max_retries:
+                break
+            delay = self._retry_delay(attempt, response)
+            with self._lock:
+                self._retries += 1
+                if response is not None and response.status_code == 429:
+                    self._throttled += 1
+            if response is not None and response.status_code == 429:
+                # Slow every sender to this host down, not only this thread
+                bucket.pause(delay)
+            time.sleep(delay)
+
+        with self._lock:
+            self._failed += 1
+        return error
+
+    def deliver(self, url, items, on_batch=None, headers=None):
+        """Send [(key, payload)] concurrently: returns (sent keys, {key: error})
+
+        on_batch(keys) is called for every `batch_size` confirmed keys, and
+        once more for the remainder. `headers` is a dict, or a function of
+        the key for per-item headers (e.g. an idempotency key).
+        """
+        sent, errors, pending = [], {}, []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='clay-delivery') as pool:
+            futures = {
+                pool.submit(self.post, url, payload, headers(key) if callable(headers) else headers): key
+                for key, payload in items
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    error = future.result()
+                except Exception as e:
+                    error = str(e)
+                if error is not None:
+                    errors[key] = error
+                    continue
+                sent.append(key)
+                pending.append(key)
+                if on_batch is not None and len(pending) >= self.batch_size:
+                    on_batch(pending)
+                    pending = []
+        if on_batch is not None and pending:
+            on_batch(pending)
+        return sent, errors
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sent': self._sent,
+                'failed': self._failed,
+                'retries': self._retries,
+                'throttled': self._throttled,
+                'avg_rate_wait_ms': round(self._rate_wait / self._sent * 1000, 1) if self._sent else None,
+                'concurrency': self.concurrency,
+                'rate_per_host': self.rate,
+            }
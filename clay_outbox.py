@@ -0,0 +1,376 @@
+"""
+Clay Outbox
+Événements hot lead écrits dans la transaction des clics qui franchissent le seuil, puis envoyés à Clay par un dispatcher en arrière-plan
+"""
+
+import os
+import secrets
+import threading
+import time
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+OUTBOX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS clay_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        idempotency_key VARCHAR(64) UNIQUE NOT NULL,
+        event_type VARCHAR(32) NOT NULL,
+        link_id VARCHAR(10) NOT NULL,
+        status VARCHAR(8) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_clay_outbox_pending ON clay_outbox (available_at, id) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_clay_outbox_link_id ON clay_outbox (link_id);
+'''
+
+# Dispatcher leases: a claimed event is 'in_flight' until `available_at`, then claimable again
+OUTBOX_LEASE_SCHEMA = '''
+    ALTER TABLE clay_outbox ALTER COLUMN status TYPE VARCHAR(16);
+    ALTER TABLE clay_outbox ADD COLUMN IF NOT EXISTS lease VARCHAR(32);
+    CREATE INDEX IF NOT EXISTS idx_clay_outbox_in_flight ON clay_outbox (available_at, id) WHERE status = 'in_flight';
+'''
+
+# Per-campaign hot-lead threshold, overriding HOT_LEAD_MIN_CLICKS (0 = no hot leads for the campaign)
+THRESHOLD_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS hot_lead_thresholds (
+        campaign VARCHAR(255) PRIMARY KEY,
+        min_clicks INTEGER NOT NULL CHECK (min_clicks >= 0),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+HOT_LEAD = 'hot_lead'
+
+# Clicks that make a lead hot when its campaign has no threshold of its own (0 = no hot-lead events)
+HOT_LEAD_MIN_CLICKS = int(os.environ.get('HOT_LEAD_MIN_CLICKS', 5))
+
+
+class HotLeadThresholds:
+    """Per-worker copy of hot_lead_thresholds, reloaded every `ttl` seconds
+
+    Click flushes check thresholds in memory, so detecting a crossing costs
+    no query; a change made through another worker applies within `ttl`.
+    """
+
+    def __init__(self, default=HOT_LEAD_MIN_CLICKS, ttl=30):
+        self.default = default
+        self.ttl = ttl
+        self._thresholds = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(ttl=float(os.environ.get('HOT_LEAD_THRESHOLD_TTL', 30)))
+
+    def _load(self, cur):
+        with self._lock:
+            if self._thresholds is None or time.monotonic() - self._loaded_at > self.ttl:
+                cur.execute('SELECT campaign, min_clicks FROM hot_lead_thresholds')
+                self._thresholds = dict(cur.fetchall())
+                self._loaded_at = time.monotonic()
+            return self._thresholds
+
+    def invalidate(self):
+        with self._lock:
+            self._thresholds = None
+
+    def min_clicks(self, cur, campaign):
+        """Threshold of a campaign (0 = disabled)"""
+        return self._load(cur).get(campaign, self.default)
+
+    def lowest(self, cur):
+        """Lowest enabled threshold (None if every campaign is disabled)"""
+        enabled = [value for value in [self.default, *self._load(cur).values()] if value > 0]
+        return min(enabled) if enabled else None
+
+
+thresholds = HotLeadThresholds.from_env()
+
+
+def hot_lead_key(link_id):
+    """Idempotency key of a link's hot-lead event: a lead is queued (and sent) once"""
+    return f'{HOT_LEAD}:{link_id}'
+
+
+def hot_lead_payload(lead):
+    """Clay webhook payload of a hot lead (row of links with its click counters)"""
+    return {
+        'first_name': lead['first_name'],
+        'last_name': lead['last_name'],
+        'email': lead['email'],
+        'company_name': lead['company_name'],
+        'company_url': lead['company_url'],
+        'linkedin_url': lead['linkedin_url'],
+        'icp': lead['icp'],
+        'campaign': lead['campaign'],
+        'click_count': lead['click_count'],
+        'first_clicked': lead['first_clicked'].isoformat() if lead['first_clicked'] else None,
+        'last_clicked': lead['last_clicked'].isoformat() if lead['last_clicked'] else None,
+        'link_id': lead['link_id'],
+        'tracking_url': f"https://{os.getenv('CUSTOM_DOMAIN', 'link-tracker.onrender.com')}/c/{lead['link_id']}"
+    }
+
+
+def enqueue_hot_leads(cur, link_ids):
+    """Queue hot-lead events (leads already queued are left alone): returns the number queued"""
+    if not link_ids:
+        return 0
+    values = [(hot_lead_key(link_id), HOT_LEAD, link_id) for link_id in sorted(link_ids)]
+    execute_values(cur, '''
+        INSERT INTO clay_outbox (idempotency_key, event_type, link_id)
+        VALUES %s
+        ON CONFLICT (idempotency_key) DO NOTHING
+    ''', values, page_size=len(values))
+    return cur.rowcount
+
+
+def record_clicks(cur, counters):
+    """Queue the leads whose click count crossed their campaign's threshold (same transaction as the insert)
+
+    counters: [(link_id, campaign, click_count before, click_count after, sent_to_clay)]
+    as returned by link_counters.record_clicks. Only the links of this
+    flush are looked at, against the cached thresholds. Returns the number queued.
+    """
+    crossed = []
+    for link_id, campaign, before, after, sent_to_clay in counters:
+        min_clicks = thresholds.min_clicks(cur, campaign)
+        if min_clicks > 0 and before < min_clicks <= after and not sent_to_clay:
+            crossed.append(link_id)
+    return enqueue_hot_leads(cur, crossed)
+
+
+class ClayDispatcher:
+    """Background thread draining clay_outbox to the Clay webhook (at least once)
+
+    Every worker may run one: pending events are claimed `batch_size` at a
+    time with a lease (status 'in_flight' until `lease_timeout` seconds
+    from now) in a short transaction, then delivered through ClayDelivery
+    with no transaction open, with their idempotency key (Idempotency-Key
+    header and `event_id`). Results are recorded in a second short
+    transaction: sent events - together with links.sent_to_clay - and
+    failures, retried with a growing delay and given up ('dead') after
+    `max_attempts` claims. A worker dying mid-batch leaves its lease to
+    expire, and the events are claimed again: Clay may see an event twice,
+    never zero times.
+    """
+
+    def __init__(self, get_connection, delivery, webhook_url, interval=2.0, batch_size=25,
+                 max_attempts=10, retry_delay=60, lease_timeout=1800):
+        self.get_connection = get_connection
+        self.delivery = delivery
+        self.webhook_url = webhook_url
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Longer than the slowest batch delivery (retries, backoff, rate limit)
+        self.lease_timeout = lease_timeout
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self._sent = 0
+        self._skipped = 0
+        self._failed = 0
+        self._dead = 0
+        self._failed_batches = 0
+        self._expired_leases = 0
+        self._lost_leases = 0
+        self._lag_total = 0.0
+        self._last_run = None
+
+    @classmethod
+    def from_env(cls, get_connection, delivery):
+        return cls(
+            get_connection,
+            delivery,
+            os.environ.get('CLAY_WEBHOOK_URL'),
+            interval=float(os.environ.get('CLAY_OUTBOX_INTERVAL', 2)),
+            batch_size=int(os.environ.get('CLAY_MARK_BATCH', 25)),
+            max_attempts=int(os.environ.get('CLAY_OUTBOX_MAX_ATTEMPTS', 10)),
+            lease_timeout=float(os.environ.get('CLAY_OUTBOX_LEASE', 1800)),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.webhook_url)
+
+    def ensure_started(self):
+        # Started lazily so the thread lives in the gunicorn worker, not the master
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='clay-dispatcher', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Dispatch now instead of at the next poll (events were just queued)"""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # A full batch means there is probably more waiting
+                if self.dispatch_batch() == self.batch_size:
+                    continue
+            except Exception as e:
+                self._failed_batches += 1
+                print(f"⚠️  Clay outbox dispatch failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _claim(self, lease):
+        """Lease a batch of due events (pending, or in flight with an expired lease) and commit"""
+        conn = self.get_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            # Leases that expired on their last allowed attempt are given up
+            cur.execute('''
+                UPDATE clay_outbox SET status = 'dead', lease = NULL, last_error = 'lease expired'
+                WHERE status = 'in_flight' AND available_at <= LOCALTIMESTAMP AND attempts >= %s
+            ''', (self.max_attempts,))
+            cur.execute('''
+                WITH due AS (
+                    SELECT id, status FROM clay_outbox
+                    WHERE status IN ('pending', 'in_flight') AND available_at <= LOCALTIMESTAMP
+                    ORDER BY available_at, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ), claimed AS (
+                    UPDATE clay_outbox o
+                    SET status = 'in_flight', lease = %s, attempts = o.attempts + 1,
+                        available_at = LOCALTIMESTAMP + %s * INTERVAL '1 second'
+                    FROM due
+                    WHERE o.id = due.id
+                    RETURNING o.id, o.idempotency_key, o.attempts, o.link_id, due.status AS previous_status
+                )
+                SELECT c.id, c.idempotency_key, c.attempts, c.previous_status,
+                       l.link_id, l.first_name, l.last_name, l.email, l.icp, l.campaign,
+                       l.company_name, l.company_url, l.linkedin_url, l.sent_to_clay,
+                       l.click_count, l.first_clicked_at AS first_clicked, l.last_clicked_at AS last_clicked
+                FROM claimed c
+                LEFT JOIN links l ON l.link_id = c.link_id
+            ''', (self.batch_size, lease, self.lease_timeout))
+            events = cur.fetchall()
+            conn.commit()
+            cur.close()
+            return events
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _settle(self, lease, skipped, sent, errors, to_send):
+        """Record delivery results in one short transaction: returns (lags, dead, lost)"""
+        conn = self.get_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            # Delivered events are settled even if their lease expired meanwhile
+            if skipped:
+                cur.execute('''
+                    UPDATE clay_outbox SET status = 'sent', sent_at = LOCALTIMESTAMP, lease = NULL
+                    WHERE id = ANY(%s)
+                ''', ([e['id'] for e in skipped],))
+            lags = []
+            if sent:
+                cur.execute('''
+                    UPDATE clay_outbox SET status = 'sent', sent_at = LOCALTIMESTAMP, lease = NULL
+                    WHERE id = ANY(%s)
+                    RETURNING EXTRACT(EPOCH FROM sent_at - created_at) AS lag
+                ''', (sent,))
+                lags = [row['lag'] for row in cur.fetchall()]
+                cur.execute('''
+                    UPDATE links SET sent_to_clay = TRUE, sent_to_clay_at = NOW()
+                    WHERE link_id = ANY(%s)
+                ''', ([to_send[event_id]['link_id'] for event_id in sent],))
+            dead = [event_id for event_id in errors if to_send[event_id]['attempts'] >= self.max_attempts]
+            lost = 0
+            if errors:
+                # Only while the lease is still ours: an expired one may have been claimed again
+                execute_values(cur, '''
+                    UPDATE clay_outbox o
+                    SET last_error = v.error,
+                        status = CASE WHEN v.dead THEN 'dead' ELSE 'pending' END,
+                        lease = NULL,
+                        available_at = LOCALTIMESTAMP + v.delay * INTERVAL '1 second'
+                    FROM (VALUES %s) AS v(id, error, delay, dead, lease)
+                    WHERE o.id = v.id AND o.status = 'in_flight' AND o.lease = v.lease
+                ''', [
+                    # Exponential retry delay, capped at 64 x retry_delay
+                    (event_id, error, self.retry_delay * 2 ** min(to_send[event_id]['attempts'] - 1, 6),
+                     event_id in dead, lease)
+                    for event_id, error in errors.items()
+                ], page_size=len(errors))
+                lost = len(errors) - cur.rowcount
+            conn.commit()
+            cur.close()
+            return lags, dead, lost
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def dispatch_batch(self):
+        """Claim, deliver and settle one batch of due events: returns the number claimed
+
+        No transaction is open while the webhook is called: the claim and
+        the results are two separate short transactions.
+        """
+        lease = secrets.token_hex(16)
+        events = self._claim(lease)
+        self._last_run = time.time()
+        if not events:
+            return 0
+        self._expired_leases += sum(1 for e in events if e['previous_status'] == 'in_flight')
+
+        # Deleted links and leads already sent by the manual endpoint are settled without a call
+        skipped = [e for e in events if e['link_id'] is None or e['sent_to_clay']]
+        to_send = {e['id']: e for e in events if e['link_id'] is not None and not e['sent_to_clay']}
+        items = [(event_id, dict(hot_lead_payload(e), event_id=e['idempotency_key']))
+                 for event_id, e in to_send.items()]
+        sent, errors = self.delivery.deliver(
+            self.webhook_url, items,
+            headers=lambda event_id: {'Idempotency-Key': to_send[event_id]['idempotency_key']}
+        )
+
+        lags, dead, lost = self._settle(lease, skipped, sent, errors, to_send)
+        self._sent += len(sent)
+        self._skipped += len(skipped)
+        self._failed += len(errors)
+        self._dead += len(dead)
+        self._lost_leases += lost
+        self._lag_total += float(sum(lags))
+        return len(events)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'sent': self._sent,
+            'skipped': self._skipped,
+            'failed': self._failed,
+            'dead': self._dead,
+            'failed_batches': self._failed_batches,
+            'expired_leases': self._expired_leases,
+            'lost_leases': self._lost_leases,
+            'avg_lag_seconds': round(self._lag_total / self._sent, 1) if self._sent else None,
+            'last_run': self._last_run,
+        }
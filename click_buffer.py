@@ -0,0 +1,320 @@
+"""
+Click Buffer
+Écriture différée des clics : regroupés en mémoire, insérés par lots dans `clicks`
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from psycopg2.extras import execute_values
+
+import clay_outbox
+import click_rollups
+import click_sketches
+import first_clicks
+import link_counters
+import response_cache
+
+
+def insert_clicks(cur, events):
+    """Insert a batch of click events with one multi-row statement
+
+    clicked_at is rebuilt from each event's age so it keeps the database
+    clock/timezone semantics of the old DEFAULT CURRENT_TIMESTAMP.
+    Clicks on links that no longer exist are skipped instead of failing
+    the whole batch, and events already stored (same event_id, e.g. a
+    spool replay after a commit whose acknowledgement was lost) are
+    ignored. Returns [(id, link_id, ip_address, clicked_at, is_bot)] for
+    inserted rows.
+    """
+    now = time.time()
+    rows = [
+        (e['event_id'], e['link_id'], max(now - e['ts'], 0.0), e['ip_address'], e['user_agent'], e['referer'],
+         e.get('bot_reason'))  # events spooled before bot filtering have no bot_reason
+        for e in events
+    ]
+    return execute_values(cur, '''
+        INSERT INTO clicks (event_id, link_id, clicked_at, ip_address, user_agent, referer, is_bot, bot_reason)
+        SELECT v.event_id, v.link_id, LOCALTIMESTAMP - v.age * INTERVAL '1 second',
+               v.ip_address, v.user_agent, v.referer, v.bot_reason IS NOT NULL, v.bot_reason
+        FROM (VALUES %s) AS v(event_id, link_id, age, ip_address, user_agent, referer, bot_reason)
+        JOIN links l ON l.link_id = v.link_id
+        ON CONFLICT (event_id) DO NOTHING
+        RETURNING id, link_id, ip_address, clicked_at, is_bot
+    ''', rows, page_size=len(rows), fetch=True)
+
+
+def persist_clicks(cur, events):
+    """Insert click events and update the derived tables in the same transaction
+
+    Bot clicks are stored (is_bot) but left out of the derived tables.
+    Returns (inserted human rows, campaigns that received human clicks).
+    """
+    rows = [row[:4] for row in insert_clicks(cur, events) if not row[4]]
+    campaigns = set()
+    if rows:
+        link_campaigns = click_rollups.record_clicks(cur, rows)
+        counters = link_counters.record_clicks(cur, rows)
+        clay_outbox.record_clicks(cur, counters)
+        click_sketches.record_clicks(cur, rows, link_campaigns)
+        first_clicks.record_clicks(cur, rows, link_campaigns)
+        campaigns = set(link_campaigns.values())
+        response_cache.bump_versions(cur, campaigns)
+    return rows, campaigns
+
+
+class ClickBuffer:
+    """Write-behind buffer for click events
+
+    add() only appends to an in-memory deque. A flusher thread writes the
+    pending events with persist_clicks() when `max_batch` events are
+    waiting or every `flush_interval` seconds, in one transaction, then
+    calls `on_flushed(rows, campaigns)` (geo enrichment, cache invalidation).
+
+    With `hold`, a click stays in memory at least `hold` seconds before it
+    is written, so a burst detected later can still tag its first hits as
+    bots (tag_recent) before anything reaches the counters.
+
+    With a `spool`, a batch that cannot be written within `write_deadline`
+    seconds (and any click arriving while the buffer is full) goes to the
+    local spool file instead; the flusher replays the spool every
+    `replay_interval` seconds once the database accepts writes again.
+    Without a spool, a failed batch is put back in the queue and retried.
+    """
+
+    def __init__(self, get_connection, on_flushed=None, max_batch=500, flush_interval=1.0, maxsize=50000,
+                 spool=None, write_deadline=2.0, replay_interval=5.0, hold=0.0):
+        self.get_connection = get_connection
+        self.on_flushed = on_flushed
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.spool = spool
+        self.write_deadline = write_deadline
+        self.replay_interval = replay_interval
+        self.hold = hold
+        self._last_replay = 0.0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self._added = 0
+        self._dropped = 0
+        self._spooled = 0
+        self._retagged = 0
+        self._flushed = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._flush_time = 0.0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._max_depth = 0
+
+    @classmethod
+    def from_env(cls, get_connection, on_flushed=None, spool=None, hold=0.0):
+        return cls(
+            get_connection,
+            on_flushed=on_flushed,
+            max_batch=int(os.environ.get('CLICK_BATCH_SIZE', 500)),
+            flush_interval=float(os.environ.get('CLICK_FLUSH_INTERVAL', 1.0)),
+            maxsize=int(os.environ.get('CLICK_BUFFER_SIZE', 50000)),
+            spool=spool,
+            write_deadline=float(os.environ.get('CLICK_WRITE_DEADLINE', 2.0)),
+            hold=hold,
+        )
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if not self._stopping and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+                self._thread.start()
+
+    def add(self, link_id, ip_address, user_agent, referer, bot_reason=None):
+        """Queue a click - returns False if the buffer is full and the click was not kept in memory"""
+        event = {
+            'event_id': uuid.uuid4().hex,
+            'link_id': link_id,
+            'ts': time.time(),
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'referer': referer,
+            'bot_reason': bot_reason,
+        }
+        self._ensure_started()
+        with self._cond:
+            full = len(self._pending) >= self.maxsize
+            if not full:
+                self._pending.append(event)
+                self._added += 1
+                depth = len(self._pending)
+                self._max_depth = max(self._max_depth, depth)
+                if depth >= self.max_batch and self._batch_due():
+                    self._cond.notify()
+        if full:
+            self._spool_or_drop([event])
+            return False
+        return True
+
+    def _spool_or_drop(self, events):
+        if self.spool is not None:
+            try:
+                self.spool.append(events)
+                self._spooled += len(events)
+                return
+            except OSError as e:
+                print(f"⚠️  Click spool write failed ({len(events)} clicks): {e}")
+        self._dropped += len(events)
+
+    def _batch_due(self):
+        """A full batch has been held long enough (caller holds _cond)"""
+        if len(self._pending) < self.max_batch:
+            return False
+        return self.hold <= 0 or self._pending[self.max_batch - 1]['ts'] <= time.time() - self.hold
+
+    def _take_batch(self, force=False):
+        with self._cond:
+            cutoff = time.time() - self.hold
+            batch = []
+            while self._pending and len(batch) < self.max_batch and (force or self._pending[0]['ts'] <= cutoff):
+                batch.append(self._pending.popleft())
+            return batch
+
+    def tag_recent(self, link_id, since, reason):
+        """Tag the clicks of a link still held in memory since `since` (time.time()) as bots
+
+        Returns the number tagged. Clicks already written are left as they are.
+        """
+        tagged = 0
+        with self._cond:
+            for event in reversed(self._pending):
+                if event['ts'] < since:
+                    break
+                if event['link_id'] == link_id and event.get('bot_reason') is None:
+                    event['bot_reason'] = reason
+                    tagged += 1
+            self._retagged += tagged
+        return tagged
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._pending.extendleft(reversed(batch))
+            while len(self._pending) > self.maxsize:
+                self._pending.pop()
+                self._dropped += 1
+
+    def flush(self, force=False):
+        """Write the pending clicks held long enough (all of them with force); returns the number written"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch(force)
+                if not batch:
+                    return written
+                if not self._write(batch):
+                    if self.spool is None:
+                        self._requeue(batch)
+                        return written
+                    # Database is slow or down: spool everything pending right away
+                    with self._cond:
+                        batch.extend(self._pending)
+                        self._pending.clear()
+                    self._spool_or_drop(batch)
+                    return written
+                written += len(batch)
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            conn = self.get_connection(timeout=self.write_deadline)
+            try:
+                cur = conn.cursor()
+                cur.execute('SET LOCAL statement_timeout = %s', (int(self.write_deadline * 1000),))
+                rows, campaigns = persist_clicks(cur, batch)
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            self._failed_batches += 1
+            print(f"⚠️  Click flush failed ({len(batch)} clicks): {e}")
+            return False
+
+        elapsed = (time.monotonic() - started) * 1000
+        self._batches += 1
+        self._flushed += len(batch)
+        self._flush_time += elapsed
+        self._last_flush_ms = elapsed
+        self._max_flush_ms = max(self._max_flush_ms, elapsed)
+
+        if self.on_flushed is not None:
+            try:
+                self.on_flushed(rows, campaigns)
+            except Exception as e:
+                print(f"⚠️  Click post-flush hook failed: {e}")
+        return True
+
+    def replay_spool(self):
+        """Drain the spool into the database; returns the number of clicks replayed"""
+        self._last_replay = time.monotonic()
+        if self.spool is None or not self.spool.has_pending():
+            return 0
+        with self._flush_lock:
+            replayed = self.spool.replay(self._write)
+        if replayed:
+            print(f"💾 Replayed {replayed} spooled clicks")
+        return replayed
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                if not self._batch_due() and not self._stopping:
+                    self._cond.wait(self.flush_interval + backoff)
+                if self._stopping:
+                    return
+            before = self._failed_batches
+            self.flush()
+            healthy = self._failed_batches == before
+            if self.spool is not None:
+                self.spool.sync()
+                if healthy and time.monotonic() - self._last_replay >= self.replay_interval:
+                    self.replay_spool()
+            # Back off while the database keeps failing
+            backoff = 0.0 if healthy else min(backoff * 2 or 1.0, 30.0)
+
+    def close(self, timeout=None):
+        """Stop the flusher thread and write what is left (worker shutdown)"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        written = self.flush(force=True)
+        if self.spool is not None:
+            self.spool.close()
+        return written
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._pending),
+            'queue_capacity': self.maxsize,
+            'queue_max_depth': self._max_depth,
+            'added_total': self._added,
+            'dropped_total': self._dropped,
+            'spooled_total': self._spooled,
+            'retagged_total': self._retagged,
+            'flushed_total': self._flushed,
+            'batches_total': self._batches,
+            'failed_batches_total': self._failed_batches,
+            'avg_flush_ms': round(self._flush_time / self._batches, 2) if self._batches else 0,
+            'last_flush_ms': round(self._last_flush_ms, 2),
+            'max_flush_ms': round(self._max_flush_ms, 2),
+        }
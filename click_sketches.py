@@ -0,0 +1,283 @@
+"""
+Click Sketches
+Sketches HyperLogLog horaires par campagne (link_id et adresse IP) : visiteurs uniques estimés sur n'importe quelle période
+"""
+
+from datetime import datetime, timedelta
+
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+
+from geolocation import parse_ip
+from hll import DEFAULT_PRECISION, HyperLogLog
+
+SKETCH_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS click_sketches_hourly (
+        campaign VARCHAR(255) NOT NULL,
+        bucket_hour TIMESTAMP NOT NULL,
+        kind VARCHAR(8) NOT NULL,
+        sketch BYTEA NOT NULL,
+        PRIMARY KEY (campaign, bucket_hour, kind)
+    );
+    CREATE INDEX IF NOT EXISTS idx_click_sketches_hour ON click_sketches_hourly (bucket_hour);
+'''
+
+# Union of every hourly sketch before `through`, per campaign and kind: seeds first_seen()
+CUMULATIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS click_sketches_cumulative (
+        campaign VARCHAR(255) NOT NULL,
+        kind VARCHAR(8) NOT NULL,
+        through TIMESTAMP NOT NULL,
+        sketch BYTEA NOT NULL,
+        PRIMARY KEY (campaign, kind)
+    )
+'''
+
+# The cumulative sketches stay this many days behind: every range (up to 30d) starts after them
+CUMULATIVE_LAG_DAYS = 31
+
+# pg_try_advisory_xact_lock key: one process at a time rolls the cumulative sketches forward
+CUMULATIVE_LOCK_ID = 72465438
+
+# What a sketch counts: distinct links (one link = one person) or distinct client IPs
+KINDS = ('link', 'ip')
+
+
+def _visitor(kind, link_id, ip_address):
+    if kind == 'link':
+        return link_id
+    ip = parse_ip(ip_address)
+    return str(ip) if ip is not None else None
+
+
+def record_clicks(cur, rows, campaigns, precision=DEFAULT_PRECISION):
+    """Add freshly inserted clicks to the hourly sketches (same transaction as the insert)
+
+    rows: [(id, link_id, ip_address, clicked_at)] as returned by insert_clicks,
+    campaigns: {link_id: campaign}. Missing rows are created empty first, so
+    the SELECT ... FOR UPDATE below always locks the row it merges into,
+    even when two workers add the first clicks of an hour at the same time.
+    """
+    sketches = {}
+    for _id, link_id, ip_address, clicked_at in rows:
+        hour = clicked_at.replace(minute=0, second=0, microsecond=0)
+        for kind in KINDS:
+            visitor = _visitor(kind, link_id, ip_address)
+            if visitor is not None:
+                key = (campaigns.get(link_id) or '', hour, kind)
+                sketches.setdefault(key, HyperLogLog(precision)).add(visitor)
+    if not sketches:
+        return
+
+    # Sorted so concurrent workers lock sketch rows in the same order
+    keys = sorted(sketches)
+    execute_values(cur, '''
+        INSERT INTO click_sketches_hourly (campaign, bucket_hour, kind, sketch)
+        VALUES %s
+        ON CONFLICT (campaign, bucket_hour, kind) DO NOTHING
+    ''', [key + (Binary(b''),) for key in keys], page_size=len(keys))
+    stored = execute_values(cur, '''
+        SELECT s.campaign, s.bucket_hour, s.kind, s.sketch
+        FROM click_sketches_hourly s
+        JOIN (VALUES %s) AS v(campaign, bucket_hour, kind)
+          ON s.campaign = v.campaign AND s.bucket_hour = v.bucket_hour AND s.kind = v.kind
+        ORDER BY s.campaign, s.bucket_hour, s.kind
+        FOR UPDATE OF s
+    ''', keys, page_size=len(keys), fetch=True)
+
+    updates = []
+    for campaign, hour, kind, sketch in stored:
+        merged = HyperLogLog.from_bytes(sketch, precision).merge(sketches[(campaign, hour, kind)])
+        updates.append((campaign, hour, kind, Binary(merged.to_bytes())))
+    execute_values(cur, '''
+        UPDATE click_sketches_hourly s
+        SET sketch = v.sketch
+        FROM (VALUES %s) AS v(campaign, bucket_hour, kind, sketch)
+        WHERE s.campaign = v.campaign AND s.bucket_hour = v.bucket_hour AND s.kind = v.kind
+    ''', updates, page_size=len(updates))
+
+    # Clicks older than the lag (spool replays) may fall before `through`: their hours were
+    # already folded into the cumulative sketches, which must take them in too
+    old = {key: sketch for key, sketch in sketches.items()
+           if key[1] < datetime.now() - timedelta(days=CUMULATIVE_LAG_DAYS - 2)}
+    if old:
+        _merge_cumulative(cur, old, precision)
+
+
+def _merge_cumulative(cur, sketches, precision=DEFAULT_PRECISION):
+    """Merge {(campaign, hour, kind): sketch} into the cumulative sketches whose `through` is past the hour"""
+    merged = {}
+    for (campaign, hour, kind), sketch in sorted(sketches.items()):
+        merged.setdefault((campaign, kind), []).append((hour, sketch))
+    cur.execute('''
+        SELECT campaign, kind, through, sketch FROM click_sketches_cumulative
+        WHERE (campaign, kind) IN %s
+        ORDER BY campaign, kind
+        FOR UPDATE
+    ''', (tuple(sorted(merged)),))
+    updates = []
+    for campaign, kind, through, stored in cur.fetchall():
+        cumulative = HyperLogLog.from_bytes(stored, precision)
+        folded = [sketch for hour, sketch in merged[(campaign, kind)] if hour < through]
+        for sketch in folded:
+            cumulative.merge(sketch)
+        if folded:
+            updates.append((Binary(cumulative.to_bytes()), campaign, kind))
+    for update in updates:
+        cur.execute('UPDATE click_sketches_cumulative SET sketch = %s WHERE campaign = %s AND kind = %s', update)
+
+
+def advance_cumulative(cur, lag_days=CUMULATIVE_LAG_DAYS, precision=DEFAULT_PRECISION):
+    """Fold the hourly sketches older than `lag_days` (whole days) into the cumulative ones
+
+    Reads only the hours between the current `through` and the new one (the
+    whole history the first time). Returns the new `through`, or None if
+    there was nothing to do or another process is doing it. The caller commits.
+    """
+    cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (CUMULATIVE_LOCK_ID,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT date_trunc('day', LOCALTIMESTAMP - %s * INTERVAL '1 day')", (lag_days,))
+    target = cur.fetchone()[0]
+    cur.execute('SELECT campaign, kind, through, sketch FROM click_sketches_cumulative ORDER BY campaign, kind FOR UPDATE')
+    cumulative = {(campaign, kind): (through, HyperLogLog.from_bytes(sketch, precision))
+                  for campaign, kind, through, sketch in cur.fetchall()}
+    start = min((through for through, _sketch in cumulative.values()), default=None)
+    if start is not None and start >= target:
+        return None
+
+    hours = cur.connection.cursor(name='click_sketches_advance')
+    hours.itersize = 10000
+    hours.execute(f'''
+        SELECT campaign, kind, bucket_hour, sketch FROM click_sketches_hourly
+        WHERE bucket_hour < %s {'AND bucket_hour >= %s' if start is not None else ''}
+    ''', (target, start) if start is not None else (target,))
+    for campaign, kind, hour, sketch in hours:
+        through, union = cumulative.get((campaign, kind), (None, None))
+        if union is None:
+            union = HyperLogLog(precision)
+            cumulative[(campaign, kind)] = (None, union)
+        if through is None or hour >= through:
+            union.merge(HyperLogLog.from_bytes(sketch, precision))
+    hours.close()
+
+    execute_values(cur, '''
+        INSERT INTO click_sketches_cumulative (campaign, kind, through, sketch) VALUES %s
+        ON CONFLICT (campaign, kind) DO UPDATE SET through = EXCLUDED.through, sketch = EXCLUDED.sketch
+    ''', [(campaign, kind, target, Binary(union.to_bytes()))
+          for (campaign, kind), (_through, union) in sorted(cumulative.items())])
+    return target
+
+
+def first_seen(cur, period_expr, since_expr=None, campaign=None, kind='link'):
+    """Estimated new visitors per period since `since_expr`: {period: count}
+
+    Like the exact first_clicks queries, a visitor is counted in the period
+    of their first click ever. Sketches are merged in hour order into one
+    running union; a period's new visitors are the growth of the union's
+    estimate over that period (sketches before `since_expr` only seed the
+    union), so the periods add up to the estimated new visitors of the range.
+
+    period_expr: SQL expression of `s.bucket_hour` giving the period
+    (e.g. the hour itself, or a day/week floor from timeline.Bucket).
+
+    The union is seeded with the cumulative sketches (everything before
+    their `through`), so only the hours from `through` on are read: at most
+    CUMULATIVE_LAG_DAYS days before the range, whatever the history length.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Invalid unique_by '{kind}' (expected one of: {', '.join(KINDS)})")
+    conditions, params = ['s.kind = %s'], [kind]
+    if campaign:
+        conditions.append('s.campaign = %s')
+        params.append(campaign)
+
+    # Plain tuples whatever the caller's cursor factory (same transaction)
+    tuples = cur.connection.cursor()
+    union = HyperLogLog(DEFAULT_PRECISION)
+    in_range = 'TRUE'
+    if since_expr:
+        in_range = f's.bucket_hour >= {since_expr}'
+        tuples.execute(f'''
+            SELECT s.through, s.sketch
+            FROM click_sketches_cumulative s
+            WHERE {' AND '.join(conditions)} AND s.through <= {since_expr}
+        ''', params)
+        cumulative = tuples.fetchall()
+        if cumulative:
+            for _through, sketch in cumulative:
+                union.merge(HyperLogLog.from_bytes(sketch))
+            # Hours already in a cumulative sketch may be merged again: a union is idempotent
+            conditions.append('s.bucket_hour >= %s')
+            params.append(min(through for through, _sketch in cumulative))
+
+    tuples.execute(f'''
+        SELECT {period_expr}, s.sketch, {in_range}
+        FROM click_sketches_hourly s
+        WHERE {' AND '.join(conditions)}
+        ORDER BY s.bucket_hour
+    ''', params)
+    rows = tuples.fetchall()
+    tuples.close()
+
+    new_visitors = {}
+    seen = union.count()
+    for period, sketch, in_range in rows:
+        union.merge(HyperLogLog.from_bytes(sketch))
+        total = union.count()
+        if in_range:
+            # Estimates are noisy: never report a shrinking union as negative visitors
+            new_visitors[period] = new_visitors.get(period, 0) + max(total - seen, 0)
+        seen = max(seen, total)
+    return new_visitors
+
+
+def rebuild(cur, precision=DEFAULT_PRECISION, batch_size=1000):
+    """Recompute all sketches from the clicks table (backfill / repair)
+
+    Clicks are streamed in (campaign, hour) order so only one hour's
+    sketches are in memory at a time. The exclusive lock makes concurrent
+    click flushes wait, so no click is counted twice or missed meanwhile.
+    """
+    cur.execute('LOCK TABLE click_sketches_hourly IN EXCLUSIVE MODE')
+    cur.execute('DELETE FROM click_sketches_hourly')
+    # Rebuilt from the new hourly sketches by the next advance_cumulative()
+    cur.execute('DELETE FROM click_sketches_cumulative')
+
+    written = 0
+    pending = []
+
+    def write(values):
+        execute_values(cur, '''
+            INSERT INTO click_sketches_hourly (campaign, bucket_hour, kind, sketch) VALUES %s
+        ''', values, page_size=len(values))
+        return len(values)
+
+    clicks = cur.connection.cursor(name='click_sketches_rebuild')
+    clicks.itersize = 50000
+    clicks.execute('''
+        SELECT COALESCE(l.campaign, ''), date_trunc('hour', c.clicked_at), c.link_id, c.ip_address
+        FROM clicks c
+        JOIN links l ON l.link_id = c.link_id
+        WHERE NOT c.is_bot
+        ORDER BY 1, 2
+    ''')
+    current, sketches = None, {}
+    for campaign, hour, link_id, ip_address in clicks:
+        if (campaign, hour) != current:
+            pending.extend((current + (kind,), Binary(sketch.to_bytes())) for kind, sketch in sketches.items())
+            current, sketches = (campaign, hour), {}
+            if len(pending) >= batch_size:
+                written += write([key + (sketch,) for key, sketch in pending])
+                pending = []
+        for kind in KINDS:
+            visitor = _visitor(kind, link_id, ip_address)
+            if visitor is not None:
+                sketches.setdefault(kind, HyperLogLog(precision)).add(visitor)
+    clicks.close()
+
+    if current is not None:
+        pending.extend((current + (kind,), Binary(sketch.to_bytes())) for kind, sketch in sketches.items())
+    if pending:
+        written += write([key + (sketch,) for key, sketch in pending])
+    return written
@@ -0,0 +1,169 @@
+"""
+Click Spool
+Journal local (append-only) des clics qui n'ont pas pu être écrits en base
+"""
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+
+class ClickSpool:
+    """Append-only JSON-lines spool for click events, drained once Postgres is back
+
+    Each process appends to its own segment `clicks-<pid>-<n>.spool` and
+    holds an exclusive flock on it while it is active. Writes are flushed
+    to the OS immediately and fsynced at most every `fsync_interval`
+    seconds (and on sync()/close()). replay() seals the local segment and
+    drains every segment nobody holds a lock on, so segments left behind
+    by dead workers are picked up too. Events carry an event_id, and the
+    insert is ON CONFLICT DO NOTHING, so replaying a segment twice is safe.
+    """
+
+    def __init__(self, directory, fsync_interval=0.5, replay_batch=1000):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.replay_batch = replay_batch
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = 0
+        self._dirty = False
+        self._last_fsync = 0.0
+
+        self._spooled = 0
+        self._replayed = 0
+        self._replay_failures = 0
+        self._corrupt_lines = 0
+        self._fsyncs = 0
+
+    @classmethod
+    def from_env(cls):
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool')
+        return cls(
+            os.environ.get('CLICK_SPOOL_DIR', default_dir),
+            fsync_interval=float(os.environ.get('CLICK_SPOOL_FSYNC_INTERVAL', 0.5)),
+        )
+
+    def _open_segment(self):
+        # Created and locked under a name replay() ignores, then renamed into
+        # the pattern: a replayer can never lock (and delete) a fresh segment
+        # before its owner holds the lock
+        os.makedirs(self.directory, exist_ok=True)
+        self._segment += 1
+        name = f'clicks-{os.getpid()}-{self._segment}.spool'
+        temp_path = os.path.join(self.directory, f'.{name}.tmp')
+        f = open(temp_path, 'a', encoding='utf-8')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            os.rename(temp_path, os.path.join(self.directory, name))
+        except OSError:
+            f.close()
+            raise
+        return f
+
+    def _fsync(self):
+        if self._file is not None and self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            self._fsyncs += 1
+        self._last_fsync = time.monotonic()
+
+    def append(self, events):
+        """Durably record click events (fsync is batched)"""
+        if not events:
+            return
+        lines = ''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in events)
+        with self._lock:
+            if self._file is None:
+                self._file = self._open_segment()
+            self._file.write(lines)
+            self._file.flush()
+            self._dirty = True
+            self._spooled += len(events)
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+
+    def sync(self):
+        """fsync pending writes (called periodically by the click flusher)"""
+        with self._lock:
+            self._fsync()
+
+    def _seal(self):
+        """Close the local segment so replay() can take it"""
+        with self._lock:
+            if self._file is not None:
+                self._fsync()
+                self._file.close()  # releases the flock
+                self._file = None
+
+    def pending_segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'clicks-*.spool')))
+
+    def has_pending(self):
+        return bool(self._file is not None or self.pending_segments())
+
+    def _read_segment(self, f):
+        events = []
+        for line in f:
+            if not line.endswith('\n'):
+                break  # torn final write from a crash
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                self._corrupt_lines += 1
+        return events
+
+    def replay(self, write_batch):
+        """Drain spooled clicks with write_batch(events); stops at the first failure
+
+        Returns the number of events handed to write_batch successfully.
+        """
+        self._seal()
+        replayed = 0
+        for path in self.pending_segments():
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue  # drained by another worker meanwhile
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # active segment of a live worker, or being replayed
+                if not os.path.exists(path):
+                    continue
+                events = self._read_segment(f)
+                for i in range(0, len(events), self.replay_batch):
+                    if not write_batch(events[i:i + self.replay_batch]):
+                        self._replay_failures += 1
+                        return replayed
+                    replayed += len(events[i:i + self.replay_batch])
+                os.remove(path)
+                self._replayed += len(events)
+        return replayed
+
+    def close(self):
+        self._seal()
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def stats(self):
+        segments = self.pending_segments()
+        return {
+            'directory': self.directory,
+            'pending_segments': len(segments),
+            'pending_bytes': sum(self._size(p) for p in segments),
+            'spooled_total': self._spooled,
+            'replayed_total': self._replayed,
+            'replay_failures_total': self._replay_failures,
+            'corrupt_lines_total': self._corrupt_lines,
+            'fsyncs_total': self._fsyncs,
+        }
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 """
-Cron job to send hot leads (5+ clicks) to Clay every hour
-Run this script with: python cron_hot_leads.py
+Cron job to catch up on hot leads (past their campaign's click threshold) every hour
+Run this script with: python cron_hot_leads.py [--direct]
+
+Hot leads are queued in clay_outbox by the click that makes them hot and
+sent within seconds by the app's outbox dispatcher. This sweep only queues
+the leads that dispatcher missed (hot before the outbox existed, threshold
+lowered, Clay status reset); the dispatcher sends them. --direct keeps the
+old behavior: the app posts the leads to Clay during the call.
 
 Or set up as a cron job:
 0 * * * * cd /path/to/link-tracker && python cron_hot_leads.py
@@ -15,32 +21,43 @@ from datetime import datetime
 # Configuration
 API_URL = os.environ.get('API_URL', 'https://link-tracker-r68v.onrender.com')
 CLAY_WEBHOOK_URL = os.environ.get('CLAY_WEBHOOK_URL')
-MIN_CLICKS = int(os.environ.get('MIN_CLICKS', 5))
+# Unset: each campaign's hot-lead threshold (HOT_LEAD_MIN_CLICKS / /api/hot-leads/thresholds)
+MIN_CLICKS = int(os.environ['MIN_CLICKS']) if os.environ.get('MIN_CLICKS') else None
 
-def send_hot_leads():
+def send_hot_leads(direct=False):
     """Call the hot-leads webhook endpoint"""
 
-    if not CLAY_WEBHOOK_URL:
+    if direct and not CLAY_WEBHOOK_URL:
         print(f"[{datetime.now()}] ERROR: CLAY_WEBHOOK_URL not set in environment")
         sys.exit(1)
 
     endpoint = f"{API_URL}/api/webhook/hot-leads"
 
-    payload = {
-        "clay_webhook_url": CLAY_WEBHOOK_URL,
-        "min_clicks": MIN_CLICKS
-    }
+    if direct:
+        payload = {
+            "clay_webhook_url": CLAY_WEBHOOK_URL
+        }
+    else:
+        # The app sends queued leads to its own CLAY_WEBHOOK_URL
+        payload = {
+            "enqueue": True
+        }
+    if MIN_CLICKS is not None:
+        payload["min_clicks"] = MIN_CLICKS
 
     try:
-        print(f"[{datetime.now()}] Checking for hot leads (min {MIN_CLICKS} clicks)...")
+        print(f"[{datetime.now()}] Checking for hot leads (min {MIN_CLICKS if MIN_CLICKS is not None else 'per campaign'} clicks)...")
 
-        response = requests.post(endpoint, json=payload, timeout=30)
+        response = requests.post(endpoint, json=payload, timeout=30 if not direct else 600)
 
         if response.status_code == 200:
             data = response.json()
             print(f"[{datetime.now()}] ✅ SUCCESS: {data.get('message')}")
-            print(f"   - Sent: {data.get('sent_count')} leads")
-            print(f"   - Total found: {data.get('total_found')} leads")
+            if direct:
+                print(f"   - Sent: {data.get('sent_count')} leads")
+            else:
+                print(f"   - Queued: {data.get('queued_count', 0)} leads")
+            print(f"   - Total found: {data.get('total_found', 0)} leads")
 
             if data.get('errors'):
                 print(f"   - Errors: {len(data['errors'])}")
@@ -56,4 +73,4 @@ def send_hot_leads():
         sys.exit(1)
 
 if __name__ == '__main__':
-    send_hot_leads()
+    send_hot_leads(direct='--direct' in sys.argv)
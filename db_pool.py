@@ -0,0 +1,239 @@
+"""
+Database Connection Pool
+Pool de connexions PostgreSQL partagé par les threads d'un worker gunicorn
+"""
+
+import itertools
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection could be borrowed before the deadline"""
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection whose close() hands it back to its pool"""
+
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            return super().close()
+        pool.putconn(self)
+
+    def discard(self):
+        """Really close the underlying socket"""
+        self._pool = None
+        if not self.closed:
+            super().close()
+
+
+class ConnectionPool:
+    """Thread-safe, lazily filled pool of PooledConnection objects
+
+    - max_size: hard cap on open connections for this process
+    - max_lifetime: connections older than this are recycled on release
+    - idle_check: connections idle longer than this are pinged before reuse
+    - acquire_timeout: how long getconn() waits when the pool is saturated
+
+    Every borrow gets a new lease number (conn._lease). putconn() with a
+    lease only releases that borrow: a stale handle kept after release
+    (request teardown, double close) cannot hand back a connection that
+    another thread has borrowed since.
+    """
+
+    def __init__(self, dsn, max_size=12, max_lifetime=1800, idle_check=30,
+                 acquire_timeout=10, connect_kwargs=None):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        self.acquire_timeout = acquire_timeout
+        self.connect_kwargs = connect_kwargs or {}
+
+        self._idle = []  # LIFO stack of (conn, released_at)
+        self._size = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._leases = itertools.count(1)
+
+        # Counters exposed through stats()
+        self._acquired = 0
+        self._created = 0
+        self._recycled = 0
+        self._broken = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._stale_releases = 0
+
+    @classmethod
+    def from_env(cls, dsn):
+        """Build a pool sized from DB_POOL_* variables (set by gunicorn_config.py)"""
+        return cls(
+            dsn,
+            max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 12)),
+            max_lifetime=int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            idle_check=int(os.environ.get('DB_POOL_IDLE_CHECK', 30)),
+            acquire_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            connect_kwargs={
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+                'keepalives': 1,
+                'keepalives_idle': 30,
+            },
+        )
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, **self.connect_kwargs)
+        conn._pool = self
+        conn._created_at = time.monotonic()
+        conn._checked_out = True
+        conn._lease = next(self._leases)
+        return conn
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn._created_at > self.max_lifetime:
+            return False
+        if idle_for < self.idle_check:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Borrow a connection, waiting up to `timeout` seconds if the pool is full"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            released_at = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f'No database connection available after {timeout}s '
+                                          f'(pool size {self.max_size})')
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                break
+
+            if self._is_healthy(conn, time.monotonic() - released_at):
+                with self._cond:
+                    conn._checked_out = True
+                    conn._lease = next(self._leases)
+                break
+
+            # Stale or broken: drop it and try again
+            conn.discard()
+            with self._cond:
+                self._size -= 1
+                self._recycled += 1
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, lease=None):
+        """Return a borrowed connection; uncommitted work is rolled back
+
+        With `lease`, nothing happens unless the connection is still out
+        under that borrow. Returns True if the connection was released.
+        """
+        with self._cond:
+            if not getattr(conn, '_checked_out', False) or (lease is not None and lease != conn._lease):
+                # Already returned (double close), possibly borrowed again since
+                self._stale_releases += 1
+                return False
+            conn._checked_out = False
+
+        keep = not conn.closed
+        if keep and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                keep = False
+        if keep and conn.autocommit:
+            conn.autocommit = False
+        if keep and time.monotonic() - conn._created_at > self.max_lifetime:
+            keep = False
+
+        if not keep:
+            broken = conn.closed
+            conn.discard()
+        with self._cond:
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+                if broken:
+                    self._broken += 1
+                else:
+                    self._recycled += 1
+            self._cond.notify()
+        return True
+
+    def closeall(self):
+        """Close idle connections (borrowed ones are closed when returned)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.max_lifetime = 0
+        for conn, _ in idle:
+            conn.discard()
+
+    def stats(self):
+        """Snapshot of pool usage, used to watch for saturation"""
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'open': self._size,
+                'idle': len(self._idle),
+                'in_use': in_use,
+                'waiting': self._waiting,
+                'saturation': round(in_use / self.max_size, 2) if self.max_size else 0,
+                'acquired_total': self._acquired,
+                'created_total': self._created,
+                'recycled_total': self._recycled,
+                'broken_total': self._broken,
+                'timeouts_total': self._timeouts,
+                'stale_releases_total': self._stale_releases,
+                'avg_wait_ms': round(self._wait_total / self._acquired * 1000, 2) if self._acquired else 0,
+                'max_wait_ms': round(self._wait_max * 1000, 2),
+            }
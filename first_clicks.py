@@ -0,0 +1,96 @@
+"""
+First Clicks
+Premier clic de chaque lien (date, campagne, pays), enregistré à l'écriture des clics : base des visiteurs uniques exacts
+"""
+
+from psycopg2.extras import execute_values
+
+FIRST_CLICK_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS first_clicks (
+        link_id VARCHAR(10) PRIMARY KEY,
+        click_id INTEGER NOT NULL,
+        clicked_at TIMESTAMP NOT NULL,
+        campaign VARCHAR(255),
+        country VARCHAR(100)
+    );
+    CREATE INDEX IF NOT EXISTS idx_first_clicks_campaign_clicked_at ON first_clicks (campaign, clicked_at);
+    CREATE INDEX IF NOT EXISTS idx_first_clicks_clicked_at ON first_clicks (clicked_at);
+    CREATE INDEX IF NOT EXISTS idx_first_clicks_click_id ON first_clicks (click_id);
+'''
+
+
+def record_clicks(cur, rows, campaigns):
+    """Record the first click of links clicked for the first time (same transaction as the insert)
+
+    rows: [(id, link_id, ip_address, clicked_at)] as returned by insert_clicks,
+    campaigns: {link_id: campaign}. An existing row is only replaced by an
+    earlier click (e.g. an old click replayed from the spool); its country
+    is then reset until the geo enricher fills it in again.
+    """
+    first = {}
+    for click_id, link_id, _ip, clicked_at in rows:
+        if link_id not in first or clicked_at < first[link_id][1]:
+            first[link_id] = (click_id, clicked_at)
+    if not first:
+        return
+
+    # Sorted so concurrent workers lock first_clicks rows in the same order
+    values = [
+        (link_id, click_id, clicked_at, campaigns.get(link_id))
+        for link_id, (click_id, clicked_at) in sorted(first.items())
+    ]
+    execute_values(cur, '''
+        INSERT INTO first_clicks (link_id, click_id, clicked_at, campaign)
+        VALUES %s
+        ON CONFLICT (link_id) DO UPDATE
+        SET click_id = EXCLUDED.click_id, clicked_at = EXCLUDED.clicked_at, country = NULL
+        WHERE EXCLUDED.clicked_at < first_clicks.clicked_at
+    ''', values, page_size=len(values))
+
+
+def record_countries(cur, rows):
+    """Copy geolocated countries onto first clicks: rows = [(click_id, country, city)]"""
+    execute_values(cur, '''
+        UPDATE first_clicks f SET country = v.country
+        FROM (VALUES %s) AS v(id, country, city)
+        WHERE f.click_id = v.id
+    ''', rows)
+
+
+def backfill(cur, first_id, last_id):
+    """Merge the first human click of each link among clicks first_id..last_id (batched backfill)
+
+    Same rows as rebuild(), country included, for one id range: a link's
+    row is only replaced by an earlier click. Returns the rows written.
+    """
+    cur.execute('''
+        INSERT INTO first_clicks (link_id, click_id, clicked_at, campaign, country)
+        SELECT DISTINCT ON (c.link_id) c.link_id, c.id, c.clicked_at, l.campaign, c.country
+        FROM clicks c
+        JOIN links l ON l.link_id = c.link_id
+        WHERE c.id BETWEEN %s AND %s AND NOT c.is_bot
+        ORDER BY c.link_id, c.clicked_at, c.id
+        ON CONFLICT (link_id) DO UPDATE
+        SET click_id = EXCLUDED.click_id, clicked_at = EXCLUDED.clicked_at, country = EXCLUDED.country
+        WHERE (EXCLUDED.clicked_at, EXCLUDED.click_id) < (first_clicks.clicked_at, first_clicks.click_id)
+    ''', (first_id, last_id))
+    return cur.rowcount
+
+
+def rebuild(cur):
+    """Recompute the table from the clicks table (backfill / repair)
+
+    The exclusive lock makes concurrent click flushes wait, so no first
+    click is missed while the table is rebuilt.
+    """
+    cur.execute('LOCK TABLE first_clicks IN EXCLUSIVE MODE')
+    cur.execute('DELETE FROM first_clicks')
+    cur.execute('''
+        INSERT INTO first_clicks (link_id, click_id, clicked_at, campaign, country)
+        SELECT DISTINCT ON (c.link_id) c.link_id, c.id, c.clicked_at, l.campaign, c.country
+        FROM clicks c
+        JOIN links l ON l.link_id = c.link_id
+        WHERE NOT c.is_bot
+        ORDER BY c.link_id, c.clicked_at, c.id
+    ''')
+    return cur.rowcount
@@ -0,0 +1,543 @@
+"""
+Geolocation
+Enrichissement pays/ville des clics en arrière-plan, hors du chemin de redirection
+"""
+
+import bisect
+import csv
+import ipaddress
+import os
+import queue
+import threading
+import time
+from array import array
+
+from psycopg2.extras import execute_values
+
+from ttl_cache import TTLCache
+
+# Optional reader for MaxMind .mmdb databases
+try:
+    import maxminddb
+    MAXMIND_AVAILABLE = True
+except ImportError:
+    MAXMIND_AVAILABLE = False
+    maxminddb = None
+
+UNKNOWN = ('Unknown', 'Unknown')
+
+
+def parse_ip(raw):
+    """Return the client ipaddress object from a remote_addr / X-Forwarded-For value
+
+    IPv4-mapped IPv6 addresses (::ffff:8.8.8.8, dual-stack sockets) are
+    returned as the IPv4 address so they hit the IPv4 ranges.
+    """
+    if not raw:
+        return None
+    try:
+        ip = ipaddress.ip_address(raw.split(',')[0].strip())
+    except ValueError:
+        return None
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        return ip.ipv4_mapped
+    return ip
+
+
+def _parse_bound(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.ip_address(value))
+
+
+class IPRangeTable:
+    """Sorted, array-backed IP range table answered by binary search
+
+    IPv4 ranges live in three parallel array('I') columns (start, end,
+    location index); IPv6 bounds do not fit a machine word and are kept in
+    plain int lists. (country, city) pairs are deduplicated in a shared
+    list, so a 3M-range table stays around 40 MB.
+    """
+
+    def __init__(self, ranges):
+        """ranges: iterable of (start_int, end_int, country, city)"""
+        self._locations = []
+        location_index = {}
+        v4, v6 = [], []
+        for start, end, country, city in ranges:
+            key = (country or 'Unknown', city or 'Unknown')
+            idx = location_index.get(key)
+            if idx is None:
+                idx = location_index[key] = len(self._locations)
+                self._locations.append(key)
+            (v4 if end <= 0xFFFFFFFF else v6).append((start, end, idx))
+        v4.sort()
+        v6.sort()
+
+        self._v4_starts = array('I', (r[0] for r in v4))
+        self._v4_ends = array('I', (r[1] for r in v4))
+        self._v4_locs = array('I', (r[2] for r in v4))
+        self._v6_starts = [r[0] for r in v6]
+        self._v6_ends = [r[1] for r in v6]
+        self._v6_locs = array('I', (r[2] for r in v6))
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a range CSV
+
+        Accepted layouts (header optional):
+        - start_ip,end_ip,country,city (dotted IPs or integers)
+        - network,country,city (CIDR notation)
+        - IP2Location LITE DB3/DB11: ip_from,ip_to,code,country,region,city,...
+        """
+        def rows():
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    if not row or row[0].startswith('#'):
+                        continue
+                    try:
+                        if '/' in row[0]:
+                            network = ipaddress.ip_network(row[0].strip(), strict=False)
+                            start, end = int(network.network_address), int(network.broadcast_address)
+                            country, city = row[1:3] if len(row) >= 3 else (row[1], None)
+                        else:
+                            start, end = _parse_bound(row[0]), _parse_bound(row[1])
+                            if len(row) >= 6:
+                                country, city = row[3], row[5]
+                            else:
+                                country, city = row[2], row[3] if len(row) > 3 else None
+                    except (ValueError, IndexError):
+                        continue  # header line or malformed row
+                    yield start, end, country.strip(), (city or '').strip()
+        return cls(rows())
+
+    def lookup(self, ip):
+        """(country, city) for an ipaddress object, or None if no range matches"""
+        value = int(ip)
+        if ip.version == 4:
+            starts, ends, locs = self._v4_starts, self._v4_ends, self._v4_locs
+        else:
+            starts, ends, locs = self._v6_starts, self._v6_ends, self._v6_locs
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return self._locations[locs[i]]
+        return None
+
+    def __len__(self):
+        return len(self._v4_starts) + len(self._v6_starts)
+
+    def memory_bytes(self):
+        arrays = (self._v4_starts, self._v4_ends, self._v4_locs, self._v6_locs)
+        return sum(a.itemsize * len(a) for a in arrays) + 16 * 2 * len(self._v6_starts)
+
+
+class MMDBTable:
+    """Same lookup interface on top of a MaxMind .mmdb file (needs maxminddb)"""
+
+    def __init__(self, path):
+        if not MAXMIND_AVAILABLE:
+            raise RuntimeError('maxminddb is not installed - cannot read .mmdb files')
+        self._reader = maxminddb.open_database(path)
+        self._path = path
+
+    def lookup(self, ip):
+        record = self._reader.get(ip)
+        if not record:
+            return None
+        country = record.get('country', {}).get('names', {}).get('en', 'Unknown')
+        city = record.get('city', {}).get('names', {}).get('en', 'Unknown')
+        return country, city
+
+    def __len__(self):
+        return self._reader.metadata().node_count
+
+    def memory_bytes(self):
+        return os.path.getsize(self._path)
+
+
+class GeoDatabase:
+    """Offline geolocation engine with hot reload
+
+    The table is loaded on first lookup. Every `check_interval` seconds the
+    file's mtime is compared; when it changed, the new file is loaded in a
+    background thread and swapped in atomically while lookups keep using
+    the old table. A failed reload keeps the previous table; a failed
+    first load is retried at most once per `check_interval` (lookups
+    answer Unknown meanwhile).
+    """
+
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self._table = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._reloading = False
+
+        self._lookups = 0
+        self._misses = 0
+        self._reloads = 0
+        self._reload_errors = 0
+        self._last_load_ms = 0.0
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get('GEOIP_DB_PATH')
+        if not path:
+            return None
+        return cls(path, check_interval=int(os.environ.get('GEOIP_RELOAD_INTERVAL', 60)))
+
+    def _load(self):
+        started = time.monotonic()
+        mtime = os.path.getmtime(self.path)
+        if self.path.endswith('.mmdb'):
+            table = MMDBTable(self.path)
+        else:
+            table = IPRangeTable.from_csv(self.path)
+        self._table, self._mtime = table, mtime
+        self._last_load_ms = (time.monotonic() - started) * 1000
+        self._reloads += 1
+        print(f"🌍 Geo database loaded: {self.path} ({len(table)} ranges, {self._last_load_ms:.0f} ms)")
+
+    def reload(self):
+        """Load the current file now, keeping the old table if it fails"""
+        try:
+            self._load()
+            return True
+        except Exception as e:
+            self._reload_errors += 1
+            print(f"⚠️  Geo database reload failed ({self.path}): {e}")
+            return False
+        finally:
+            self._reloading = False
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval or self._reloading:
+                return
+            self._checked_at = now
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                return
+            if changed:
+                self._reloading = True
+                threading.Thread(target=self.reload, name='geo-reload', daemon=True).start()
+
+    def lookup(self, raw_ip):
+        """(country, city) for a raw IP string - never raises, never hits the network"""
+        if self._table is None:
+            now = time.monotonic()
+            with self._lock:
+                if self._table is None:
+                    if self._checked_at and now - self._checked_at < self.check_interval:
+                        self._lookups += 1
+                        self._misses += 1
+                        return UNKNOWN
+                    self._checked_at = now
+                    if not self.reload():
+                        self._lookups += 1
+                        self._misses += 1
+                        return UNKNOWN
+        else:
+            self._maybe_reload()
+
+        self._lookups += 1
+        ip = parse_ip(raw_ip)
+        result = self._table.lookup(ip) if ip is not None and ip.is_global else None
+        if result is None:
+            self._misses += 1
+            return UNKNOWN
+        return result
+
+    def stats(self):
+        table = self._table
+        return {
+            'path': self.path,
+            'loaded': table is not None,
+            'ranges': len(table) if table is not None else 0,
+            'memory_bytes': table.memory_bytes() if table is not None else 0,
+            'lookups_total': self._lookups,
+            'misses_total': self._misses,
+            'reloads_total': self._reloads,
+            'reload_errors_total': self._reload_errors,
+            'last_load_ms': round(self._last_load_ms, 1),
+        }
+
+
+class GeoCache:
+    """LRU/TTL cache in front of a geo lookup, keyed by IP with a network fallback
+
+    An exact-IP hit is served directly. Otherwise the /24 (IPv4) or /48
+    (IPv6) network is tried: clicks behind the same corporate NAT or ISP
+    block almost always resolve to the same place. Only resolved results
+    are cached, so a transient lookup failure is retried next time.
+    """
+
+    def __init__(self, lookup, maxsize=50000, ttl=86400):
+        self.lookup_uncached = lookup
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, lookup):
+        return cls(
+            lookup,
+            maxsize=int(os.environ.get('GEO_CACHE_SIZE', 50000)),
+            ttl=int(os.environ.get('GEO_CACHE_TTL', 86400)),
+        )
+
+    @staticmethod
+    def prefix_key(ip):
+        prefix = 24 if ip.version == 4 else 48
+        return str(ipaddress.ip_network((ip, prefix), strict=False))
+
+    def lookup(self, raw_ip):
+        ip = parse_ip(raw_ip)
+        if ip is None:
+            return UNKNOWN
+
+        exact_key = str(ip)
+        result = self._cache.get(exact_key)
+        if result is not None:
+            self.exact_hits += 1
+            return result
+
+        prefix_key = self.prefix_key(ip)
+        result = self._cache.get(prefix_key)
+        if result is not None:
+            self.prefix_hits += 1
+            self._cache.set(exact_key, result)
+            return result
+
+        self.misses += 1
+        result = self.lookup_uncached(exact_key)
+        if result != UNKNOWN:
+            self._cache.set(exact_key, result)
+            self._cache.set(prefix_key, result)
+        return result
+
+    def stats(self):
+        lookups = self.exact_hits + self.prefix_hits + self.misses
+        stats = self._cache.stats()
+        stats.update({
+            'lookups': lookups,
+            'exact_hits': self.exact_hits,
+            'prefix_hits': self.prefix_hits,
+            'lookup_misses': self.misses,
+            'hit_rate': round((self.exact_hits + self.prefix_hits) / lookups, 3) if lookups else 0,
+        })
+        return stats
+
+
+class GeoEnricher:
+    """Background stage that fills clicks.country / clicks.city after the redirect
+
+    Clicks are queued as (click_id, ip). A single daemon thread drains the
+    queue in batches, resolves each IP with `lookup(ip) -> (country, city)`
+    and writes the whole batch back with one UPDATE, retried `max_retries`
+    times with backoff. The queue is bounded: when it is full new clicks
+    are dropped rather than slowing down redirects, and the drop is
+    counted. `on_write(cur, rows)` runs in the same transaction as the
+    UPDATE (tables derived from clicks).
+
+    Clicks left without geo (dropped, failed after the retries, still
+    queued when a worker exited) are picked up by a sweep of human clicks
+    with a NULL country older than `sweep_grace` seconds, run when the
+    thread starts and every `sweep_interval` seconds (0 = never), at most
+    `sweep_limit` clicks at a time. Workers may sweep the same rows: the
+    UPDATE is idempotent.
+    """
+
+    def __init__(self, lookup, get_connection, maxsize=10000, batch_size=100, max_wait=1.0, on_write=None,
+                 max_retries=3, sweep_interval=300, sweep_grace=60, sweep_limit=1000):
+        self.lookup = lookup
+        self.get_connection = get_connection
+        self.on_write = on_write
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.sweep_interval = sweep_interval
+        self.sweep_grace = sweep_grace
+        self.sweep_limit = sweep_limit
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._next_sweep = 0.0
+
+        self._submitted = 0
+        self._dropped = 0
+        self._enriched = 0
+        self._failed_batches = 0
+        self._retries = 0
+        self._swept = 0
+        self._max_depth = 0
+        self._lookup_time = 0.0
+        self._last_batch_ms = 0.0
+
+    @classmethod
+    def from_env(cls, lookup, get_connection, on_write=None):
+        return cls(
+            lookup,
+            get_connection,
+            maxsize=int(os.environ.get('GEO_QUEUE_SIZE', 10000)),
+            batch_size=int(os.environ.get('GEO_BATCH_SIZE', 100)),
+            on_write=on_write,
+            max_retries=int(os.environ.get('GEO_MAX_RETRIES', 3)),
+            sweep_interval=float(os.environ.get('GEO_SWEEP_INTERVAL', 300)),
+            sweep_grace=float(os.environ.get('GEO_SWEEP_GRACE', 60)),
+            sweep_limit=int(os.environ.get('GEO_SWEEP_LIMIT', 1000)),
+        )
+
+    def ensure_started(self):
+        # Started lazily so the thread lives in the gunicorn worker, not the master
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='geo-enricher', daemon=True)
+                self._thread.start()
+
+    def submit(self, click_id, ip):
+        """Queue a click for enrichment - never blocks; returns False if dropped"""
+        self.ensure_started()
+        try:
+            self._queue.put_nowait((click_id, ip))
+        except queue.Full:
+            self._dropped += 1
+            return False
+        self._submitted += 1
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+
+    def _next_batch(self):
+        timeout = None
+        if self.sweep_interval > 0:
+            timeout = max(self._next_sweep - time.monotonic(), 0.01)
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch):
+        """Resolve and write [(click_id, ip)]: returns False if the batch is left for the sweep"""
+        started = time.monotonic()
+        try:
+            rows = []
+            for click_id, ip in batch:
+                t = time.monotonic()
+                country, city = self.lookup(ip)
+                self._lookup_time += time.monotonic() - t
+                rows.append((click_id, country or 'Unknown', city or 'Unknown'))
+        except Exception as e:
+            self._failed_batches += 1
+            print(f"⚠️  Geo lookup failed ({len(batch)} clicks, left for the sweep): {e}")
+            return False
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(rows)
+                self._enriched += len(rows)
+                self._last_batch_ms = (time.monotonic() - started) * 1000
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._failed_batches += 1
+                    print(f"⚠️  Geo enrichment batch failed ({len(rows)} clicks, left for the sweep): {e}")
+                    return False
+                self._retries += 1
+                time.sleep(min(2 ** attempt, 30))
+
+    def _sweep(self):
+        """Enrich up to sweep_limit clicks left without geo: returns True if more are waiting"""
+        swept = 0
+        while swept < self.sweep_limit:
+            conn = self.get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    SELECT id, ip_address FROM clicks
+                    WHERE country IS NULL AND NOT is_bot
+                      AND clicked_at < LOCALTIMESTAMP - %s * INTERVAL '1 second'
+                    ORDER BY id DESC
+                    LIMIT %s
+                ''', (self.sweep_grace, min(self.batch_size, self.sweep_limit - swept)))
+                batch = cur.fetchall()
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+            if not batch or not self._process(batch):
+                return False
+            swept += len(batch)
+            self._swept += len(batch)
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._process(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+            if self.sweep_interval > 0 and time.monotonic() >= self._next_sweep:
+                try:
+                    more = self._sweep()
+                except Exception as e:
+                    more = False
+                    print(f"⚠️  Geo sweep failed: {e}")
+                # A large backlog is worked off in slices between queued batches
+                self._next_sweep = time.monotonic() + (self.max_wait if more else self.sweep_interval)
+
+    def _write(self, rows):
+        conn = self.get_connection()
+        try:
+            cur = conn.cursor()
+            execute_values(cur, '''
+                UPDATE clicks SET country = v.country, city = v.city
+                FROM (VALUES %s) AS v(id, country, city)
+                WHERE clicks.id = v.id
+            ''', rows)
+            if self.on_write is not None:
+                self.on_write(cur, rows)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def stats(self):
+        depth = self._queue.qsize()
+        looked_up = self._enriched or 1
+        return {
+            'queue_depth': depth,
+            'queue_capacity': self._queue.maxsize,
+            'queue_max_depth': self._max_depth,
+            'queue_utilization': round(depth / self._queue.maxsize, 2) if self._queue.maxsize else 0,
+            'submitted_total': self._submitted,
+            'dropped_total': self._dropped,
+            'enriched_total': self._enriched,
+            'failed_batches_total': self._failed_batches,
+            'retries_total': self._retries,
+            'swept_total': self._swept,
+            'avg_lookup_ms': round(self._lookup_time / looked_up * 1000, 2),
+            'last_batch_ms': round(self._last_batch_ms, 2),
+        }
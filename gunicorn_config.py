@@ -30,15 +30,60 @@ accesslog = "-"
 errorlog = "-"
 loglevel = "info"
 
+# Database pool, sized from what a worker can hold at the same time:
+# - one connection per request thread (the /api/dashboard leader included)
+# - DASHBOARD_PARALLELISM - 1 dashboard followers: they run in one executor
+#   shared by the worker, whatever the number of concurrent dashboards
+# - one per background thread: click flusher (and spool replay), geo enricher
+#   (and its sweep), Clay outbox dispatcher, cumulative sketch advance, and at
+#   startup the link filter build and the link cache warm-up
+# Total connections = workers x pool size, which must stay under the
+# database's max_connections (see README)
+DB_POOL_BACKGROUND = 6
+DB_POOL_HEADROOM = int(os.environ.get("DB_POOL_HEADROOM", 0))
+
+def db_pool_size(cfg):
+    followers = max(int(os.environ.get("DASHBOARD_PARALLELISM", 3)) - 1, 0)
+    default = cfg.threads + followers + DB_POOL_BACKGROUND + DB_POOL_HEADROOM
+    return int(os.environ.get("DB_POOL_MAX_SIZE", default))
+
 # Startup hook to confirm config is loaded
 def on_starting(server):
+    # Use the effective settings (command-line flags override this file)
+    pool_size = db_pool_size(server.cfg)
     print("=" * 60)
     print("🚀 GUNICORN CONFIG LOADED")
     print(f"   Port: {port}")
     print(f"   Timeout: {timeout} seconds ({timeout/60:.1f} minutes)")
-    print(f"   Workers: {workers}")
-    print(f"   Threads: {threads}")
+    print(f"   Workers: {server.cfg.workers}")
+    print(f"   Threads: {server.cfg.threads}")
+    print(f"   DB pool: {pool_size} per worker ({pool_size * server.cfg.workers} connections max)")
     print("=" * 60)
+    max_connections = int(os.environ.get("DB_MAX_CONNECTIONS", 0))
+    if max_connections and pool_size * server.cfg.workers + 1 > max_connections:
+        print(f"⚠️  DB pools may open {pool_size * server.cfg.workers} connections "
+              f"(+1 for migrations), over DB_MAX_CONNECTIONS={max_connections}")
+
+    # Schema migrations run once here, in the master, before any worker
+    # serves a request. A failure (database unreachable) is logged and the
+    # server starts anyway: redirects keep working from the link cache and
+    # the click spool until the database is back, and the next start (or
+    # `python migrations.py`) applies what is pending
+    import migrations
+    try:
+        migrations.run()
+    except Exception as e:
+        print(f"⚠️  Schema migrations failed, serving anyway: {e}")
+
+def post_fork(server, worker):
+    # Runs in the worker before app.py is imported, so the pool picks it up
+    os.environ["DB_POOL_MAX_SIZE"] = str(db_pool_size(server.cfg))
+
+def worker_exit(server, worker):
+    # Write buffered clicks before the worker goes away, within graceful_timeout
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.shutdown(timeout=max(graceful_timeout - 10, 1))
 
 # Process naming
 proc_name = "link-tracker"
@@ -0,0 +1,135 @@
+"""
+HyperLogLog
+Estimation de cardinalité fusionnable (visiteurs uniques), sérialisée de façon compacte en bytea
+"""
+
+import hashlib
+import math
+import os
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+_DENSE = 0
+_SPARSE = 1
+
+# 2^-rank for every possible register value
+_INVERSE_POWERS = [2.0 ** -r for r in range(66)]
+
+
+def precision_for_error(error):
+    """Smallest precision whose standard error is at most `error` (e.g. 0.01 -> 14)"""
+    p = math.ceil(2 * math.log2(1.04 / error))
+    return min(max(p, MIN_PRECISION), MAX_PRECISION)
+
+
+# Target standard error (HLL_ERROR, e.g. 0.01) or register count exponent (HLL_PRECISION);
+# the default 2^12 registers give ~1.6% standard error, at most 4 KB per sketch
+if os.environ.get('HLL_ERROR'):
+    DEFAULT_PRECISION = precision_for_error(float(os.environ['HLL_ERROR']))
+else:
+    DEFAULT_PRECISION = int(os.environ.get('HLL_PRECISION', 12))
+
+
+class HyperLogLog:
+    """HyperLogLog sketch over strings (64-bit blake2b hash, one byte per register)
+
+    Sketches of different precisions can be merged: the finer one is
+    folded down to the coarser precision first. to_bytes() stores only
+    the non-zero registers while that is smaller than the dense form, so
+    the sketch of a quiet hour takes a few bytes.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"HyperLogLog precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.precision = precision
+        self.m = 1 << precision
+        self._registers = bytearray(self.m)
+        # Kept up to date on every register change so count() is O(1)
+        self._inverse_sum = float(self.m)
+        self._zeros = self.m
+
+    @property
+    def relative_error(self):
+        """Standard error of count() for this precision"""
+        return 1.04 / math.sqrt(self.m)
+
+    def _set(self, index, rank):
+        current = self._registers[index]
+        if rank > current:
+            self._registers[index] = rank
+            self._inverse_sum += _INVERSE_POWERS[rank] - _INVERSE_POWERS[current]
+            if current == 0:
+                self._zeros -= 1
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        width = 64 - self.precision
+        rest = x & ((1 << width) - 1)
+        self._set(x >> width, width - rest.bit_length() + 1)
+
+    def nonzero(self):
+        """(index, rank) of every non-empty register"""
+        return [(i, r) for i, r in enumerate(self._registers) if r]
+
+    def folded(self, precision):
+        """Copy of this sketch at a lower precision"""
+        if precision == self.precision:
+            return self
+        if precision > self.precision:
+            raise ValueError("A sketch can only be folded to a lower precision")
+        shift = self.precision - precision
+        low_mask = (1 << shift) - 1
+        result = HyperLogLog(precision)
+        for index, rank in self.nonzero():
+            dropped = index & low_mask
+            # The dropped index bits become the leading bits of the rank
+            result._set(index >> shift, shift - dropped.bit_length() + 1 if dropped else rank + shift)
+        return result
+
+    def merge(self, other):
+        """Union `other` into this sketch (in place)"""
+        if other.precision < self.precision:
+            folded = self.folded(other.precision)
+            self.__dict__.update(folded.__dict__)
+        elif other.precision > self.precision:
+            other = other.folded(self.precision)
+        for index, rank in other.nonzero():
+            self._set(index, rank)
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / self._inverse_sum
+        # Small range correction (linear counting)
+        if estimate <= 2.5 * m and self._zeros:
+            return round(m * math.log(m / self._zeros))
+        return round(estimate)
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self):
+        pairs = self.nonzero()
+        if 3 * len(pairs) < self.m:
+            body = b''.join(index.to_bytes(2, 'big') + bytes((rank,)) for index, rank in pairs)
+            return bytes((self.precision, _SPARSE)) + body
+        return bytes((self.precision, _DENSE)) + bytes(self._registers)
+
+    @classmethod
+    def from_bytes(cls, data, precision=DEFAULT_PRECISION):
+        """Sketch from to_bytes() output (empty data = empty sketch of `precision`)"""
+        data = bytes(data or b'')
+        if not data:
+            return cls(precision)
+        sketch = cls(data[0])
+        if data[1] == _SPARSE:
+            for offset in range(2, len(data), 3):
+                sketch._set(int.from_bytes(data[offset:offset + 2], 'big'), data[offset + 2])
+        else:
+            for index, rank in enumerate(data[2:]):
+                if rank:
+                    sketch._set(index, rank)
+        return sketch
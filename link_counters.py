@@ -0,0 +1,88 @@
+"""
+Link Counters
+Compteurs de clics dénormalisés sur `links` (click_count, premier / dernier clic), maintenus à chaque écriture de clics
+"""
+
+from psycopg2.extras import execute_values
+
+COUNTER_SCHEMA = '''
+    ALTER TABLE links ADD COLUMN IF NOT EXISTS click_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE links ADD COLUMN IF NOT EXISTS first_clicked_at TIMESTAMP;
+    ALTER TABLE links ADD COLUMN IF NOT EXISTS last_clicked_at TIMESTAMP;
+'''
+
+# (name, definition) - built CONCURRENTLY by migrate_add_link_counters.py
+COUNTER_INDEXES = [
+    # /api/clicks ordering (keyset pagination), per campaign and overall
+    ('idx_links_campaign_click_count', 'links (campaign, click_count DESC, created_at DESC, link_id DESC)'),
+    ('idx_links_click_count', 'links (click_count DESC, created_at DESC, link_id DESC)'),
+    # Hot-lead detection: links not sent to Clay yet, by click count
+    ('idx_links_hot_leads', 'links (click_count DESC) WHERE sent_to_clay = FALSE'),
+]
+
+
+def record_clicks(cur, rows):
+    """Add freshly inserted clicks to the links counters (same transaction as the insert)
+
+    rows: [(id, link_id, ip_address, clicked_at)] as returned by insert_clicks.
+    Returns [(link_id, campaign, click_count before, click_count after, sent_to_clay)].
+    """
+    counters = {}
+    for _id, link_id, _ip, clicked_at in rows:
+        count, first, last = counters.get(link_id, (0, clicked_at, clicked_at))
+        counters[link_id] = (count + 1, min(first, clicked_at), max(last, clicked_at))
+    if not counters:
+        return []
+
+    # Sorted so concurrent workers lock links rows in the same order
+    values = [(link_id, count, first, last) for link_id, (count, first, last) in sorted(counters.items())]
+    return execute_values(cur, '''
+        UPDATE links l
+        SET click_count = l.click_count + v.click_count,
+            first_clicked_at = LEAST(l.first_clicked_at, v.first_clicked_at),
+            last_clicked_at = GREATEST(l.last_clicked_at, v.last_clicked_at)
+        FROM (VALUES %s) AS v(link_id, click_count, first_clicked_at, last_clicked_at)
+        WHERE l.link_id = v.link_id
+        RETURNING l.link_id, l.campaign, l.click_count - v.click_count, l.click_count, l.sent_to_clay
+    ''', values, template='(%s, %s, %s::timestamp, %s::timestamp)', page_size=len(values), fetch=True)
+
+
+def reconcile(cur, first_id, last_id, dry_run=False):
+    """Recompute the counters of links with first_id <= id <= last_id from clicks
+
+    The links rows are locked first, then counted with a fresh snapshot:
+    a concurrent click flush either committed before (and is counted) or
+    waits for the lock and adds its clicks on top. Returns the number of
+    links whose counters were wrong (and fixed unless dry_run).
+    Run it inside a transaction, one id range at a time.
+    """
+    cur.execute('SELECT link_id FROM links WHERE id BETWEEN %s AND %s ORDER BY link_id FOR UPDATE',
+                (first_id, last_id))
+    drift = '''
+        WITH drift AS (
+            SELECT l.id, t.click_count, t.first_clicked_at, t.last_clicked_at
+            FROM links l
+            CROSS JOIN LATERAL (
+                SELECT COUNT(c.id)::int as click_count,
+                       MIN(c.clicked_at) as first_clicked_at,
+                       MAX(c.clicked_at) as last_clicked_at
+                FROM clicks c
+                WHERE c.link_id = l.link_id AND NOT c.is_bot
+            ) t
+            WHERE l.id BETWEEN %s AND %s
+              AND (l.click_count, l.first_clicked_at, l.last_clicked_at)
+                  IS DISTINCT FROM (t.click_count, t.first_clicked_at, t.last_clicked_at)
+        )
+    '''
+    if dry_run:
+        cur.execute(drift + 'SELECT COUNT(*) FROM drift', (first_id, last_id))
+        return cur.fetchone()[0]
+    cur.execute(drift + '''
+        UPDATE links l
+        SET click_count = d.click_count,
+            first_clicked_at = d.first_clicked_at,
+            last_clicked_at = d.last_clicked_at
+        FROM drift d
+        WHERE l.id = d.id
+    ''', (first_id, last_id))
+    return cur.rowcount
@@ -0,0 +1,219 @@
+"""
+Link Filter
+Filtre de Bloom des link_id existants : rejette les codes inconnus sans requête SQL
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 64)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def expected_false_positive_rate(self):
+        """Theoretical FP rate for the number of keys added so far"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def memory_bytes(self):
+        return len(self._bits)
+
+
+class LinkFilter:
+    """Per-worker membership filter of links.link_id
+
+    might_exist() answers False only for codes that are definitely not in
+    the filter, so /c/<link_id> can 404 without a query. Links created by
+    another worker are picked up by an incremental sync that runs on a
+    negative answer, at most once every `sync_interval` seconds. The sync
+    reads links by created_at (the start of the inserting transaction),
+    going back `sync_overlap` seconds before the previous sync: a link
+    whose transaction committed after a later id was already synced is
+    still picked up, as long as it committed within `sync_overlap` seconds.
+    Links created by this worker are added right away (add). Deleted links
+    cannot be removed from a Bloom filter; they only cost a query, and the
+    filter is rebuilt every `rebuild_interval` seconds or when it outgrows
+    its capacity. Until the first build has finished every code is let through.
+    """
+
+    def __init__(self, get_connection, error_rate=0.001, sync_interval=1.0, sync_overlap=60.0,
+                 sync_timeout=1.0, rebuild_interval=3600):
+        self.get_connection = get_connection
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        # Pool wait of a sync: it runs on the redirect path
+        self.sync_timeout = sync_timeout
+        self.rebuild_interval = rebuild_interval
+
+        self._bloom = None
+        self._synced_until = None  # database time the last sync (or build) started reading
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._sync_lock = threading.Lock()
+        self._bits_lock = threading.Lock()  # guards bit updates of the current filter
+        self._build_lock = threading.Lock()
+        self._building = False
+
+        self.checks = 0
+        self.rejected = 0
+        self.false_positives = 0
+        self.deleted_since_build = 0
+        self.syncs = 0
+        self.synced_links = 0
+
+    @classmethod
+    def from_env(cls, get_connection):
+        return cls(
+            get_connection,
+            error_rate=float(os.environ.get('LINK_FILTER_ERROR_RATE', 0.001)),
+            sync_interval=float(os.environ.get('LINK_FILTER_SYNC_INTERVAL', 1.0)),
+            sync_overlap=float(os.environ.get('LINK_FILTER_SYNC_OVERLAP', 60)),
+        )
+
+    def _rebuild(self):
+        try:
+            conn = self.get_connection()
+            try:
+                cur = conn.cursor()
+                # Transaction start: the next sync reads from there (minus the overlap)
+                cur.execute('SELECT LOCALTIMESTAMP, COUNT(*) FROM links')
+                started, count = cur.fetchone()
+                # Leave room to grow before the next rebuild
+                bloom = BloomFilter(max(count * 2, 100000), self.error_rate)
+                cur.execute('SELECT link_id FROM links')
+                for (link_id,) in cur:
+                    bloom.add(link_id)
+                cur.close()
+            finally:
+                conn.close()
+            with self._sync_lock, self._bits_lock:
+                self._bloom, self._synced_until = bloom, started
+                self._built_at = self._synced_at = time.monotonic()
+                self.deleted_since_build = 0
+            self._sync()  # links inserted while we were reading
+            print(f"🧱 Link filter built: {bloom.count} links, {bloom.memory_bytes() // 1024} KB")
+        except Exception as e:
+            print(f"⚠️  Link filter build failed: {e}")
+        finally:
+            self._building = False
+
+    def _schedule_rebuild(self):
+        with self._build_lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild, name='link-filter-build', daemon=True).start()
+
+    def _sync(self):
+        """Add links created (by any worker) since the last sync: False if another thread is syncing"""
+        if not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            conn = self.get_connection(timeout=self.sync_timeout)
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT LOCALTIMESTAMP')
+                started = cur.fetchone()[0]
+                cur.execute('SELECT link_id FROM links WHERE created_at >= %s',
+                            (self._synced_until - timedelta(seconds=self.sync_overlap),))
+                rows = cur.fetchall()
+                cur.close()
+            finally:
+                conn.close()
+            added = 0
+            with self._bits_lock:
+                for (link_id,) in rows:
+                    # The overlap reads links again: only new ones count towards capacity
+                    if link_id not in self._bloom:
+                        self._bloom.add(link_id)
+                        added += 1
+            self._synced_until = started
+            self.syncs += 1
+            self.synced_links += added
+        except Exception as e:
+            print(f"⚠️  Link filter sync failed: {e}")
+        finally:
+            self._synced_at = time.monotonic()
+            self._sync_lock.release()
+        return True
+
+    def might_exist(self, link_id):
+        """False only if link_id is definitely unknown"""
+        bloom = self._bloom
+        if bloom is None:
+            self._schedule_rebuild()
+            return True
+        now = time.monotonic()
+        if (now - self._built_at > self.rebuild_interval or bloom.count > bloom.capacity
+                or self.deleted_since_build > bloom.count // 10):
+            self._schedule_rebuild()
+
+        self.checks += 1
+        if link_id in bloom:
+            return True
+        if now - self._synced_at >= self.sync_interval and self._sync() and link_id in self._bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, link_id):
+        """Register a link created by this worker"""
+        with self._bits_lock:
+            if self._bloom is not None:
+                self._bloom.add(link_id)
+
+    def remove(self, link_id):
+        """Note a deleted link (it stays in the filter until the next rebuild)"""
+        self.deleted_since_build += 1
+
+    def record_false_positive(self):
+        """The filter let a code through and the database had no such link"""
+        self.false_positives += 1
+
+    def stats(self):
+        bloom = self._bloom
+        unknown = self.false_positives + self.rejected
+        return {
+            'ready': bloom is not None,
+            'links': bloom.count if bloom is not None else 0,
+            'capacity': bloom.capacity if bloom is not None else 0,
+            'hash_functions': bloom.num_hashes if bloom is not None else 0,
+            'memory_bytes': bloom.memory_bytes() if bloom is not None else 0,
+            'expected_false_positive_rate': round(bloom.expected_false_positive_rate(), 6) if bloom is not None else None,
+            'observed_false_positive_rate': round(self.false_positives / unknown, 6) if unknown else None,
+            'checks_total': self.checks,
+            'rejected_total': self.rejected,
+            'false_positives_total': self.false_positives,
+            'deleted_since_build': self.deleted_since_build,
+            'syncs_total': self.syncs,
+            'synced_links_total': self.synced_links,
+        }
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Migration script: Add event_id column to the clicks table
+Required by the click buffer / spool (idempotent click inserts)
+Safe migration - does not delete any data
+
+Usage: python migrate_add_click_event_id.py
+"""
+
+import os
+import psycopg2
+from datetime import datetime
+
+# Database configuration
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+print(f"🔧 Migration: Add event_id column to clicks table")
+print(f"📅 Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+print("=" * 60)
+
+def migrate():
+    """Add clicks.event_id and its unique index if they don't exist"""
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        print("\n📋 Checking if event_id column exists...")
+        cur.execute("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'clicks' AND column_name = 'event_id'
+        """)
+
+        if cur.fetchone():
+            print("✅ event_id column already exists")
+        else:
+            print("🔄 Adding event_id column to clicks table...")
+            # Nullable, no default: instant on large tables, existing rows stay NULL
+            cur.execute("ALTER TABLE clicks ADD COLUMN event_id VARCHAR(32)")
+            print("✅ Added column: event_id")
+
+        print("🔄 Creating unique index on clicks(event_id) (without locking writes)...")
+        cur.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_clicks_event_id
+            ON clicks (event_id)
+        """)
+
+        # A failed concurrent build leaves an INVALID index behind
+        cur.execute("""
+            SELECT i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = 'idx_clicks_event_id'
+        """)
+        if not cur.fetchone()[0]:
+            raise Exception("idx_clicks_event_id is INVALID - drop it and run this script again")
+
+        cur.close()
+        conn.close()
+
+        print("\n" + "=" * 60)
+        print("✅ Migration completed successfully!")
+        print("=" * 60)
+
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Error during migration: {str(e)}")
+        if 'conn' in locals():
+            conn.close()
+        return False
+
+if __name__ == "__main__":
+    if not migrate():
+        exit(1)
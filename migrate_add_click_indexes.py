@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Migration script: Add indexes for the analytics access paths
+- clicks(link_id, clicked_at): joins to links, DISTINCT ON (link_id) ... ORDER BY link_id, clicked_at
+- clicks(clicked_at): time range filters, most recent clicks
+- links(campaign), links(email), links(created_at)
+
+Indexes are built with CREATE INDEX CONCURRENTLY: production keeps
+reading and writing while they build. Query plans of every /api/*
+endpoint (recorded from the analytics panels themselves) are printed
+before and after so the gain can be checked.
+
+Usage: python migrate_add_click_indexes.py [--yes] [--analyze]
+  --yes      don't ask for confirmation
+  --analyze  use EXPLAIN ANALYZE (runs the queries) instead of plain EXPLAIN
+"""
+
+import os
+import sys
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from datetime import datetime
+
+import analytics
+
+# Database configuration
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+INDEXES = [
+    ('idx_clicks_link_id_clicked_at', 'clicks (link_id, clicked_at)'),
+    ('idx_clicks_clicked_at', 'clicks (clicked_at)'),
+    ('idx_links_campaign', 'links (campaign)'),
+    ('idx_links_email', 'links (email)'),
+    ('idx_links_created_at', 'links (created_at)'),
+]
+
+# Endpoints whose queries are explained (range=7d, first campaign found). The
+# queries are not copied here: each panel runs once on a recording cursor, so
+# the report follows the endpoint code (rollups, link counters, keyset cursor)
+def endpoint_panels(params):
+    campaign = params['campaign']
+    cursor = analytics.encode_cursor({'click_count': 1, 'created_at': datetime.now(), 'link_id': ''})
+    return {
+        '/api/analytics': (analytics.analytics_panel, ('7d', campaign)),
+        '/api/clicks': (analytics.clicks_panel, (campaign, 1, 50, '', 'all')),
+        '/api/clicks (cursor)': (analytics.clicks_panel, (campaign, 1, 50, '', 'all', cursor)),
+        '/api/campaigns': (analytics.campaigns_panel, ()),
+        '/api/icp-stats': (analytics.icp_stats_panel, ('7d', campaign)),
+        '/api/heatmap': (analytics.heatmap_panel, ('7d', campaign, 'exact')),
+        '/api/analytics/timeline': (analytics.timeline_panel, ('7d', campaign, None, 'exact')),
+    }
+
+# Lookups made directly in app.py
+ENDPOINT_QUERIES = {
+    '/api/update-link (by email)': ("SELECT * FROM links WHERE email = %(email)s", None),
+    'link cache warm-up': ('SELECT link_id, destination_url FROM links ORDER BY created_at DESC LIMIT 5000', None),
+}
+
+class RecordingCursor:
+    """Cursor that runs an endpoint's queries and keeps them for EXPLAIN"""
+
+    def __init__(self, cur):
+        self._cur = cur
+        self.queries = []
+
+    def execute(self, query, params=None):
+        if not query.lstrip().upper().startswith('EXPLAIN'):
+            self.queries.append((query, params))
+        return self._cur.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+def endpoint_queries(conn, params):
+    """{label: (query, params)} for every query the endpoints run"""
+    queries = {label: (query, params) for label, (query, _params) in ENDPOINT_QUERIES.items()}
+    for endpoint, (fn, args) in endpoint_panels(params).items():
+        cur = RecordingCursor(conn.cursor(cursor_factory=RealDictCursor))
+        try:
+            fn(cur, *args)
+        except psycopg2.Error as e:
+            print(f"   ⚠️  {endpoint} skipped: {e}")
+            continue
+        finally:
+            cur.close()
+        for i, query in enumerate(cur.queries, 1):
+            queries[f"{endpoint} #{i}" if len(cur.queries) > 1 else endpoint] = query
+    return queries
+
+print(f"🔧 Migration: Add analytics indexes on clicks and links")
+print(f"📅 Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+print("=" * 60)
+
+def explain_all(cur, queries, analyze):
+    """Return {endpoint: (plan summary, cost or time)}"""
+    results = {}
+    prefix = 'EXPLAIN (ANALYZE, FORMAT JSON) ' if analyze else 'EXPLAIN (FORMAT JSON) '
+    for endpoint, (query, params) in queries.items():
+        cur.execute(prefix + query, params)
+        plan = cur.fetchone()[0][0]
+        nodes = []
+
+        def walk(node):
+            label = node['Node Type']
+            if 'Index Name' in node:
+                label += f" using {node['Index Name']}"
+            elif 'Relation Name' in node:
+                label += f" on {node['Relation Name']}"
+            if 'Scan' in node['Node Type']:
+                nodes.append(label)
+            for child in node.get('Plans', []):
+                walk(child)
+
+        walk(plan['Plan'])
+        metric = f"{plan['Execution Time']:.1f} ms" if analyze else f"cost {plan['Plan']['Total Cost']:.0f}"
+        results[endpoint] = (', '.join(nodes) or plan['Plan']['Node Type'], metric)
+    return results
+
+def print_plans(title, plans):
+    print(f"\n📊 {title}")
+    for endpoint, (scans, metric) in plans.items():
+        print(f"   {endpoint:<36} {metric:>12}  {scans}")
+
+def migrate(analyze=False):
+    """Create the indexes concurrently and report plans before/after"""
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        cur.execute("SELECT campaign, email FROM links LIMIT 1")
+        row = cur.fetchone() or ('default', '')
+        queries = endpoint_queries(conn, {'campaign': row[0], 'email': row[1]})
+
+        before = explain_all(cur, queries, analyze)
+        print_plans("Query plans BEFORE", before)
+
+        print("\n🔄 Creating indexes (CONCURRENTLY - no write lock)...")
+        for name, definition in INDEXES:
+            # Drop leftovers of an interrupted concurrent build
+            cur.execute("""
+                SELECT i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s
+            """, (name,))
+            existing = cur.fetchone()
+            if existing and not existing[0]:
+                print(f"   ⚠️  {name} is INVALID, rebuilding")
+                cur.execute(f"DROP INDEX CONCURRENTLY {name}")
+            elif existing:
+                print(f"   ✅ {name} already exists")
+                continue
+
+            started = datetime.now()
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+            print(f"   ✅ {name} ON {definition} ({(datetime.now() - started).total_seconds():.1f}s)")
+
+        # Fresh statistics so the planner picks the new indexes up
+        cur.execute("ANALYZE links")
+        cur.execute("ANALYZE clicks")
+
+        after = explain_all(cur, queries, analyze)
+        print_plans("Query plans AFTER", after)
+
+        cur.close()
+        conn.close()
+
+        print("\n" + "=" * 60)
+        print("✅ Migration completed successfully!")
+        print("=" * 60)
+
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Error during migration: {str(e)}")
+        if 'conn' in locals():
+            conn.close()
+        return False
+
+if __name__ == "__main__":
+    print("\n⚠️  This script will add indexes to the clicks and links tables")
+    print("   Existing data will NOT be affected")
+    print("   Indexes are built concurrently: the app keeps running meanwhile")
+
+    if '--yes' in sys.argv:
+        response = 'yes'
+    else:
+        response = input("\nContinue? (yes/no): ").lower().strip()
+
+    if response in ['yes', 'y', 'oui', 'o']:
+        if not migrate(analyze='--analyze' in sys.argv):
+            print("\n⚠️  Migration failed. Please check the error above.")
+            exit(1)
+    else:
+        print("\n❌ Migration cancelled")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Migration script: Create the hourly click rollup table and backfill it from clicks
+The analytics endpoints read click_rollups_hourly instead of scanning clicks.
+Safe to run again: the rollups are recomputed from the clicks table.
+
+Usage: python migrate_add_click_rollups.py
+"""
+
+import os
+import psycopg2
+from datetime import datetime
+
+from click_rollups import ROLLUP_SCHEMA, rebuild
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+def migrate():
+    """Create click_rollups_hourly and fill it from existing clicks"""
+    print("Starting migration...")
+
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+
+        print("Connected to database successfully")
+
+        cur.execute(ROLLUP_SCHEMA)
+        print("✅ Table click_rollups_hourly ready")
+
+        cur.execute("SELECT COUNT(*) FROM clicks")
+        total_clicks = cur.fetchone()[0]
+        print(f"🔄 Backfilling rollups from {total_clicks} clicks...")
+
+        started = datetime.now()
+        rows = rebuild(cur)
+        conn.commit()
+        print(f"✅ {rows} hourly rollup rows written ({(datetime.now() - started).total_seconds():.1f}s)")
+
+        # Verify the migration
+        cur.execute("SELECT COALESCE(SUM(click_count), 0) FROM click_rollups_hourly")
+        rolled_up = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM clicks c JOIN links l ON l.link_id = c.link_id")
+        expected = cur.fetchone()[0]
+        if rolled_up != expected:
+            print(f"⚠️  Rollups hold {rolled_up} clicks, clicks table has {expected} (clicks written meanwhile?)")
+        else:
+            print(f"✅ Rollups match the clicks table ({expected} clicks)")
+
+        cur.close()
+        conn.close()
+
+        print("\n✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        raise
+
+if __name__ == '__main__':
+    migrate()
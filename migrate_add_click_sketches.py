@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Migration script: Create the hourly unique visitor sketches and backfill them from clicks
+The heatmap and timeline (mode=approx) merge HyperLogLog sketches from
+click_sketches_hourly instead of scanning clicks for unique visitors.
+Safe to run again: the sketches are recomputed from the clicks table,
+e.g. after changing HLL_PRECISION / HLL_ERROR.
+
+Usage: python migrate_add_click_sketches.py
+"""
+
+import os
+import psycopg2
+from datetime import datetime
+
+from click_sketches import SKETCH_SCHEMA, rebuild
+from hll import DEFAULT_PRECISION, HyperLogLog
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+def migrate():
+    """Create click_sketches_hourly and fill it from existing clicks"""
+    print("Starting migration...")
+
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+
+        print("Connected to database successfully")
+
+        cur.execute(SKETCH_SCHEMA)
+        print("✅ Table click_sketches_hourly ready")
+
+        cur.execute("SELECT COUNT(*) FROM clicks")
+        total_clicks = cur.fetchone()[0]
+        error = HyperLogLog(DEFAULT_PRECISION).relative_error
+        print(f"🔄 Backfilling sketches from {total_clicks} clicks (precision {DEFAULT_PRECISION}, ±{error:.1%})...")
+
+        started = datetime.now()
+        rows = rebuild(cur)
+        conn.commit()
+        print(f"✅ {rows} hourly sketches written ({(datetime.now() - started).total_seconds():.1f}s)")
+
+        # Compare the estimate with the exact count
+        cur.execute("SELECT COALESCE(SUM(LENGTH(sketch)), 0) FROM click_sketches_hourly")
+        size = cur.fetchone()[0]
+        cur.execute("SELECT sketch FROM click_sketches_hourly WHERE kind = 'link'")
+        union = HyperLogLog(DEFAULT_PRECISION)
+        for (sketch,) in cur.fetchall():
+            union.merge(HyperLogLog.from_bytes(sketch))
+        cur.execute("SELECT COUNT(DISTINCT c.link_id) FROM clicks c JOIN links l ON l.link_id = c.link_id")
+        exact = cur.fetchone()[0]
+        print(f"✅ Unique visitors: {union.count()} estimated, {exact} exact - sketches take {size // 1024} KB")
+
+        cur.close()
+        conn.close()
+
+        print("\n✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        raise
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Migration script: Create the first_clicks table and backfill it from clicks
+The exact unique visitor heatmap and timeline read each link's first
+click from first_clicks instead of a DISTINCT ON over clicks.
+Safe to run again: the table is recomputed from the clicks table.
+
+Usage: python migrate_add_first_clicks.py
+"""
+
+import os
+import psycopg2
+from datetime import datetime
+
+from first_clicks import FIRST_CLICK_SCHEMA, rebuild
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+def migrate():
+    """Create first_clicks and fill it from existing clicks"""
+    print("Starting migration...")
+
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+
+        print("Connected to database successfully")
+
+        cur.execute(FIRST_CLICK_SCHEMA)
+        print("✅ Table first_clicks ready")
+
+        cur.execute("SELECT COUNT(*) FROM clicks")
+        total_clicks = cur.fetchone()[0]
+        print(f"🔄 Backfilling first clicks from {total_clicks} clicks...")
+
+        started = datetime.now()
+        rows = rebuild(cur)
+        conn.commit()
+        print(f"✅ {rows} first clicks written ({(datetime.now() - started).total_seconds():.1f}s)")
+
+        # Verify the migration
+        cur.execute("SELECT COUNT(*) FROM first_clicks")
+        stored = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(DISTINCT c.link_id) FROM clicks c JOIN links l ON l.link_id = c.link_id")
+        expected = cur.fetchone()[0]
+        if stored != expected:
+            print(f"⚠️  first_clicks holds {stored} links, {expected} links have clicks (clicks written meanwhile?)")
+        else:
+            print(f"✅ first_clicks matches the clicks table ({expected} clicked links)")
+
+        cur.close()
+        conn.close()
+
+        print("\n✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        raise
+
+if __name__ == '__main__':
+    migrate()
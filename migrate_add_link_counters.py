@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Migration script: Add denormalized click counters to links and backfill them
+- links.click_count, links.first_clicked_at, links.last_clicked_at
+- indexes for /api/clicks ordering and hot-lead detection (built CONCURRENTLY)
+
+Counters are kept up to date by every click flush. Safe to run again: it
+then acts as a reconcile tool and only rewrites links whose counters
+differ from the clicks table. The app keeps running meanwhile.
+
+Usage: python migrate_add_link_counters.py [--check] [--batch-size N]
+  --check         only report links whose counters are wrong (no schema change)
+  --batch-size N  links reconciled per transaction (default 5000)
+"""
+
+import os
+import sys
+import psycopg2
+from datetime import datetime
+
+from link_counters import COUNTER_SCHEMA, COUNTER_INDEXES, reconcile
+from migrations import create_index_concurrently
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+def create_indexes(cur):
+    """Build the counter indexes concurrently (INVALID leftovers are rebuilt)"""
+    for name, definition in COUNTER_INDEXES:
+        create_index_concurrently(cur, name, definition)
+
+def migrate(check=False, batch_size=5000):
+    """Add the counter columns, reconcile them with clicks, then index them"""
+    print("Starting migration..." if not check else "Checking link counters...")
+
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+
+        print("Connected to database successfully")
+
+        if not check:
+            cur.execute(COUNTER_SCHEMA)
+            conn.commit()
+            print("✅ Columns click_count, first_clicked_at, last_clicked_at ready")
+
+        cur.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM links")
+        min_id, max_id = cur.fetchone()
+        conn.commit()
+
+        # One short transaction per id range: only a batch of links is locked at a time
+        print(f"🔄 {'Checking' if check else 'Reconciling'} links {min_id}..{max_id} by batches of {batch_size}...")
+        started = datetime.now()
+        wrong = 0
+        for first_id in range(min_id, max_id + 1, batch_size):
+            wrong += reconcile(cur, first_id, first_id + batch_size - 1, dry_run=check)
+            if check:
+                conn.rollback()
+            else:
+                conn.commit()
+        elapsed = (datetime.now() - started).total_seconds()
+
+        if check:
+            print(f"{'⚠️ ' if wrong else '✅'} {wrong} links with wrong counters ({elapsed:.1f}s)")
+        else:
+            print(f"✅ {wrong} links updated ({elapsed:.1f}s)")
+
+            print("\n🔄 Creating indexes (CONCURRENTLY - no write lock)...")
+            conn.autocommit = True
+            create_indexes(cur)
+            cur.execute("ANALYZE links")
+
+        cur.close()
+        conn.close()
+
+        print("\n✅ Done!")
+        return wrong
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        raise
+
+if __name__ == '__main__':
+    batch_size = 5000
+    if '--batch-size' in sys.argv:
+        batch_size = int(sys.argv[sys.argv.index('--batch-size') + 1])
+    wrong = migrate(check='--check' in sys.argv, batch_size=batch_size)
+    if '--check' in sys.argv and wrong:
+        exit(1)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Migrations
+Migrations de schéma versionnées, appliquées une fois au démarrage (gunicorn on_starting, app.py, init_db.py)
+et enregistrées dans `schema_migrations`
+
+Usage: python migrations.py [--status]
+  --status  list applied and pending migrations without applying anything
+"""
+
+import os
+import sys
+import time
+import psycopg2
+import secrets
+from datetime import datetime
+
+import bot_filter
+import clay_outbox
+import click_rollups
+import click_sketches
+import first_clicks
+import link_counters
+import response_cache
+import short_ids
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost/link_tracker')
+
+# pg_advisory_lock key: only one process migrates at a time (workers, deploy build, scripts)
+MIGRATION_LOCK_ID = 72465437
+# Seconds between two pg_try_advisory_lock attempts while another process migrates
+LOCK_POLL_INTERVAL = 1.0
+
+# Clicks (or links) per transaction in backfills: only a batch is locked at a time
+BACKFILL_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '5000'))
+
+MIGRATIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    -- Derived tables being filled from clicks: ids up to max_id, done up to last_id
+    CREATE TABLE IF NOT EXISTS schema_backfills (
+        name VARCHAR(64) PRIMARY KEY,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        max_id BIGINT
+    );
+'''
+
+
+def _table_exists(cur, table):
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+    return cur.fetchone()[0]
+
+
+def _column_exists(cur, table, column):
+    cur.execute('''
+        SELECT EXISTS (
+            SELECT FROM information_schema.columns
+            WHERE table_name = %s AND column_name = %s
+        )
+    ''', (table, column))
+    return cur.fetchone()[0]
+
+
+def create_index_concurrently(cur, name, definition, unique=False):
+    """Build an index without blocking writes (CREATE INDEX CONCURRENTLY)
+
+    Commits the current transaction and runs in autocommit mode, which a
+    concurrent build requires. Leftovers of an interrupted build (INVALID
+    index) are dropped and built again.
+    """
+    conn = cur.connection
+    autocommit = conn.autocommit
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cur.execute('''
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+        ''', (name,))
+        existing = cur.fetchone()
+        if existing and existing[0]:
+            return
+        if existing:
+            print(f"   ⚠️  {name} is INVALID, rebuilding")
+            cur.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+        started = datetime.now()
+        cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+        print(f"   ✅ {name} ({(datetime.now() - started).total_seconds():.1f}s)")
+    finally:
+        conn.autocommit = autocommit
+
+
+def _start_backfill(cur, table, schema):
+    """Create a derived table: returns the backfill to run, (last id done, max id), or None
+
+    The table and its schema_backfills row are created in one transaction.
+    The upper bound is read once the transactions that were running then
+    have ended: clicks above it are written to the table by the click
+    flushes themselves, clicks up to it by the backfill, so none is counted
+    twice. Progress is recorded with each batch and an interrupted backfill
+    resumes where it stopped. A table that already existed (created by a
+    migrate_add_*.py script) is left as is.
+    """
+    conn = cur.connection
+    created = not _table_exists(cur, table)
+    cur.execute(schema)
+    if created:
+        _add_bot_columns(cur)
+        cur.execute('INSERT INTO schema_backfills (name) VALUES (%s) ON CONFLICT (name) DO NOTHING', (table,))
+    cur.execute('SELECT last_id, max_id FROM schema_backfills WHERE name = %s', (table,))
+    progress = cur.fetchone()
+    cur.execute('SELECT txid_current()')
+    created_xid = cur.fetchone()[0]
+    conn.commit()
+    if progress is None:
+        return None
+    last_id, max_id = progress
+    if max_id is None:
+        waiting = False
+        while True:
+            cur.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            oldest = cur.fetchone()[0]
+            conn.commit()
+            if oldest > created_xid:
+                break
+            if not waiting:
+                print(f"   ⏳ {table}: waiting for running transactions before the backfill...")
+                waiting = True
+            time.sleep(LOCK_POLL_INTERVAL)
+        cur.execute('SELECT COALESCE(MAX(id), 0) FROM clicks')
+        max_id = cur.fetchone()[0]
+        cur.execute('UPDATE schema_backfills SET max_id = %s WHERE name = %s', (max_id, table))
+        conn.commit()
+    elif last_id:
+        print(f"   ↪️  {table}: resuming backfill after click {last_id} (up to {max_id})")
+    return last_id, max_id
+
+
+def _backfill_from_clicks(cur, table, progress, backfill, batch_size=None):
+    """Run backfill(cur, first_id, last_id) over the clicks up to the recorded bound, one transaction per id range
+
+    Each batch commits together with its progress in schema_backfills.
+    """
+    batch_size = batch_size or BACKFILL_BATCH_SIZE
+    conn = cur.connection
+    last_id, max_id = progress
+    for first_id in range(last_id + 1, max_id + 1, batch_size):
+        batch_last = min(first_id + batch_size - 1, max_id)
+        backfill(cur, first_id, batch_last)
+        cur.execute('UPDATE schema_backfills SET last_id = %s WHERE name = %s', (batch_last, table))
+        conn.commit()
+    cur.execute('DELETE FROM schema_backfills WHERE name = %s', (table,))
+    conn.commit()
+
+
+def _recording(record):
+    """backfill(cur, first_id, last_id) feeding a range of human clicks to record(cur, rows, campaigns)
+
+    Same rows as a click flush gives the derived tables, so each batch
+    merges into what the previous ones wrote.
+    """
+    def backfill(cur, first_id, last_id):
+        cur.execute('''
+            SELECT c.id, c.link_id, c.ip_address, c.clicked_at, l.campaign
+            FROM clicks c
+            JOIN links l ON l.link_id = c.link_id
+            WHERE c.id BETWEEN %s AND %s AND NOT c.is_bot
+        ''', (first_id, last_id))
+        clicks = cur.fetchall()
+        if clicks:
+            record(cur, [click[:4] for click in clicks], {click[1]: click[4] for click in clicks})
+    return backfill
+
+
+def create_base_tables(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS links (
+            id SERIAL PRIMARY KEY,
+            link_id VARCHAR(10) UNIQUE NOT NULL,
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            email VARCHAR(255),
+            campaign VARCHAR(255),
+            destination_url TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS clicks (
+            id SERIAL PRIMARY KEY,
+            link_id VARCHAR(10) NOT NULL,
+            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            country VARCHAR(100),
+            city VARCHAR(100),
+            referer TEXT,
+            FOREIGN KEY (link_id) REFERENCES links(link_id)
+        )
+    ''')
+
+
+def add_company_fields(cur):
+    cur.execute('''
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS company_name VARCHAR(255);
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS company_url TEXT;
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS linkedin_url TEXT;
+    ''')
+
+
+def add_icp(cur):
+    cur.execute('ALTER TABLE links ADD COLUMN IF NOT EXISTS icp VARCHAR(255)')
+
+
+def add_clay_tracking(cur):
+    cur.execute('''
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS sent_to_clay BOOLEAN DEFAULT FALSE;
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS sent_to_clay_at TIMESTAMP;
+    ''')
+
+
+def add_click_event_id(cur):
+    # Idempotency key for buffered/spooled click inserts
+    cur.execute('ALTER TABLE clicks ADD COLUMN IF NOT EXISTS event_id VARCHAR(32)')
+    create_index_concurrently(cur, 'idx_clicks_event_id', 'clicks (event_id)', unique=True)
+
+
+CLICK_INDEXES = [
+    ('idx_clicks_link_id_clicked_at', 'clicks (link_id, clicked_at)'),
+    ('idx_clicks_clicked_at', 'clicks (clicked_at)'),
+    ('idx_links_campaign', 'links (campaign)'),
+    ('idx_links_email', 'links (email)'),
+    ('idx_links_created_at', 'links (created_at)'),
+]
+
+
+def add_click_indexes(cur):
+    # Analytics access paths
+    for name, definition in CLICK_INDEXES:
+        create_index_concurrently(cur, name, definition)
+
+
+def _add_bot_columns(cur):
+    # The derived-table backfills skip bot clicks: on a database older than
+    # migration 14 the columns must exist before they run (idempotent)
+    cur.execute(bot_filter.BOT_COLUMNS)
+
+
+def add_click_rollups(cur):
+    progress = _start_backfill(cur, 'click_rollups_hourly', click_rollups.ROLLUP_SCHEMA)
+    if progress:
+        _backfill_from_clicks(cur, 'click_rollups_hourly', progress,
+                              _recording(lambda cur, rows, campaigns: click_rollups.record_clicks(cur, rows)))
+
+
+def add_first_clicks(cur):
+    progress = _start_backfill(cur, 'first_clicks', first_clicks.FIRST_CLICK_SCHEMA)
+    if progress:
+        # Countries are copied from the clicks (geolocated long ago, record_countries won't run again)
+        _backfill_from_clicks(cur, 'first_clicks', progress, first_clicks.backfill)
+
+
+def add_click_sketches(cur):
+    progress = _start_backfill(cur, 'click_sketches_hourly', click_sketches.SKETCH_SCHEMA)
+    if progress:
+        _backfill_from_clicks(cur, 'click_sketches_hourly', progress, _recording(click_sketches.record_clicks))
+
+
+def add_link_counters(cur):
+    cur.execute(link_counters.COUNTER_SCHEMA)
+    _add_bot_columns(cur)
+    cur.connection.commit()
+
+    # Reconcile is idempotent: an interrupted run simply goes over every batch again
+    cur.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM links')
+    min_id, max_id = cur.fetchone()
+    cur.connection.commit()
+    for first_id in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+        link_counters.reconcile(cur, first_id, first_id + BACKFILL_BATCH_SIZE - 1)
+        cur.connection.commit()
+
+    for name, definition in link_counters.COUNTER_INDEXES:
+        create_index_concurrently(cur, name, definition)
+
+
+def add_short_id_allocation(cur):
+    # Sequence behind the link_id allocator, and the key of its permutation
+    cur.execute(f'''
+        CREATE SEQUENCE IF NOT EXISTS {short_ids.SEQUENCE};
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key VARCHAR(64) PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    ''')
+    cur.execute('INSERT INTO app_settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO NOTHING',
+                (short_ids.KEY_SETTING, secrets.token_hex(32)))
+
+
+def add_clay_outbox(cur):
+    cur.execute(clay_outbox.OUTBOX_SCHEMA)
+
+
+def add_clay_outbox_leases(cur):
+    cur.execute(clay_outbox.OUTBOX_LEASE_SCHEMA)
+
+
+def add_cumulative_sketches(cur):
+    # Filled by the app (click_sketches.advance_cumulative) after its first click flush
+    cur.execute(click_sketches.CUMULATIVE_SCHEMA)
+
+
+def add_hot_lead_thresholds(cur):
+    cur.execute(clay_outbox.THRESHOLD_SCHEMA)
+
+
+def add_bot_flags(cur):
+    # Existing clicks stay counted as human (is_bot defaults to FALSE)
+    _add_bot_columns(cur)
+
+
+def add_geo_sweep_index(cur):
+    # Human clicks still waiting for geolocation (GeoEnricher sweep)
+    create_index_concurrently(cur, 'idx_clicks_missing_geo', 'clicks (id) WHERE country IS NULL AND NOT is_bot')
+
+
+def add_cache_versions(cur):
+    cur.execute(response_cache.VERSION_SCHEMA)
+
+
+# (version, name, function) - append only: an applied version is never run again.
+# Derived tables created on an existing database are backfilled from clicks.
+# A migration touching a large live table commits on its own (batched
+# backfills, concurrent index builds) and must then be safe to run again
+# after an interruption: it is only recorded once it has completed.
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables),
+    (2, 'company fields', add_company_fields),
+    (3, 'icp', add_icp),
+    (4, 'clay tracking', add_clay_tracking),
+    (5, 'click event_id', add_click_event_id),
+    (6, 'click indexes', add_click_indexes),
+    (7, 'click rollups', add_click_rollups),
+    (8, 'first clicks', add_first_clicks),
+    (9, 'click sketches', add_click_sketches),
+    (10, 'link counters', add_link_counters),
+    (11, 'short id allocation', add_short_id_allocation),
+    (12, 'clay outbox', add_clay_outbox),
+    (13, 'hot lead thresholds', add_hot_lead_thresholds),
+    (14, 'click bot flags', add_bot_flags),
+    (15, 'geo sweep index', add_geo_sweep_index),
+    (16, 'cache versions', add_cache_versions),
+    (17, 'clay outbox leases', add_clay_outbox_leases),
+    (18, 'cumulative click sketches', add_cumulative_sketches),
+]
+
+
+def applied_versions(cur):
+    cur.execute('SELECT version FROM schema_migrations')
+    return {version for (version,) in cur.fetchall()}
+
+
+def _acquire_lock(conn):
+    """Take the migration advisory lock, polling instead of blocking
+
+    A session blocked in pg_advisory_lock() holds a snapshot that a
+    concurrent index build of the migrating process would wait for.
+    """
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            waiting = False
+            while True:
+                cur.execute('SELECT pg_try_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+                if cur.fetchone()[0]:
+                    return
+                if not waiting:
+                    print("🗄️  Another process is migrating the database, waiting...")
+                    waiting = True
+                time.sleep(LOCK_POLL_INTERVAL)
+    finally:
+        conn.autocommit = False
+
+
+def run(database_url=DATABASE_URL):
+    """Apply pending migrations in order: returns the versions applied
+
+    Each migration runs in its own transaction, except the steps that
+    commit on their own (see MIGRATIONS). Holds an advisory lock for the
+    whole run, so processes starting at the same time wait for the first
+    one and then find nothing left to do.
+    """
+    conn = psycopg2.connect(database_url)
+    try:
+        _acquire_lock(conn)
+        cur = conn.cursor()
+        cur.execute(MIGRATIONS_SCHEMA)
+        applied = applied_versions(cur)
+        conn.commit()
+
+        done = []
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            started = datetime.now()
+            migrate(cur)
+            cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+            conn.commit()
+            done.append(version)
+            print(f"🗄️  Migration {version:03d} {name} applied ({(datetime.now() - started).total_seconds():.1f}s)")
+
+        if not done:
+            print(f"🗄️  Database schema up to date (version {max(applied, default=0)})")
+        cur.close()
+        return done
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Also releases the advisory lock
+        conn.close()
+
+
+def status(database_url=DATABASE_URL):
+    """Print applied / pending migrations: returns the pending versions"""
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        applied = applied_versions(cur) if _table_exists(cur, 'schema_migrations') else set()
+        for version, name, _migrate in MIGRATIONS:
+            print(f"   {'✅' if version in applied else '⏳'} {version:03d} {name}")
+        cur.close()
+        return [version for version, _name, _migrate in MIGRATIONS if version not in applied]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == '__main__':
+    try:
+        if '--status' in sys.argv:
+            pending = status()
+            print(f"\n{len(pending)} pending migration(s)")
+        else:
+            run()
+            print("✅ Done!")
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        sys.exit(1)
@@ -0,0 +1,166 @@
+"""
+Response Cache
+Cache des réponses JSON des endpoints analytics, versionné par campagne (tous workers) à chaque écriture de clics ou de liens
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+from ttl_cache import TTLCache
+
+CachedResponse = namedtuple('CachedResponse', 'version computed_at body etag last_modified')
+
+# Per-campaign data version shared by all workers, bumped in the transactions
+# that write clicks or change links (see migrations.py)
+VERSION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        campaign VARCHAR(255) PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+'''
+
+
+def bump_versions(cur, campaigns):
+    """Bump the shared version of `campaigns` (same transaction as the change)
+
+    Sorted so concurrent flushes lock the rows in the same order. Each row
+    only ever increases, so the sum over all rows versions the unfiltered view.
+    """
+    campaigns = sorted({campaign or '' for campaign in campaigns})
+    if not campaigns:
+        return
+    cur.execute('''
+        INSERT INTO cache_versions (campaign, version)
+        SELECT c, 1 FROM unnest(%s::varchar[]) AS c
+        ON CONFLICT (campaign) DO UPDATE SET version = cache_versions.version + 1
+    ''', (campaigns,))
+
+
+class ResponseCache:
+    """Per-worker cache of API response bodies, versioned per campaign
+
+    An entry is served while it is younger than `ttl` seconds and the
+    campaign version it was computed at has not moved. The version is
+    this worker's local counter (invalidate(), for its own writes) plus
+    the shared cache_versions row that every worker bumps when it writes
+    clicks or changes links - the unfiltered '' view uses the sum of all
+    rows. The shared version is read at most once per
+    `version_check_interval` seconds per campaign (one primary-key read),
+    so entries stay correct across workers and can outlive the dashboard
+    poll; the TTL only bounds sliding time ranges (24h, 7d).
+
+    Stale entries are kept (up to `maxsize`) for their validators: the
+    ETag is a hash of the body, so a recomputed identical body keeps its
+    ETag and Last-Modified, and clients polling with If-None-Match get a
+    304 from any worker.
+    """
+
+    def __init__(self, maxsize=1000, ttl=300, get_connection=None, version_check_interval=1.0):
+        self.ttl = ttl
+        self.get_connection = get_connection
+        self.version_check_interval = version_check_interval
+        self._entries = TTLCache(maxsize, ttl=max(ttl * 10, 3600))
+        self._versions = {}
+        self._shared = {}  # campaign -> (checked_at, shared version)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.not_modified = 0
+        self.version_checks = 0
+
+    @classmethod
+    def from_env(cls, get_connection=None):
+        return cls(
+            maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE', 1000)),
+            ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 300)),
+            get_connection=get_connection,
+            version_check_interval=float(os.environ.get('RESPONSE_CACHE_VERSION_CHECK', 1.0)),
+        )
+
+    def shared_version(self, campaign):
+        """Version of `campaign` in cache_versions (None if it cannot be read)"""
+        if self.get_connection is None:
+            return 0
+        campaign = campaign or ''
+        now = time.monotonic()
+        checked = self._shared.get(campaign)
+        if checked is not None and now - checked[0] < self.version_check_interval:
+            return checked[1]
+        try:
+            conn = self.get_connection()
+            try:
+                cur = conn.cursor()
+                if campaign:
+                    cur.execute('SELECT COALESCE(MAX(version), 0) FROM cache_versions WHERE campaign = %s', (campaign,))
+                else:
+                    cur.execute('SELECT COALESCE(SUM(version), 0) FROM cache_versions')
+                version = int(cur.fetchone()[0])
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"⚠️  Response cache version check failed: {e}")
+            return None
+        self.version_checks += 1
+        self._shared[campaign] = (now, version)
+        return version
+
+    def version(self, campaign):
+        """Current version of a campaign's data - read it before running the queries"""
+        return (self._generation, self._versions.get(campaign or '', 0), self.shared_version(campaign))
+
+    def invalidate(self, campaigns=None):
+        """Bump the local version of `campaigns` (all campaigns if None)"""
+        with self._lock:
+            if campaigns is None:
+                self._generation += 1
+                return
+            for campaign in set(campaigns) | {''}:
+                self._versions[campaign] = self._versions.get(campaign, 0) + 1
+
+    def get(self, key, campaign):
+        """Fresh entry for key, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        version = self.version(campaign)
+        if version[2] is None or entry.version != version:
+            self.invalidated += 1
+            return None
+        if time.monotonic() - entry.computed_at >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def set(self, key, version, body):
+        """Store a response body computed at `version`; returns its CachedResponse"""
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        previous = self._entries.get(key)
+        if previous is not None and previous.etag == etag:
+            last_modified = previous.last_modified
+        else:
+            last_modified = time.time()
+        entry = CachedResponse(version, time.monotonic(), body, etag, last_modified)
+        self._entries.set(key, entry)
+        return entry
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.invalidated
+        return {
+            'size': len(self._entries),
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidated': self.invalidated,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+            'not_modified': self.not_modified,
+            'version_checks': self.version_checks,
+        }
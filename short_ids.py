@@ -0,0 +1,133 @@
+"""
+Short IDs
+Allocation des link_id : valeurs de séquence réservées par blocs, permutées (Feistel à clé) et encodées en base62
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# 8 base62 characters hold 62^8 > 2^47 values: the permutation works on 46 bits
+ID_LENGTH = 8
+HALF_BITS = 23
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+SEQUENCE = 'link_short_id_seq'
+KEY_SETTING = 'short_id_key'
+
+
+def encode_base62(value, length=ID_LENGTH):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(BASE62[digit])
+    if value:
+        raise ValueError('value does not fit in the short ID length')
+    return ''.join(reversed(chars))
+
+
+class FeistelPermutation:
+    """Keyed bijection of [0, 2^46): consecutive sequence values give unrelated IDs"""
+
+    def __init__(self, key):
+        self.key = key.encode('utf-8') if isinstance(key, str) else bytes(key)
+
+    def _round(self, half, round_index):
+        digest = hashlib.blake2b(half.to_bytes(4, 'big'), digest_size=4, key=self.key,
+                                 salt=round_index.to_bytes(16, 'big')).digest()
+        return int.from_bytes(digest, 'big') & HALF_MASK
+
+    def permute(self, value):
+        left, right = value >> HALF_BITS & HALF_MASK, value & HALF_MASK
+        for i in range(ROUNDS):
+            left, right = right, left ^ self._round(right, i)
+        return left << HALF_BITS | right
+
+    def invert(self, value):
+        left, right = value >> HALF_BITS & HALF_MASK, value & HALF_MASK
+        for i in reversed(range(ROUNDS)):
+            left, right = right ^ self._round(left, i), left
+        return left << HALF_BITS | right
+
+
+class ShortIdAllocator:
+    """Unique, unguessable link_ids without a uniqueness check
+
+    Sequence values are reserved `block_size` at a time (one round-trip
+    per block, more for a large bulk request) and handed out from memory;
+    each one goes through the keyed permutation and base62. Distinct
+    sequence values always give distinct IDs, so an INSERT never collides
+    with another generated ID. Values left in a block when the worker
+    exits are simply skipped. The key lives in app_settings (created by
+    migrations.py) so every worker produces the same mapping.
+    """
+
+    def __init__(self, get_connection, block_size=100):
+        self.get_connection = get_connection
+        self.block_size = block_size
+
+        self._values = deque()
+        self._permutation = None
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self._allocated = 0
+        self._blocks = 0
+        self._reserve_seconds = 0.0
+        self._allocate_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, get_connection):
+        return cls(get_connection, block_size=int(os.environ.get('SHORT_ID_BLOCK_SIZE', 100)))
+
+    def _reserve(self, cur, count):
+        if self._permutation is None:
+            cur.execute('SELECT value FROM app_settings WHERE key = %s', (KEY_SETTING,))
+            self._permutation = FeistelPermutation(cur.fetchone()[0])
+        cur.execute(f"SELECT nextval('{SEQUENCE}') FROM generate_series(1, %s)", (count,))
+        self._values.extend(value for (value,) in cur.fetchall())
+        self._blocks += 1
+
+    def allocate(self, count=1, cur=None):
+        """`count` new link_ids; `cur` reuses the caller's connection for a reservation"""
+        started = time.perf_counter()
+        with self._lock:
+            missing = count - len(self._values)
+            if missing > 0:
+                # Round up to whole blocks so the next calls are served from memory
+                reserve = -(-missing // self.block_size) * self.block_size
+                reserve_started = time.perf_counter()
+                if cur is not None:
+                    self._reserve(cur, reserve)
+                else:
+                    conn = self.get_connection()
+                    try:
+                        own = conn.cursor()
+                        self._reserve(own, reserve)
+                        conn.commit()
+                        own.close()
+                    finally:
+                        conn.close()
+                self._reserve_seconds += time.perf_counter() - reserve_started
+
+            values = [self._values.popleft() for _ in range(count)]
+            ids = [encode_base62(self._permutation.permute(value)) for value in values]
+            self._allocated += count
+            self._allocate_seconds += time.perf_counter() - started
+        return ids
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allocated': self._allocated,
+                'blocks_reserved': self._blocks,
+                'block_size': self.block_size,
+                'available': len(self._values),
+                'avg_reserve_ms': round(self._reserve_seconds / self._blocks * 1000, 2) if self._blocks else None,
+                'ids_per_second': round(self._allocated / self._allocate_seconds) if self._allocate_seconds else None,
+            }
@@ -0,0 +1,58 @@
+"""BotFilter user-agent rules and burst tagging through the click buffer (no database)"""
+
+import time
+
+import pytest
+
+from bot_filter import BotFilter
+from click_buffer import ClickBuffer
+
+BROWSER = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36'
+
+
+@pytest.fixture
+def bots():
+    return BotFilter(burst_hits=3, burst_window=2.0)
+
+
+@pytest.mark.parametrize('user_agent, reason', [
+    ('LinkedInBot/1.0 (compatible; Mozilla/5.0; +http://www.linkedin.com)', 'preview:linkedin'),
+    ('Barracuda Sentinel (EE)', 'scanner:email'),
+    ('Mozilla/5.0 (compatible; Proofpoint-URLDefense/2.1)', 'scanner:email'),
+    ('Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)', 'crawler'),
+    ('SiteChecker/1.2', 'crawler'),
+    ('python-requests/2.31.0', 'scanner:script'),
+])
+def test_known_bots(bots, user_agent, reason):
+    assert bots.classify('abc123', '8.8.8.8', user_agent) == reason
+
+
+@pytest.mark.parametrize('user_agent', [
+    BROWSER,
+    # Corporate builds mentioning a security vendor or a monitor in a comment
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; Cisco AnyConnect) AppleWebKit/537.36 Chrome/126.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Symantec Endpoint Protection; Trident/7.0; rv:11.0) like Gecko',
+    'Mozilla/5.0 (X11; Linux x86_64; PerformanceMonitor) Gecko/20100101 Firefox/127.0',
+])
+def test_browsers_are_human(bots, user_agent):
+    assert bots.classify('abc123', '8.8.8.8', user_agent) is None
+
+
+def test_burst_tags_its_first_hits_in_the_buffer(bots):
+    buffer = ClickBuffer(get_connection=None, hold=bots.burst_hold)
+    buffer._ensure_started = lambda: None  # no flusher thread
+
+    reasons = []
+    for _ in range(4):
+        reason = bots.classify('abc123', '8.8.8.8', BROWSER)
+        if reason == 'burst':
+            buffer.tag_recent('abc123', time.time() - bots.burst_window, reason)
+        buffer.add('abc123', '8.8.8.8', BROWSER, '', bot_reason=reason)
+        reasons.append(reason)
+    buffer.add('other1', '8.8.8.8', BROWSER, '')
+
+    assert reasons == [None, None, 'burst', 'burst']
+    assert [e['bot_reason'] for e in buffer._pending] == ['burst'] * 4 + [None]
+    # Held clicks are not written before the burst window is over
+    assert buffer._take_batch() == []
+    assert len(buffer._take_batch(force=True)) == 5
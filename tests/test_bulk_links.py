@@ -0,0 +1,56 @@
+"""bulk_links.link_row validation of one input row"""
+
+import pytest
+
+from bulk_links import CAMPAIGN, LINK_FIELDS, link_row
+
+FIELDS = [field for field, _size in LINK_FIELDS]
+
+
+def values(row):
+    return dict(zip(FIELDS, row))
+
+
+def test_valid_row():
+    row = link_row({
+        'first_name': 'Jean', 'last_name': 'Dupont', 'email': 'jean@example.com', 'ICP': 'CEO',
+        'campaign': 'q4', 'destination_url': 'https://example.com', 'unknown_field': 'ignored',
+    })
+    assert len(row) == len(LINK_FIELDS)
+    assert values(row) == {
+        'first_name': 'Jean', 'last_name': 'Dupont', 'email': 'jean@example.com', 'icp': 'CEO',
+        'campaign': 'q4', 'company_name': '', 'company_url': '', 'linkedin_url': '',
+        'destination_url': 'https://example.com',
+    }
+
+
+def test_defaults_and_coercion():
+    row = values(link_row({'destination_url': 'https://example.com', 'campaign': '', 'icp': 'CTO',
+                           'first_name': None, 'company_name': 42}))
+    assert row['campaign'] == 'default'
+    assert row['icp'] == 'CTO'
+    assert row['first_name'] == ''
+    assert row['company_name'] == '42'
+    assert link_row({'destination_url': 'https://example.com'})[CAMPAIGN] == 'default'
+
+
+@pytest.mark.parametrize('data, message', [
+    (['https://example.com'], 'row must be a JSON object'),
+    ('https://example.com', 'row must be a JSON object'),
+    (None, 'row must be a JSON object'),
+    ({'email': 'jean@example.com'}, 'destination_url is required'),
+    ({'destination_url': ''}, 'destination_url is required'),
+    ({'destination_url': 'https://example.com', 'email': {'a': 1}}, 'email must be a string'),
+    ({'destination_url': 'https://example.com', 'ICP': ['CEO']}, 'icp must be a string'),
+    ({'destination_url': 'https://example.com', 'campaign': 'c' * 256}, 'campaign is longer than 255 characters'),
+])
+def test_invalid_rows(data, message):
+    with pytest.raises(ValueError, match=message):
+        link_row(data)
+
+
+def test_size_limits():
+    assert values(link_row({'destination_url': 'https://example.com', 'email': 'e' * 255}))['email'] == 'e' * 255
+    # TEXT columns have no limit
+    long_url = 'https://example.com/' + 'x' * 5000
+    assert values(link_row({'destination_url': long_url}))['destination_url'] == long_url
@@ -0,0 +1,48 @@
+"""/api/clicks keyset cursors: round trip and rejection of invalid or tampered cursors"""
+
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from analytics import decode_cursor, encode_cursor
+
+ROW = {'click_count': 12, 'created_at': datetime(2026, 10, 18, 9, 30, 15, 123456), 'link_id': 'Ab3dE6gH'}
+
+
+def cursor_of(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+def test_round_trip():
+    cursor = encode_cursor(ROW)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (12, ROW['created_at'], 'Ab3dE6gH')
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor',
+    '%%%%',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    encode_cursor(ROW)[:-4],                          # truncated
+    cursor_of(None),
+    cursor_of({'click_count': 12}),
+    cursor_of([12, '2026-10-18T09:30:15']),           # missing link_id
+    cursor_of([12, '2026-10-18T09:30:15', 'a', 'b']),
+    cursor_of(['twelve', '2026-10-18T09:30:15', 'a']),
+    cursor_of([[12], '2026-10-18T09:30:15', 'a']),
+    cursor_of([12, 'yesterday', 'a']),
+    cursor_of([12, 1760780000, 'a']),
+])
+def test_invalid_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+
+def test_tampered_key_is_only_a_position():
+    # Cursors are not signed: an edited but well-formed key just moves the
+    # keyset position, and its values are typed before reaching the query
+    cursor = cursor_of(['7', '2026-01-01T00:00:00', 42])
+    assert decode_cursor(cursor) == (7, datetime(2026, 1, 1), '42')
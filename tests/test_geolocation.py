@@ -0,0 +1,51 @@
+"""Offline GeoDatabase lookups against tests/fixtures/geo_ranges.csv"""
+
+import os
+
+import pytest
+
+from geolocation import UNKNOWN, GeoDatabase, parse_ip
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'geo_ranges.csv')
+
+
+@pytest.fixture
+def geo():
+    return GeoDatabase(FIXTURE)
+
+
+def test_ipv4(geo):
+    assert geo.lookup('8.8.8.8') == ('United States', 'Mountain View')
+    assert geo.lookup('81.56.1.2') == ('France', 'Paris')
+
+
+def test_x_forwarded_for_uses_first_address(geo):
+    assert geo.lookup('81.56.1.2, 10.0.0.1') == ('France', 'Paris')
+
+
+def test_ipv6(geo):
+    assert geo.lookup('2001:4860:4860::8888') == ('United States', 'Mountain View')
+    assert geo.lookup('2a01:e00:1::1') == ('France', 'Paris')
+
+
+def test_ipv4_mapped_ipv6(geo):
+    assert parse_ip('::ffff:8.8.8.8') == parse_ip('8.8.8.8')
+    assert geo.lookup('::ffff:8.8.8.8') == ('United States', 'Mountain View')
+
+
+def test_private_and_unmatched(geo):
+    assert geo.lookup('10.1.2.3') == UNKNOWN
+    assert geo.lookup('192.168.1.1') == UNKNOWN
+    assert geo.lookup('1.1.1.1') == UNKNOWN
+    assert geo.lookup('not an ip') == UNKNOWN
+    assert geo.stats()['misses_total'] == 4
+
+
+def test_missing_file_is_not_reloaded_on_every_lookup(tmp_path):
+    geo = GeoDatabase(str(tmp_path / 'missing.csv'), check_interval=60)
+    for _ in range(3):
+        assert geo.lookup('8.8.8.8') == UNKNOWN
+    stats = geo.stats()
+    assert stats['loaded'] is False
+    assert stats['reload_errors_total'] == 1
+    assert stats['lookups_total'] == 3
@@ -0,0 +1,69 @@
+"""HyperLogLog estimates, merges across precisions and serialization"""
+
+import pytest
+
+from hll import HyperLogLog, precision_for_error
+
+
+def sketch_of(values, precision=12):
+    sketch = HyperLogLog(precision)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.mark.parametrize('cardinality', [1000, 20000, 100000])
+def test_estimate_within_error_bound(cardinality):
+    sketch = sketch_of(f'visitor-{i}' for i in range(cardinality))
+    # 4 standard errors: a deterministic hash, so this never flakes
+    assert abs(sketch.count() - cardinality) <= 4 * sketch.relative_error * cardinality
+
+
+def test_small_cardinalities_are_near_exact():
+    assert HyperLogLog().count() == 0
+    assert sketch_of(['a', 'a', 'a']).count() == 1
+    assert abs(sketch_of(f'v{i}' for i in range(100)).count() - 100) <= 2
+
+
+def test_merge_estimates_the_union():
+    left = sketch_of(f'v{i}' for i in range(0, 30000))
+    right = sketch_of(f'v{i}' for i in range(20000, 50000))
+    union = left.merge(right)
+    assert abs(union.count() - 50000) <= 4 * union.relative_error * 50000
+
+
+def test_merge_is_the_sketch_of_the_union():
+    values = [f'v{i}' for i in range(5000)]
+    merged = sketch_of(values[:3000]).merge(sketch_of(values[2000:]))
+    assert merged.to_bytes() == sketch_of(values).to_bytes()
+
+
+def test_merge_folds_to_the_coarser_precision():
+    fine = sketch_of((f'v{i}' for i in range(10000)), precision=14)
+    coarse = sketch_of((f'v{i}' for i in range(10000, 20000)), precision=10)
+
+    assert fine.folded(10).to_bytes() == sketch_of((f'v{i}' for i in range(10000)), precision=10).to_bytes()
+    for union in (sketch_of([], 14).merge(fine).merge(coarse), sketch_of([], 10).merge(coarse).merge(fine)):
+        assert union.precision == 10
+        assert abs(union.count() - 20000) <= 4 * union.relative_error * 20000
+    with pytest.raises(ValueError):
+        coarse.folded(12)
+
+
+@pytest.mark.parametrize('cardinality', [0, 10, 5000])
+def test_bytes_round_trip(cardinality):
+    sketch = sketch_of(f'v{i}' for i in range(cardinality))
+    data = sketch.to_bytes()
+    restored = HyperLogLog.from_bytes(data)
+    assert restored.to_bytes() == data
+    assert restored.count() == sketch.count()
+    # Quiet hours are stored sparse, busy ones dense (at most m bytes plus the header)
+    assert len(data) == (2 + 3 * cardinality if cardinality <= 10 else 2 + sketch.m)
+
+
+def test_precision_bounds():
+    assert precision_for_error(0.01) == 14
+    assert precision_for_error(0.5) == 4
+    assert precision_for_error(0.0001) == 16
+    with pytest.raises(ValueError):
+        HyperLogLog(17)
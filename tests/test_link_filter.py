@@ -0,0 +1,87 @@
+"""BloomFilter membership and LinkFilter sync against an in-memory links table"""
+
+from datetime import datetime, timedelta
+
+from link_filter import BloomFilter, LinkFilter
+
+
+def test_bloom_has_no_false_negatives():
+    bloom = BloomFilter(5000, error_rate=0.01)
+    keys = [f'k{i:05d}' for i in range(5000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f'x{i:05d}' in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.03
+
+
+class FakeLinks:
+    """links table with commit visibility: a row is only seen once committed"""
+
+    def __init__(self):
+        self.now = datetime(2026, 10, 18, 12, 0, 0)
+        self.committed = []  # (created_at, link_id)
+
+    def connect(self, timeout=None):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, links):
+        self.links = links
+
+    def cursor(self):
+        return FakeCursor(self.links)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, links):
+        self.links = links
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith('SELECT LOCALTIMESTAMP, COUNT(*)'):
+            self.rows = [(self.links.now, len(self.links.committed))]
+        elif sql.startswith('SELECT LOCALTIMESTAMP'):
+            self.rows = [(self.links.now,)]
+        elif 'WHERE created_at >=' in sql:
+            self.rows = [(link_id,) for created_at, link_id in self.links.committed if created_at >= params[0]]
+        else:
+            self.rows = [(link_id,) for _created_at, link_id in self.links.committed]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+def test_sync_picks_up_links_committed_out_of_order():
+    links = FakeLinks()
+    links.committed.append((links.now, 'old001'))
+    link_filter = LinkFilter(links.connect, sync_interval=0, sync_overlap=60)
+    link_filter._rebuild()
+    assert link_filter.might_exist('old001')
+
+    # A slow transaction starts (created_at = its start) while a later one commits first
+    slow_started = links.now + timedelta(seconds=1)
+    links.now += timedelta(seconds=2)
+    links.committed.append((links.now, 'fast01'))
+    links.now += timedelta(seconds=1)
+    assert link_filter.might_exist('fast01')
+
+    # The slow transaction commits after fast01 was synced: still found by the next sync
+    links.now += timedelta(seconds=10)
+    links.committed.append((slow_started, 'slow01'))
+    assert link_filter.might_exist('slow01')
+    assert not link_filter.might_exist('nope00')
+    assert link_filter.stats()['links'] == 3
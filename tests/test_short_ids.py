@@ -0,0 +1,47 @@
+"""Keyed Feistel permutation and base62 encoding of link_ids"""
+
+import pytest
+
+from short_ids import BASE62, HALF_BITS, ID_LENGTH, FeistelPermutation, encode_base62
+
+SPACE = 1 << (2 * HALF_BITS)
+
+
+@pytest.fixture
+def permutation():
+    return FeistelPermutation('test-key')
+
+
+def test_permutation_is_invertible(permutation):
+    for value in list(range(1000)) + [SPACE - 1, SPACE // 2, 123456789]:
+        permuted = permutation.permute(value)
+        assert 0 <= permuted < SPACE
+        assert permutation.invert(permuted) == value
+
+
+def test_no_collisions_across_a_block(permutation):
+    # A few sequence blocks, consecutive values as the allocator hands them out
+    values = range(1, 20001)
+    ids = {encode_base62(permutation.permute(value)) for value in values}
+    assert len(ids) == len(values)
+    assert all(len(link_id) == ID_LENGTH and set(link_id) <= set(BASE62) for link_id in ids)
+
+
+def test_consecutive_values_are_unrelated(permutation):
+    ids = [permutation.permute(value) for value in range(100, 110)]
+    assert ids != sorted(ids)
+    assert all(abs(a - b) > 1 for a, b in zip(ids, ids[1:]))
+
+
+def test_key_changes_the_mapping(permutation):
+    other = FeistelPermutation('other-key')
+    assert [permutation.permute(v) for v in range(50)] != [other.permute(v) for v in range(50)]
+    assert FeistelPermutation(b'test-key').permute(42) == permutation.permute(42)
+
+
+def test_base62_bounds():
+    assert encode_base62(0) == '0' * ID_LENGTH
+    assert encode_base62(61) == '0' * (ID_LENGTH - 1) + 'z'
+    assert encode_base62(SPACE - 1)  # the whole permutation space fits in ID_LENGTH characters
+    with pytest.raises(ValueError):
+        encode_base62(62 ** ID_LENGTH)
@@ -0,0 +1,68 @@
+"""Timeline bucket parsing, boundaries and period limits"""
+
+import pytest
+
+from timeline import MAX_PERIODS, Bucket, resolve, timeline_query
+
+
+@pytest.mark.parametrize('spec, seconds', [
+    ('15m', 900), ('hour', 3600), ('1h', 3600), ('6h', 21600), ('day', 86400), ('week', 604800), ('2w', 1209600),
+])
+def test_bucket_sizes(spec, seconds):
+    assert Bucket(spec).seconds == seconds
+
+
+@pytest.mark.parametrize('spec', ['', '0h', '1y', 'h', '1.5h', '-1h', '1 h', None])
+def test_invalid_buckets(spec):
+    with pytest.raises(ValueError):
+        Bucket(spec)
+
+
+@pytest.mark.parametrize('spec, from_rollups, label', [
+    ('15m', False, 'YYYY-MM-DD HH24:MI'),
+    ('90m', False, 'YYYY-MM-DD HH24:MI'),
+    ('60m', True, 'YYYY-MM-DD HH24:00'),
+    ('6h', True, 'YYYY-MM-DD HH24:00'),
+    ('24h', True, 'YYYY-MM-DD'),
+    ('1w', True, 'YYYY-MM-DD'),
+])
+def test_whole_hours_read_the_rollups(spec, from_rollups, label):
+    bucket = Bucket(spec)
+    assert bucket.from_rollups is from_rollups
+    assert bucket.label_format == label
+
+
+def test_bucket_start_alignment():
+    # Single calendar units truncate, multiples floor from a fixed origin (Monday for weeks)
+    assert Bucket('hour').sql('ts') == "date_trunc('hour', ts)"
+    assert Bucket('1w').sql('ts') == "date_trunc('week', ts)"
+    assert "TIMESTAMP '1970-01-01'" in Bucket('15m').sql('ts') and '/ 900)' in Bucket('15m').sql('ts')
+    assert "TIMESTAMP '1970-01-05'" in Bucket('2w').sql('ts')
+
+
+def test_period_limit():
+    # 90 days: 13-minute buckets give 9969 periods, 12-minute ones 10800
+    assert 7776000 // 780 <= MAX_PERIODS < 7776000 // 720
+    assert resolve('all', '13m')[1].seconds == 780
+    with pytest.raises(ValueError):
+        resolve('all', '12m')
+    assert resolve('24h', '1m')[1].seconds == 60
+
+
+@pytest.mark.parametrize('time_range, interval, seconds', [
+    ('24h', '24 hours', 3600), ('7d', '7 days', 86400), ('30d', '30 days', 86400),
+    ('all', '90 days', 86400), ('unknown', '90 days', 86400),
+])
+def test_range_defaults(time_range, interval, seconds):
+    start_interval, bucket = resolve(time_range)
+    assert (start_interval, bucket.seconds) == (interval, seconds)
+
+
+def test_sources_follow_the_bucket():
+    query, params = timeline_query('7d', '6h', campaign='c1')
+    assert 'click_rollups_hourly' in query and 'FROM clicks' not in query
+    assert params == ['c1', 'c1']
+
+    query, params = timeline_query('24h', '15m', with_uniques=False)
+    assert 'FROM clicks' in query and 'NOT c.is_bot' in query and 'first_clicks' not in query
+    assert params == []
@@ -0,0 +1,151 @@
+"""
+Timeline
+Séries temporelles clics / visiteurs uniques en une seule passe groupée, pas de temps au choix
+"""
+
+import re
+
+# Default look-back and bucket for each dashboard range
+RANGES = {
+    '24h': ('24 hours', 'hour'),
+    '7d': ('7 days', 'day'),
+    '30d': ('30 days', 'day'),
+    'all': ('90 days', 'day'),
+}
+
+UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+ALIASES = {'hour': '1h', 'day': '1d', 'week': '1w'}
+MAX_PERIODS = 10000
+
+
+class Bucket:
+    """A bucket size such as 15m, 1h, 6h, 1d or 1w"""
+
+    def __init__(self, spec):
+        spec = ALIASES.get(spec, spec)
+        match = re.fullmatch(r'(\d+)([mhdw])', spec or '')
+        if not match or int(match.group(1)) == 0:
+            raise ValueError(f"Invalid bucket '{spec}' (examples: 15m, hour, 6h, day, week)")
+        self.count = int(match.group(1))
+        self.unit = match.group(2)
+        self.seconds = self.count * UNIT_SECONDS[self.unit]
+
+    @property
+    def from_rollups(self):
+        """Whole-hour buckets can be computed from the hourly rollups"""
+        return self.seconds % 3600 == 0
+
+    @property
+    def label_format(self):
+        if self.seconds % 86400 == 0:
+            return 'YYYY-MM-DD'
+        if self.seconds % 3600 == 0:
+            return 'YYYY-MM-DD HH24:00'
+        return 'YYYY-MM-DD HH24:MI'
+
+    def sql(self, expr):
+        """SQL expression flooring the timestamp `expr` to its bucket start"""
+        if self.count == 1 and self.unit != 'm':
+            field = {'h': 'hour', 'd': 'day', 'w': 'week'}[self.unit]
+            return f"date_trunc('{field}', {expr})"
+        # Weeks are aligned on Monday 1970-01-05, everything else on the epoch
+        origin = "TIMESTAMP '1970-01-05'" if self.unit == 'w' else "TIMESTAMP '1970-01-01'"
+        return (f"({origin} + FLOOR(EXTRACT(EPOCH FROM ({expr}) - {origin}) / {self.seconds})::float8"
+                f" * INTERVAL '{self.seconds} seconds')")
+
+
+def resolve(time_range, bucket_spec=None):
+    """(look-back interval, Bucket) for a range - raises ValueError on a bad bucket"""
+    if time_range not in RANGES:
+        time_range = 'all'
+    start_interval, default_bucket = RANGES[time_range]
+    bucket = Bucket(bucket_spec or default_bucket)
+
+    interval_seconds = {'24 hours': 86400, '7 days': 604800, '30 days': 2592000, '90 days': 7776000}[start_interval]
+    if interval_seconds // bucket.seconds > MAX_PERIODS:
+        raise ValueError(f"Bucket '{bucket_spec}' is too small for range '{time_range}' (max {MAX_PERIODS} periods)")
+    return start_interval, bucket
+
+
+def timeline_query(time_range, bucket_spec=None, campaign=None, with_uniques=True):
+    """SQL + params returning [{period, unique_visitors, total_clicks}] for the range
+
+    Clicks are bucketed once and joined to a generated series of periods,
+    so the cost is O(clicks in range + periods). Unique visitors are new
+    visitors: links counted in the period of their first click ever, read
+    from first_clicks. Whole-hour buckets read click_rollups_hourly; finer
+    ones (e.g. 15m) read clicks through idx_clicks_clicked_at.
+
+    Without uniques the rows carry `period_start` (the bucket start)
+    instead of unique_visitors, to be joined with sketch estimates.
+    """
+    start_interval, bucket = resolve(time_range, bucket_spec)
+
+    params = []
+    since = f"LOCALTIMESTAMP - INTERVAL '{start_interval}'"
+    if bucket.from_rollups:
+        source = f'''
+            SELECT r.link_id, r.bucket_hour AS ts, r.click_count AS n
+            FROM click_rollups_hourly r
+            WHERE r.bucket_hour >= date_trunc('hour', LOCALTIMESTAMP - INTERVAL '{start_interval}')
+        '''
+        if campaign:
+            source += ' AND r.campaign = %s'
+            params.append(campaign)
+    else:
+        source = f'''
+            SELECT c.link_id, c.clicked_at AS ts, 1 AS n
+            FROM clicks c
+            JOIN links l ON l.link_id = c.link_id
+            WHERE c.clicked_at >= LOCALTIMESTAMP - INTERVAL '{start_interval}' AND NOT c.is_bot
+        '''
+        if campaign:
+            source += ' AND l.campaign = %s'
+            params.append(campaign)
+
+    query = f'''
+        WITH time_series AS (
+            SELECT generate_series(
+                {bucket.sql(f"LOCALTIMESTAMP - INTERVAL '{start_interval}'")},
+                {bucket.sql('LOCALTIMESTAMP')},
+                INTERVAL '{bucket.seconds} seconds'
+            ) AS period_time
+        ),
+        filtered AS ({source}),
+        totals AS (
+            SELECT {bucket.sql('ts')} AS period_time, SUM(n) AS total_clicks
+            FROM filtered
+            GROUP BY 1
+        )'''
+    if with_uniques:
+        # Same start as the click source (top of the hour with the rollups)
+        uniques_since = f"date_trunc('hour', {since})" if bucket.from_rollups else since
+        query += f''',
+        uniques AS (
+            SELECT {bucket.sql('f.clicked_at')} AS period_time, COUNT(*) AS unique_visitors
+            FROM first_clicks f
+            WHERE f.clicked_at >= {uniques_since} {'AND f.campaign = %s' if campaign else ''}
+            GROUP BY 1
+        )
+        SELECT
+            TO_CHAR(ts.period_time, '{bucket.label_format}') as period,
+            COALESCE(u.unique_visitors, 0) as unique_visitors,
+            COALESCE(t.total_clicks, 0)::bigint as total_clicks
+        FROM time_series ts
+        LEFT JOIN uniques u ON u.period_time = ts.period_time
+        LEFT JOIN totals t ON t.period_time = ts.period_time
+        ORDER BY ts.period_time
+        '''
+        if campaign:
+            params.append(campaign)
+    else:
+        query += f'''
+        SELECT
+            TO_CHAR(ts.period_time, '{bucket.label_format}') as period,
+            ts.period_time as period_start,
+            COALESCE(t.total_clicks, 0)::bigint as total_clicks
+        FROM time_series ts
+        LEFT JOIN totals t ON t.period_time = ts.period_time
+        ORDER BY ts.period_time
+        '''
+    return query, params